@@ -1,21 +1,20 @@
 import os
-import requests
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, send_file, stream_with_context
 import sqlite3
-import csv
-import io
-from dotenv import load_dotenv
+import time
 from datetime import datetime, date
 import json
-from app import db, hlp, gc, dashboard, platform, prf 
+import asyncio
+from app import db, hlp, gc, dashboard, platform, prf, rsp, rev, mtr, sqt, ddp, pcg, phs, ucx, wrq, stg, shd, asv
 
 
-def create_app(db_path: str = "database.db") -> Flask:
+def create_app(db_path: str = None) -> Flask:
     """
     Factory function to create and configure the Flask application.
 
     Args:
-        db_path (str): Path to the SQLite database file.
+        db_path (str): Path to the SQLite database file, or a postgresql:// DSN.
+            Defaults to the DATABASE_URL environment variable, then database.db.
 
     Returns:
         Flask: Configured Flask application.
@@ -23,98 +22,90 @@ def create_app(db_path: str = "database.db") -> Flask:
     app = Flask(__name__, static_folder='static', template_folder='templates')
     # Secret key for session management. In production this should be a strong random value.
     app.config['SECRET_KEY'] = 'replace-this-with-a-secret-key'
-    app.config['DATABASE'] = os.path.join(os.path.dirname(__file__), db_path)
+    db_path = db_path or os.getenv('DATABASE_URL') or 'database.db'
+    app.config['DATABASE'] = db_path if stg.is_postgres(db_path) else os.path.join(os.path.dirname(__file__), db_path)
 
     # Configure upload folder for images
     upload_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
     os.makedirs(upload_folder, exist_ok=True)
     app.config['UPLOAD_FOLDER'] = upload_folder
-    # Initialize database on app creation
+    # Valutazione item: finestra degli snapshot e campioni minimi per usare i percentili reali
+    app.config.setdefault('VALUATION_SKETCH_DAYS', 365)
+    app.config.setdefault('VALUATION_MIN_SAMPLES', 5)
+    # Numero massimo di codici per /api/code-resolve/batch
+    app.config.setdefault('CODE_RESOLVE_MAX_BATCH', 500)
+    # JSON veloce (orjson se disponibile) e compressione gzip/br delle risposte grandi
+    rsp.install(app)
+    # Metriche per endpoint / SQL / provider esterni, esposte su /metrics
+    mtr.install(app)
+    # Slow query log (EXPLAIN QUERY PLAN) e rilevamento N+1 per richiesta
+    sqt.install(app)
+    # Scritture SQLite: commit per richiesta o, con WRITE_BEHIND, thread scrittore unico con commit di gruppo
+    wrq.install(app)
+    # Storico prezzi per item: scritture a blocchi e politica di downsampling/retention
+    phs.install(app)
+    # Sharding opzionale delle collezioni per utente (SHARD_COUNT file SQLite per gli items)
+    shd.install(app)
+    # View async degli stimatori (/api/*-estimate): attesa dei provider su event loop invece che su thread
+    asv.install(app)
+    # Initialize database on app creation (applies only the pending schema migrations)
     db.init_db(app.config['DATABASE'])
-    dashboard.ensure_finance_snapshots_table(app.config['DATABASE'])
   
 
     def estimate_valuation(item: sqlite3.Row) -> dict:
         """
-        Estimate a fair market value and price range for an item using a simple heuristic.
-        For this MVP, the function uses the purchase price or sale price as a base and applies
-        multipliers to derive a range. If both prices are missing or zero, returns None values.
+        Estimate a fair market value and price range for an item.
+        When the item is linked to the global catalog and its price snapshots carry enough raw
+        samples, fair value and p05/p95 are real percentiles from the merged quantile sketches
+        (hlp.price_percentiles), converted to the item currency. Otherwise the purchase or sale price is used as a base and
+        simple multipliers derive a range. If both prices are missing or zero, returns None values.
 
         Args:
             item (sqlite3.Row): The database row representing the item.
 
         Returns:
-            dict: A dictionary with keys fair_value, price_p05, price_p95 and valuation_date.
+            dict: A dictionary with keys fair_value, price_p05, price_p95, valuation_date and method.
         """
+        val_date = date.today().isoformat()
+        if item['global_id']:
+            conn = db.get_db_connection(app.config['DATABASE'])
+            pct = hlp.price_percentiles(conn.cursor(), item['global_id'], app.config['VALUATION_SKETCH_DAYS'],
+                                        currency=item['currency'] or 'EUR')
+            conn.close()
+            if pct['samples'] >= app.config['VALUATION_MIN_SAMPLES']:
+                return {
+                    'fair_value': pct['p50'],
+                    'price_p05': pct['p05'],
+                    'price_p95': pct['p95'],
+                    'valuation_date': val_date,
+                    'method': 'sketch',
+                    'samples': pct['samples'],
+                    'sources': pct['sources']
+                }
+        # No market data: fallback to sale_price or purchase_price
         base_price = None
-        # Normalize category to determine which services to query
         try:
-            cat = (item['category'] or '').lower()
+            if item['sale_price'] is not None and float(item['sale_price']) > 0:
+                base_price = float(item['sale_price'])
+            elif item['purchase_price'] is not None and float(item['purchase_price']) > 0:
+                base_price = float(item['purchase_price'])
         except Exception:
-            cat = ''
-        # Build a list of functions to query based on category
-        price_fetchers = []
-        if cat == 'trading card':
-            price_fetchers.extend([
-                get_tcgplayer_market_price,
-                get_justtcg_market_price
-            ])
-        # For video games and similar categories, try PriceCharting and eBay
-        if cat in ('videogames', 'video games', 'console', 'cd', 'vynil', 'music', 'other', 'action figure'):
-            price_fetchers.extend([
-                get_pricecharting_market_price,
-                get_ebay_market_price
-            ])
-        # As a catch-all, always append eBay as last resort if not already in list
-        if get_ebay_market_price not in price_fetchers:
-            price_fetchers.append(get_ebay_market_price)
-        # Attempt each fetcher until a price is found
-        for fetch_fn in price_fetchers:
-            try:
-                m_price = fetch_fn(item['name'])
-            except Exception:
-                m_price = None
-            if m_price:
-                base_price = m_price
-                break
-        # If still no external price, fallback to sale_price or purchase_price
-        if base_price is None:
-            try:
-                if item['sale_price'] is not None and float(item['sale_price']) > 0:
-                    base_price = float(item['sale_price'])
-                elif item['purchase_price'] is not None and float(item['purchase_price']) > 0:
-                    base_price = float(item['purchase_price'])
-            except Exception:
-                base_price = None
+            base_price = None
         if not base_price:
             return {
                 'fair_value': None,
                 'price_p05': None,
                 'price_p95': None,
-                'valuation_date': None
+                'valuation_date': None,
+                'method': None
             }
         # Apply simple multipliers to compute median and range
-        fair_value = base_price * 1.2  # assume 20% appreciation
-        price_p05 = base_price * 0.8  # -20% low estimate
-        price_p95 = base_price * 1.4  # +40% high estimate
-        # If we fetched market price from TCGPlayer, it's denominated in USD. Convert to the item's currency if known.
-        try:
-            if cat == 'trading card':
-                item_currency = item['currency']
-                if item_currency and item_currency.upper() != 'USD':
-                    # Convert each value from USD to the item's currency
-                    fair_value = hlp.convert_currency(fair_value, 'USD', item_currency)
-                    price_p05 = hlp.convert_currency(price_p05, 'USD', item_currency)
-                    price_p95 = hlp.convert_currency(price_p95, 'USD', item_currency)
-        except Exception:
-            # Ignore conversion errors and keep values in USD
-            pass
-        val_date = date.today().isoformat()
         return {
-            'fair_value': fair_value,
-            'price_p05': price_p05,
-            'price_p95': price_p95,
-            'valuation_date': val_date
+            'fair_value': base_price * 1.2,  # assume 20% appreciation
+            'price_p05': base_price * 0.8,   # -20% low estimate
+            'price_p95': base_price * 1.4,   # +40% high estimate
+            'valuation_date': val_date,
+            'method': 'heuristic'
         }
 
     # def compute_profile_stats(user: dict) -> dict:
@@ -222,14 +213,7 @@ def create_app(db_path: str = "database.db") -> Flask:
         """
         if not session.get('logged_in'):
             return render_template('login.html')
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        user_id = session.get('user_id')
-        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cur.fetchone()
-        conn.close()
-        user_dict = dict(user) if user else {}
-        return render_template('index.html', user=user_dict)
+        return render_template('index.html', user=ucx.current(app.config['DATABASE']))
 
     @app.route('/login', methods=['POST'])
     def login():
@@ -268,6 +252,15 @@ def create_app(db_path: str = "database.db") -> Flask:
         Returns 401 if user is not authenticated.
         """
         from functools import wraps
+        import inspect
+        if inspect.iscoroutinefunction(f):
+            # view async: il wrapper deve restare una coroutine (app.ensure_sync, pool async di asv.asgi)
+            @wraps(f)
+            async def decorated_async(*args, **kwargs):
+                if not session.get('logged_in'):
+                    return jsonify({'error': 'Unauthorized'}), 401
+                return await f(*args, **kwargs)
+            return decorated_async
         @wraps(f)
         def decorated(*args, **kwargs):
             if not session.get('logged_in'):
@@ -275,6 +268,101 @@ def create_app(db_path: str = "database.db") -> Flask:
             return f(*args, **kwargs)
         return decorated
 
+    def items_db(user_id=None) -> str:
+        """Database with the items of the given (default: logged in) user; the shared one without sharding."""
+        return shd.for_user(app.config['DATABASE'], user_id if user_id is not None else session.get('user_id'))
+
+    def fetch_item(db_string: str, item_id: int):
+        """Items row as a dict, or None. Blocking: the async estimators run it with asyncio.to_thread."""
+        conn = db.get_db_connection(db_string)
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    async def record_price(item: dict, source: str, stats: dict):
+        """Add an estimate to the item's price history, only for items owned by the logged in user."""
+        if item.get('user_id') == session.get('user_id'):
+            await asyncio.to_thread(phs.record, items_db(), item['id'], source, stats)
+
+    def serialize_item(item: sqlite3.Row) -> dict:
+        """
+        Convert an items row into the JSON shape used by the API, including the
+        derived time_in_collection and ROI fields.
+        """
+        info_links = []
+        if item['info_links']:
+            try:
+                info_links = json.loads(item['info_links']) if item['info_links'] else []
+            except Exception:
+                info_links = [] 
+        marketplace_links = [] 
+        if item['marketplace_links']:
+            try:
+                marketplace_links = json.loads(item['marketplace_links']) if item['marketplace_links'] else []
+            except Exception:
+                marketplace_links = [] 
+        # Compute derived fields
+        time_in_collection = None
+        roi = None
+        if item['purchase_date']:
+            try:
+                purchase_date = datetime.strptime(item['purchase_date'], '%Y-%m-%d').date()
+                if item['sale_date']:
+                    delta = datetime.strptime(item['sale_date'], '%Y-%m-%d').date() - purchase_date
+                else:
+                    delta = date.today() - purchase_date 
+                time_in_collection = delta.days
+            except ValueError:
+                time_in_collection = None
+        if item['purchase_price'] and item['sale_price'] and item['purchase_price'] != 0:
+            try:
+                roi = (item['sale_price'] - item['purchase_price']) / item['purchase_price']
+            except Exception:
+                roi = None
+        # Estimate valuation for this item
+        # valuation = estimate_valuation(item)
+        valuation = {
+            'fair_value' : 0,
+            'price_p05': 0,
+            'price_p95': 0,
+            'valuation_date': 0
+        }
+        try:
+            mp = json.loads(item['market_params']) if item['market_params'] else None
+        except Exception:
+            mp = item['market_params']  # se è già dict o è stringa non-JSON
+
+        return {
+            'id': item['id'],
+            'name': item['name'],
+            'description': item['description'],
+            'language': item['language'],
+            'category': item['category'],
+            'market_params': mp,
+            'purchase_price': item['purchase_price'],
+            'purchase_price_curr_ref': item['purchase_price_curr_ref'],
+            'purchase_date': item['purchase_date'],
+            'sale_price': item['sale_price'],
+            'sale_date': item['sale_date'],
+            'marketplace_links': marketplace_links,
+            'info_links': info_links,
+            'tags': item['tags'],
+            'image_path': item['image_path'],
+            'quantity': item['quantity'],
+            'condition': item['condition'],
+            'currency': item['currency'],
+            'time_in_collection': time_in_collection,
+            'roi': roi,
+            'fair_value': valuation.get('fair_value'),
+            'price_p05': valuation.get('price_p05'),
+            'price_p95': valuation.get('price_p95'),
+            'valuation_date': valuation.get('valuation_date')
+        }
+
     @app.route('/api/items', methods=['GET'])
     @require_login
     def get_items():
@@ -292,15 +380,23 @@ def create_app(db_path: str = "database.db") -> Flask:
         tags_filter = [t.strip() for t in tags_param.split(',') if t.strip()] if tags_param else []
         # Only retrieve items belonging to the logged-in user
         user_id = session.get('user_id')
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        if user_id is not None:
-            cur.execute("SELECT * FROM items WHERE user_id = ?", (user_id,))
-        else:
+        if user_id is None:
             # In the unlikely case there is no user_id, return empty list
-            items = []
-            conn.close()
             return jsonify([])
+        conn = db.get_db_connection(items_db())
+        cur = conn.cursor()
+        # Conditional GET: se la revisione della collezione non è cambiata rispondi 304
+        # senza leggere la tabella items
+        etag = rev.items_etag(user_id, rev.current(cur, user_id), request.args, rsp.negotiated_mimetype())
+        matched = rsp.matching_etag(etag)
+        if matched:
+            conn.close()
+            resp = app.response_class(status=304)
+            resp.set_etag(matched)
+            resp.vary.update(('Accept', 'Accept-Encoding'))
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        cur.execute("SELECT * FROM items WHERE user_id = ?", (user_id,))
         items = cur.fetchall()
         conn.close()
         result = []
@@ -313,76 +409,52 @@ def create_app(db_path: str = "database.db") -> Flask:
             item_tags = [t.strip().lower() for t in (item['tags'] or '').split(',') if t.strip()]
             if tags_filter and not all(tag in item_tags for tag in tags_filter):
                 continue
-            info_links = []
-            if item['info_links']:
-                try:
-                    info_links = json.loads(item['info_links']) if item['info_links'] else []
-                except Exception:
-                    info_links = [] 
-            marketplace_links = [] 
-            if item['marketplace_links']:
-                try:
-                    marketplace_links = json.loads(item['marketplace_links']) if item['marketplace_links'] else []
-                except Exception:
-                    marketplace_links = [] 
-            # Compute derived fields
-            time_in_collection = None
-            roi = None
-            if item['purchase_date']:
-                try:
-                    purchase_date = datetime.strptime(item['purchase_date'], '%Y-%m-%d').date()
-                    if item['sale_date']:
-                        delta = datetime.strptime(item['sale_date'], '%Y-%m-%d').date() - purchase_date
-                    else:
-                        delta = date.today() - purchase_date 
-                    time_in_collection = delta.days
-                except ValueError:
-                    time_in_collection = None
-            if item['purchase_price'] and item['sale_price'] and item['purchase_price'] != 0:
-                try:
-                    roi = (item['sale_price'] - item['purchase_price']) / item['purchase_price']
-                except Exception:
-                    roi = None
-            # Estimate valuation for this item
-            # valuation = estimate_valuation(item)
-            valuation = {
-                'fair_value' : 0,
-                'price_p05': 0,
-                'price_p95': 0,
-                'valuation_date': 0
-            }
-            try:
-                mp = json.loads(item['market_params']) if item['market_params'] else None
-            except Exception:
-                mp = item['market_params']  # se è già dict o è stringa non-JSON
-
-            result.append({
-                'id': item['id'],
-                'name': item['name'],
-                'description': item['description'],
-                'language': item['language'],
-                'category': item['category'],
-                'market_params': mp,
-                'purchase_price': item['purchase_price'],
-                'purchase_price_curr_ref': item['purchase_price_curr_ref'],
-                'purchase_date': item['purchase_date'],
-                'sale_price': item['sale_price'],
-                'sale_date': item['sale_date'],
-                'marketplace_links': marketplace_links,
-                'info_links': info_links,
-                'tags': item['tags'],
-                'image_path': item['image_path'],
-                'quantity': item['quantity'],
-                'condition': item['condition'],
-                'currency': item['currency'],
-                'time_in_collection': time_in_collection,
-                'roi': roi,
-                'fair_value': valuation.get('fair_value'),
-                'price_p05': valuation.get('price_p05'),
-                'price_p95': valuation.get('price_p95'),
-                'valuation_date': valuation.get('valuation_date')
-            })
-        return jsonify(result)
+            result.append(serialize_item(item))
+        resp = rsp.negotiate(result)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
+
+    @app.route('/api/items/changes', methods=['GET'])
+    @require_login
+    def get_item_changes():
+        """
+        Incremental sync of the user's items.
+        Query parameters:
+            since: revision already known by the client (0 or missing = full sync)
+        Returns the current revision, the items created or updated after `since`
+        and the ids of the items deleted after `since` (tombstones).
+        """
+        since = request.args.get('since', 0, type=int) or 0
+        user_id = session.get('user_id')
+        conn = db.get_db_connection(items_db())
+        cur = conn.cursor()
+        current = rev.current(cur, user_id)
+        full = since <= 0 or since > current
+        if full:
+            cur.execute("SELECT * FROM items WHERE user_id = ?", (user_id,))
+            rows = cur.fetchall()
+            deleted = []
+        else:
+            upserted, deleted = rev.changes_since(cur, user_id, since)
+            rows = []
+            # IN (...) a blocchi per restare sotto il limite di parametri di SQLite
+            for i in range(0, len(upserted), 500):
+                chunk = upserted[i:i + 500]
+                cur.execute(
+                    f"SELECT * FROM items WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                    [user_id] + chunk
+                )
+                rows.extend(cur.fetchall())
+        conn.close()
+        return rsp.negotiate({
+            'rev': current,
+            'since': since,
+            'full': full,
+            'as_of': date.today().isoformat(),
+            'items': [serialize_item(item) for item in rows],
+            'deleted': deleted
+        })
 
     @app.route('/api/items', methods=['POST'])
     @require_login
@@ -418,15 +490,7 @@ def create_app(db_path: str = "database.db") -> Flask:
             # Only compute if not provided explicitly and conversion parameters exist
             if purchase_price_curr_ref is None:
                 # Fetch the user's reference currency
-                user_id = session.get('user_id')
-                user_ref = None
-                if user_id:
-                    conn = db.get_db_connection(app.config['DATABASE'])
-                    ccur = conn.cursor()
-                    ccur.execute("SELECT ref_currency FROM users WHERE id = ?", (user_id,))
-                    row = ccur.fetchone()
-                    conn.close()
-                    user_ref = row['ref_currency'] if row else None
+                user_ref = ucx.current(app.config['DATABASE']).get('ref_currency')
                 if purchase_price is not None and currency and user_ref:
                     purchase_price_curr_ref = hlp.convert_currency(float(purchase_price), currency, user_ref)
         except Exception:
@@ -434,15 +498,15 @@ def create_app(db_path: str = "database.db") -> Flask:
             purchase_price_curr_ref = None
         # Insert a new item associated with the current user. The image_path is stored as NULL on creation.
         user_id = session.get('user_id')
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute(
+        def insert(cur):
+            cur.execute(
             """
             INSERT INTO items (
                 user_id, name, description, category, purchase_price, purchase_price_curr_ref, purchase_date,
                 sale_price, sale_date, marketplace_links, info_links, tags, image_path, quantity, condition, currency, language,market_params
             )
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
             """,
             (
                 user_id,
@@ -464,10 +528,11 @@ def create_app(db_path: str = "database.db") -> Flask:
                 language,
                 json.dumps(data.get('market_params') if isinstance(data.get('market_params'), dict) else (json.loads(data.get('market_params')) if data.get('market_params') else None))
             )
-        )
-        conn.commit()
-        item_id = cur.lastrowid
-        conn.close()
+            )
+            item_id = cur.fetchone()[0]
+            rev.bump(cur, user_id, item_id)
+            return item_id
+        item_id = wrq.run(items_db(), insert)
         return jsonify({'id': item_id}), 201
 
 
@@ -512,15 +577,7 @@ def create_app(db_path: str = "database.db") -> Flask:
                 cat = mapping.get('category')
                 if mapping.get('purchase_price_curr_ref') is None and mapping.get('purchase_price') is not None:
                     # fetch user's reference currency
-                    user_ref = None
-                    user_id_ses = session.get('user_id')
-                    if user_id_ses:
-                        conn_ref = db.get_db_connection(app.config['DATABASE'])
-                        cur_ref = conn_ref.cursor()
-                        cur_ref.execute("SELECT ref_currency FROM users WHERE id = ?", (user_id_ses,))
-                        row_ref = cur_ref.fetchone()
-                        conn_ref.close()
-                        user_ref = row_ref['ref_currency'] if row_ref else None
+                    user_ref = ucx.current(app.config['DATABASE']).get('ref_currency')
                     if user_ref and mapping.get('currency'):
                         mapping['purchase_price_curr_ref'] = hlp.convert_currency(mapping['purchase_price'], mapping.get('currency'), user_ref)
                     else:
@@ -551,15 +608,15 @@ def create_app(db_path: str = "database.db") -> Flask:
             # Ensure only the owner can update the item
             user_id_ses = session.get('user_id')
             values.append(user_id_ses)
-            conn = db.get_db_connection(app.config['DATABASE'])
-            cur = conn.cursor()
-            cur.execute(f"UPDATE items SET {', '.join(fields)} WHERE id = ? AND user_id = ?", values)
-            if cur.rowcount == 0:
+            def update(cur):
+                cur.execute(f"UPDATE items SET {', '.join(fields)} WHERE id = ? AND user_id = ?", values)
+                if cur.rowcount == 0:
+                    return False
+                rev.bump(cur, user_id_ses, item_id)
+                return True
+            if not wrq.run(items_db(), update):
                 # No rows updated implies item does not belong to user or does not exist
-                conn.close()
                 return jsonify({'error': 'Item not found or unauthorized'}), 404
-            conn.commit()
-            conn.close()
             return jsonify({'message': 'Item updated'})
         else:
             data = request.get_json() or {}
@@ -575,15 +632,7 @@ def create_app(db_path: str = "database.db") -> Flask:
             # If purchase_price changes and no converted price provided, compute automatically
             try:
                 if ('purchase_price_curr_ref' not in data or data.get('purchase_price_curr_ref') is None) and data.get('purchase_price') is not None:
-                    user_ref = None
-                    user_id_ses = session.get('user_id')
-                    if user_id_ses:
-                        conn_ref = db.get_db_connection(app.config['DATABASE'])
-                        c_ref = conn_ref.cursor()
-                        c_ref.execute("SELECT ref_currency FROM users WHERE id = ?", (user_id_ses,))
-                        row_ref = c_ref.fetchone()
-                        conn_ref.close()
-                        user_ref = row_ref['ref_currency'] if row_ref else None
+                    user_ref = ucx.current(app.config['DATABASE']).get('ref_currency')
                     if user_ref and data.get('currency'):
                         conv_val = hlp.convert_currency(float(data['purchase_price']), data.get('currency'), user_ref)
                         fields.append("purchase_price_curr_ref = ?")
@@ -602,14 +651,15 @@ def create_app(db_path: str = "database.db") -> Flask:
             values.append(item_id)
             user_id_ses = session.get('user_id')
             values.append(user_id_ses)
-            conn = db.get_db_connection(app.config['DATABASE'])
-            cur = conn.cursor()
-            cur.execute(f"UPDATE items SET {', '.join(fields)} WHERE id = ? AND user_id = ?", values)
-            if cur.rowcount == 0:
-                conn.close()
+            def update(cur):
+                cur.execute(f"UPDATE items SET {', '.join(fields)} WHERE id = ? AND user_id = ?", values)
+                if cur.rowcount == 0:
+                    return False
+                rev.bump(cur, user_id_ses, item_id)
+                return True
+            if not wrq.run(items_db(), update):
+                # No rows updated implies item does not belong to user or does not exist
                 return jsonify({'error': 'Item not found or unauthorized'}), 404
-            conn.commit()
-            conn.close()
             return jsonify({'message': 'Item updated'})
 
     @app.route('/api/items/<int:item_id>', methods=['DELETE'])
@@ -620,14 +670,14 @@ def create_app(db_path: str = "database.db") -> Flask:
         """
         # Delete only if the item belongs to the current user
         user_id = session.get('user_id')
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("DELETE FROM items WHERE id = ? AND user_id = ?", (item_id, user_id))
-        if cur.rowcount == 0:
-            conn.close()
+        def delete(cur):
+            cur.execute("DELETE FROM items WHERE id = ? AND user_id = ?", (item_id, user_id))
+            if cur.rowcount == 0:
+                return False
+            rev.bump(cur, user_id, item_id, 'delete')
+            return True
+        if not wrq.run(items_db(), delete):
             return jsonify({'error': 'Item not found or unauthorized'}), 404
-        conn.commit()
-        conn.close()
         return jsonify({'message': 'Item deleted'})
 
     @app.route('/api/convert')
@@ -661,14 +711,10 @@ def create_app(db_path: str = "database.db") -> Flask:
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'error': 'Unauthorized'}), 401
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT id, username, nickname, ref_currency, theme, item_view_mode FROM users WHERE id = ?", (user_id,))
-        user = cur.fetchone()
-        conn.close()
+        user = ucx.current(app.config['DATABASE'])
         if user:
             # Return user info as dict
-            return jsonify({k: user[k] for k in user.keys()})
+            return jsonify({k: user.get(k) for k in ('id', 'username', 'nickname', 'ref_currency', 'theme', 'item_view_mode')})
         return jsonify({'error': 'User not found'}), 404
 
     @app.route('/api/profile/stats', methods=['GET'])
@@ -692,15 +738,14 @@ def create_app(db_path: str = "database.db") -> Flask:
         user_id = session.get('user_id')
         if user_id is None:
             return jsonify({'error': 'Unauthorized'}), 401
-        conn = db.get_db_connection(app.config['DATABASE'])
+        conn = db.get_db_connection(items_db())
         cur = conn.cursor()
         cur.execute("SELECT * FROM items WHERE id = ? AND user_id = ?", (item_id, user_id))
         item = cur.fetchone()
         conn.close()
         if not item:
             return jsonify({'error': 'Item not found'}), 404
-        valuation = estimate_valuation2(item)
-        # valuation = estimate_valuation(item)
+        valuation = estimate_valuation(item)
         # Include the item's currency for clarity
         valuation['currency'] = item['currency']
         return jsonify(valuation)
@@ -792,14 +837,14 @@ def create_app(db_path: str = "database.db") -> Flask:
         cur = conn.cursor()
         try:
             cur.execute(
-                "INSERT INTO users (username, password, nickname, ref_currency) VALUES (?, ?, ?, ?)",
+                "INSERT INTO users (username, password, nickname, ref_currency) VALUES (?, ?, ?, ?) RETURNING id",
                 (username, password, nickname, ref_currency)
             )
+            user_id = cur.fetchone()[0]
             conn.commit()
-            user_id = cur.lastrowid
             conn.close()
             return jsonify({'id': user_id}), 201
-        except sqlite3.IntegrityError:
+        except db.IntegrityError:
             conn.close()
             return jsonify({'error': 'Username already exists'}), 400
 
@@ -836,10 +881,11 @@ def create_app(db_path: str = "database.db") -> Flask:
             if cur.rowcount == 0:
                 conn.close()
                 return jsonify({'error': 'User not found'}), 404
+            ucx.invalidate(app.config['DATABASE'], uid, cur)
             conn.commit()
             conn.close()
             return jsonify({'message': 'User updated'})
-        except sqlite3.IntegrityError:
+        except db.IntegrityError:
             conn.close()
             return jsonify({'error': 'Username already exists'}), 400
 
@@ -859,13 +905,106 @@ def create_app(db_path: str = "database.db") -> Flask:
         cur = conn.cursor()
         # Delete user and cascade delete items
         cur.execute("DELETE FROM users WHERE id = ?", (uid,))
-        # Also delete items belonging to this user
-        cur.execute("DELETE FROM items WHERE user_id = ?", (uid,))
+        # Also delete items belonging to this user (in the user's shard when sharding is on)
+        iconn = conn if items_db(uid) == app.config['DATABASE'] else db.get_db_connection(items_db(uid))
+        icur = iconn.cursor()
+        icur.execute("DELETE FROM items WHERE user_id = ?", (uid,))
+        icur.execute("DELETE FROM item_revisions WHERE user_id = ?", (uid,))
+        icur.execute("DELETE FROM item_changes WHERE user_id = ?", (uid,))
+        if iconn is not conn:
+            iconn.commit()
+            iconn.close()
         conn.commit()
         conn.close()
+        ucx.invalidate(app.config['DATABASE'], uid)
         return jsonify({'message': 'User deleted'})
 
 
+    @app.route('/api/admin/catalog/dedupe', methods=['POST'])
+    @require_login
+    @require_admin
+    def admin_catalog_dedupe():
+        """
+        Run the near-duplicate detection over the global catalog (MinHash/LSH, see ddp.find_duplicates)
+        and store the candidate pairs. Optional JSON body: min_score, category.
+        """
+        data = request.get_json(silent=True) or {}
+        kwargs = {'category': data.get('category') or None}
+        if data.get('min_score') is not None:
+            try:
+                kwargs['min_score'] = float(data['min_score'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid min_score'}), 400
+        summary = ddp.find_duplicates(app.config['DATABASE'], **kwargs)
+        return jsonify(summary), 200
+
+    @app.route('/api/admin/catalog/duplicates', methods=['GET'])
+    @require_login
+    @require_admin
+    def admin_catalog_duplicates():
+        """List candidate duplicate pairs, best score first (?status=open|dismissed|merged&limit=100)."""
+        status = request.args.get('status') or 'open'
+        limit = max(1, min(1000, request.args.get('limit', default=100, type=int)))
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
+        rows = ddp.list_candidates(cur, status, limit, app.config['DATABASE'])
+        conn.close()
+        return jsonify(rows), 200
+
+    @app.route('/api/admin/catalog/duplicates/<int:a_id>/<int:b_id>/dismiss', methods=['POST'])
+    @require_login
+    @require_admin
+    def admin_catalog_dismiss(a_id: int, b_id: int):
+        """Mark a candidate pair as not duplicate: it will not be proposed again."""
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
+        found = ddp.dismiss(cur, a_id, b_id)
+        conn.commit(); conn.close()
+        if not found:
+            return jsonify({'error': 'Candidate not found'}), 404
+        return jsonify({'message': 'Dismissed'}), 200
+
+    @app.route('/api/admin/catalog/merge', methods=['POST'])
+    @require_login
+    @require_admin
+    def admin_catalog_merge():
+        """
+        Merge global catalog entries: JSON body {keep_id, merge_ids: [...]}. Items, price history
+        and identifiers of the merged entries are re-pointed to keep_id in one transaction.
+        """
+        data = request.get_json(silent=True) or {}
+        try:
+            keep_id = int(data['keep_id'])
+            merge_ids = [int(m) for m in data.get('merge_ids') or []]
+            result = ddp.merge(app.config['DATABASE'], keep_id, merge_ids)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid request: {e}'}), 400
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        return jsonify(result), 200
+
+    @app.route('/api/admin/pricecharting/import', methods=['POST'])
+    @require_login
+    @require_admin
+    def admin_pricecharting_import():
+        """
+        Import a PriceCharting price guide CSV into the local table used by the estimators.
+        Multipart upload (field 'file') or JSON body {path} of a .csv/.csv.gz readable by the server.
+        """
+        upload = request.files.get('file')
+        data = request.get_json(silent=True) or {}
+        try:
+            if upload:
+                summary = pcg.import_csv(app.config['DATABASE'], upload.stream)
+            elif data.get('path'):
+                summary = pcg.import_csv(app.config['DATABASE'], data['path'])
+            else:
+                return jsonify({'error': 'Missing file or path'}), 400
+        except OSError as e:
+            return jsonify({'error': f'Cannot read CSV: {e}'}), 400
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(summary), 200
+
+
     @app.route('/api/export/csv', methods=['GET'])
     @require_login
     def export_csv():
@@ -873,12 +1012,13 @@ def create_app(db_path: str = "database.db") -> Flask:
         Export all items as a CSV file. Optional query parameters for filters similar to get_items.
         Returns a downloadable CSV file.
         """
+        import csv, io
         # Reuse get_items filtering logic
         query = request.args.get('q', '', type=str).strip().lower()
         category = request.args.get('category', '', type=str).strip().lower()
         tags_param = request.args.get('tags', '', type=str).strip().lower()
         tags_filter = [t.strip() for t in tags_param.split(',') if t.strip()] if tags_param else []
-        conn = db.get_db_connection(app.config['DATABASE'])
+        conn = db.get_db_connection(items_db())
         cur = conn.cursor()
         # Filter items by logged-in user
         user_id = session.get('user_id')
@@ -922,7 +1062,7 @@ def create_app(db_path: str = "database.db") -> Flask:
             writer.writerow([
                 item['id'], item['name'], item['description'], item['language'], item['category'],
                 item['purchase_price'], item['purchase_price_curr_ref'], item['currency'], item['purchase_date'], item['sale_price'], item['sale_date'],
-                item['marketplace_link'], item['tags'], item['image_path'], item['quantity'], item['condition'],
+                item['marketplace_links'], item['tags'], item['image_path'], item['quantity'], item['condition'],
                 time_in_collection, roi
             ])
         output.seek(0)
@@ -949,13 +1089,7 @@ def create_app(db_path: str = "database.db") -> Flask:
         Display the home page for the logged-in user. This shows a summary
         of collection statistics similar to the profile page without the edit form.
         """
-        user_id = session.get('user_id')
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cur.fetchone()
-        conn.close()
-        user_dict = dict(user) if user else {}
+        user_dict = ucx.current(app.config['DATABASE'])
         stats = prf.compute_profile_stats(app.config['DATABASE'],app.config['UPLOAD_FOLDER'],user_dict)
         return render_template('home.html', user=user_dict, stats=stats)
 
@@ -967,19 +1101,14 @@ def create_app(db_path: str = "database.db") -> Flask:
 
     @app.route('/api/ebay-estimate')
     @require_login
-    def ebay_estimate():
+    async def ebay_estimate():
         item_id = request.args.get('item_id', type=int)
         if not item_id:
             return jsonify({'error': 'Missing item_id'}), 400
 
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
+        item = await asyncio.to_thread(fetch_item, items_db(), item_id)
+        if item is None:
             return jsonify({'error': 'Item not found'}), 404
-        item = dict(row)
 
         parts = [item.get('name') or '']
         if item.get('language'): parts.append(item['language'])
@@ -987,7 +1116,7 @@ def create_app(db_path: str = "database.db") -> Flask:
         if item.get('condition'): parts.append(item['condition'])
         keywords = " ".join([p for p in parts if p]).strip() or "collectible"
 
-        import requests, statistics, os as _os, datetime as _dt
+        import statistics, os as _os, datetime as _dt
         EBAY_APP_ID = os.environ.get("EBAY_CLIENT_ID")
         site_id = _os.getenv('EBAY_SITE_ID', '101')
 
@@ -1003,13 +1132,13 @@ def create_app(db_path: str = "database.db") -> Flask:
             'itemFilter(0).value': 'true',
             'siteid': site_id,
         }
-        url = 'https://svcs.ebay.com/services/search/FindingService/v1'
+        url = hlp.provider_base('ebay')
         result = {'source':'eBay Finding API - findCompletedItems','query':{'url':url,'params':payload},'stats':None,'samples':[]}
 
         try:
             if not EBAY_APP_ID:
                 raise RuntimeError('Missing EBAY_APP_ID')
-            r = requests.get(url, params=payload, timeout=8)
+            r = await asv.http_get('ebay', url, params=payload, timeout=8)
             r.raise_for_status()
             data = r.json()
             items = (((data or {}).get('findCompletedItemsResponse') or [{}])[0].get('searchResult') or [{}])[0].get('item', [])
@@ -1046,10 +1175,11 @@ def create_app(db_path: str = "database.db") -> Flask:
 
             result['stats'] = stats
             result['samples'] = samples
-            conn.close()
+            await record_price(item, 'ebay', stats)
             return jsonify(result), 200
 
         except Exception:
+            mtr.count_fallback('ebay')
             base_val = float(item.get('purchase_price') or 0) or 50.0
             est = base_val * 1.1
             today = _dt.date.today().isoformat()
@@ -1057,48 +1187,85 @@ def create_app(db_path: str = "database.db") -> Flask:
             result['stats'] = stats
             return jsonify(result), 200
 
+    def price_history_response(item_id: int, source: str = None):
+        since = request.args.get('since')
+        try:
+            if since:
+                date.fromisoformat(since)
+        except ValueError:
+            return jsonify({'error': 'Invalid since (YYYY-MM-DD)'}), 400
+        phs.flush(items_db())
+        conn = db.get_db_connection(items_db())
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM items WHERE id = ? AND user_id = ?", (item_id, session.get('user_id')))
+        if cur.fetchone() is None:
+            conn.close()
+            return jsonify({'error': 'Item not found'}), 404
+        rows = phs.history(cur, item_id, source, since)
+        conn.close()
+        return rsp.negotiate(rows)
+
     @app.route('/api/ebay-history')
     @require_login
     def ebay_history():
         item_id = request.args.get('item_id', type=int)
         if not item_id:
             return jsonify({'error':'Missing item_id'}), 400
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT date, avg, median, min, max, count, currency, keywords FROM ebay_price_history WHERE item_id = ? ORDER BY date ASC", (item_id,))
-        rows = cur.fetchall(); conn.close()
-        return jsonify([dict(r) for r in rows]), 200
+        return price_history_response(item_id, 'ebay')
+
+    @app.route('/api/items/<int:item_id>/price-history')
+    @require_login
+    def item_price_history(item_id: int):
+        """Daily (then weekly/monthly) estimate history of an item, optionally ?source=ebay&since=YYYY-MM-DD."""
+        return price_history_response(item_id, request.args.get('source') or None)
 
     @app.route('/api/pricecharting-estimate')
     @require_login
-    def pricecharting_estimate():
-        """Estimate from PriceCharting Prices API using /api/product with q.
+    async def pricecharting_estimate():
+        """Estimate from the local PriceCharting price guide (CSV import, see pcg) or, on a miss,
+        from the Prices API using /api/product with q.
         Env: PRICECHARTING_TOKEN or PRICECHARTING_T
         """
         item_id = request.args.get('item_id', type=int)
         if not item_id:
             return jsonify({'error':'Missing item_id'}), 400
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
-        row = cur.fetchone(); conn.close()
-        if not row: return jsonify({'error':'Item not found'}), 404
-        item = dict(row)
+        def load(db_string):
+            conn = db.get_db_connection(db_string)
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None, None
+                item = dict(row)
+                # Prima la price guide importata in locale (pcg.import_csv): nessuna chiamata di rete
+                return item, pcg.find_for_item(cur, item.get('market_params'), item.get('name'))
+            finally:
+                conn.close()
+
+        item, local = await asyncio.to_thread(load, items_db())
+        if item is None:
+            return jsonify({'error':'Item not found'}), 404
         #parts = [item.get('name').split() or '']
         #if item.get('category'): parts.append(item['category'])
         #if item.get('language'): parts.append(item['language'])
         #if item.get('condition'): parts.append(item['condition'])
         #q = " ".join([p for p in parts if p]).strip() or "mario"
         q = " ".join(item.get('name').split()[0:3]) or item.get('name')
-        import os, requests
+        import os
         token = os.getenv('PRICECHARTING_TOKEN') or os.getenv('PRICECHARTING_T')
-        url = "https://www.pricecharting.com/api/product"
+        url = f"{hlp.provider_base('pricecharting')}/product"
         params = {'t': token or '', 'q': q}
         result = {'source':'PriceCharting Prices API - /api/product','query':{'url':url,'params':{'t':('***' if token else ''),'q':q}},'product':None,'prices':None}
         try:
-            if not token: raise RuntimeError('Missing PRICECHARTING_TOKEN')
-            r = requests.get(url, params=params, timeout=8); r.raise_for_status(); data = r.json()
-            if data.get('status') != 'success': raise RuntimeError(data.get('error-message') or 'API error')
+            if local:
+                data = pcg.as_api(local[0])
+                result['source'] = 'PriceCharting price guide (local CSV import)'
+                result['query'] = {'match': local[1], 'id': local[0]['id'], 'imported_at': local[0]['imported_at']}
+            else:
+                if not token: raise RuntimeError('Missing PRICECHARTING_TOKEN')
+                r = await asv.http_get('pricecharting', url, params=params, timeout=8); r.raise_for_status(); data = r.json()
+                if data.get('status') != 'success': raise RuntimeError(data.get('error-message') or 'API error')
             def cents(x):
                 try: return round(int(x)/100.0,2)
                 except: return None
@@ -1114,15 +1281,21 @@ def create_app(db_path: str = "database.db") -> Flask:
             }
             result['product'] = product
             result['prices'] = prices
+            vals = [v for v in (prices['loose'], prices['cib'], prices['new']) if v is not None]
+            if vals:
+                await record_price(item, 'pricecharting',
+                                   {'count': len(vals), 'avg': round(sum(vals) / len(vals), 2), 'median': prices['loose'] if prices['loose'] is not None else vals[0],
+                                    'min': min(vals), 'max': max(vals), 'currency': 'USD'})
             return jsonify(result), 200
         except Exception as e:
+            mtr.count_fallback('pricecharting')
             base_val = float(item.get('purchase_price') or 0) or None
             result['prices'] = {'loose': base_val, 'currency': item.get('currency') or 'EUR', 'stub': True}
             return jsonify(result), 200
 
     @app.route('/api/discogs-estimate')
     @require_login
-    def discogs_estimate():
+    async def discogs_estimate():
         """
         Stima Discogs per un item:
         - Se presente discogs_release_id in market_params → lookup diretto
@@ -1131,6 +1304,11 @@ def create_app(db_path: str = "database.db") -> Flask:
             /marketplace/price_suggestions/{release_id}  → suggerimenti per condizione (avg/median/min/max)
             /marketplace/stats/{release_id}              → num_for_sale, lowest_price, ecc.
         - Ritorna: source, query, release scelto, suggestions, stats (prezzi), market_stats (annunci attivi)
+
+        La risoluzione ricerca → release (e i dati della release) è in cache su provider_resolution_cache
+        per DISCOGS_RELEASE_CACHE_DAYS giorni; l'id scelto dalla ricerca viene salvato nei market_params
+        dell'item. price_suggestions e stats partono in parallelo: a cache calda una stima costa un solo
+        round trip verso Discogs.
         """
         import os, json, requests, statistics as _st
 
@@ -1139,20 +1317,10 @@ def create_app(db_path: str = "database.db") -> Flask:
             return jsonify({'error': 'Missing item_id'}), 400
 
         # --- carica item ---
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
+        item = await asyncio.to_thread(fetch_item, items_db(), item_id)
+        if item is None:
             return jsonify({'error': 'Item not found'}), 404
 
-        # sqlite Row → dict
-        try:
-            item = dict(row)
-        except Exception:
-            item = row
-
         # --- market_params ---
         mp = {}
         try:
@@ -1198,7 +1366,8 @@ def create_app(db_path: str = "database.db") -> Flask:
         if token:
             headers['Authorization'] = f'Discogs token={token}'
 
-        base_api = 'https://api.discogs.com'
+        base_api = hlp.provider_base('discogs')
+        cache_days = float(os.getenv('DISCOGS_RELEASE_CACHE_DAYS') or 30)
         result = {
             'source': 'Discogs API',
             'query': {},
@@ -1214,25 +1383,33 @@ def create_app(db_path: str = "database.db") -> Flask:
 
         try:
             if discogs_release_id:
-                # Verifica che la release esista
-                url = f"{base_api}/releases/{discogs_release_id}"
-                params = {}
-                if not token and key and sec:
-                    params.update({'key': key, 'secret': sec})
-                rr = requests.get(url, headers=headers, params=params, timeout=12)
-                rr.raise_for_status()
-                rel = rr.json()
-                release_id = rel.get('id')
-                result['release'] = {
-                    'id': release_id,
-                    'title': rel.get('title'),
-                    'artist_names' : [a.get("name") for a in rel.get("artists", [])],
-                    'year': rel.get('year'),
-                    'country': rel.get('country'),
-                    'labels': [l.get('name') for l in rel.get('labels', []) if l.get('name')],
-                    'formats': [f.get('name') for f in rel.get('formats', []) if f.get('name')],
-                }
-                result['query']['releases_lookup'] = {'url': url, 'id': discogs_release_id}
+                cached = await asyncio.to_thread(hlp.resolution_cache_get, app.config['DATABASE'], 'discogs', f'release:{discogs_release_id}', cache_days)
+                if cached:
+                    release_id = cached.get('id')
+                    result['release'] = cached
+                    result['query']['releases_lookup'] = {'id': discogs_release_id, 'cached': True}
+                else:
+                    # Verifica che la release esista
+                    url = f"{base_api}/releases/{discogs_release_id}"
+                    params = {}
+                    if not token and key and sec:
+                        params.update({'key': key, 'secret': sec})
+                    rr = await asv.http_get('discogs', url, headers=headers, params=params, timeout=12)
+                    rr.raise_for_status()
+                    rel = rr.json()
+                    release_id = rel.get('id')
+                    result['release'] = {
+                        'id': release_id,
+                        'title': rel.get('title'),
+                        'artist_names' : [a.get("name") for a in rel.get("artists", [])],
+                        'year': rel.get('year'),
+                        'country': rel.get('country'),
+                        'labels': [l.get('name') for l in rel.get('labels', []) if l.get('name')],
+                        'formats': [f.get('name') for f in rel.get('formats', []) if f.get('name')],
+                    }
+                    result['query']['releases_lookup'] = {'url': url, 'id': discogs_release_id}
+                    if release_id:
+                        await asyncio.to_thread(hlp.resolution_cache_put, app.config['DATABASE'], 'discogs', {f'release:{release_id}': result['release']})
             else:
                 # database/search
                 url = f"{base_api}/database/search"
@@ -1250,52 +1427,76 @@ def create_app(db_path: str = "database.db") -> Flask:
                     'url': url,
                     'params': {k: ('***' if k in ('key','secret') else v) for k, v in params.items()}
                 }
-
-                rs = requests.get(url, params=params, headers=headers, timeout=12)
-                rs.raise_for_status()
-                data = rs.json() or {}
-                rels = data.get('results') or []
-                if not rels:
-                    return jsonify({**result, 'error': 'Nessuna release trovata'}), 200
-
-                # preferisci formato/anno se possibile
-                def score(r):
-                    s = 0
-                    fmts = r.get('format') or []
-                    if desired_format and any(desired_format.lower() == (f or '').lower() for f in fmts):
-                        s -= 10
-                    try:
-                        y_req = int(mp.get('year')) if mp.get('year') else None
-                        y_rel = int(r.get('year')) if r.get('year') else None
-                        if y_req and y_rel:
-                            s += abs(y_req - y_rel)  # più vicino all'anno
-                    except Exception:
-                        pass
-                    if mp.get('catno') and (r.get('catno') or '').lower() == mp['catno'].lower():
-                        s -= 5
-                    if mp.get('label') and (r.get('label') or [''])[0].lower() == mp['label'].lower():
-                        s -= 3
-                    return s
-
-                rels = sorted(rels, key=score)
-                top = rels[0]
-                release_id = top.get('id')
-                result['release'] = {
-                    'id': release_id,
-                    'title': top.get('title'),
-                    'year': top.get('year'),
-                    'country': top.get('country'),
-                    'labels': top.get('label'),
-                    'formats': top.get('format') or []
-                }
-                used_search = True
+                search_key = 'search:' + hlp.cache_key({k: v for k, v in params.items() if k not in ('key', 'secret')})
+                cached = await asyncio.to_thread(hlp.resolution_cache_get, app.config['DATABASE'], 'discogs', search_key, cache_days)
+                if cached:
+                    release_id = cached.get('id')
+                    result['release'] = cached
+                    result['query']['search']['cached'] = True
+                    used_search = True
+                else:
+                    rs = await asv.http_get('discogs', url, params=params, headers=headers, timeout=12)
+                    rs.raise_for_status()
+                    data = rs.json() or {}
+                    rels = data.get('results') or []
+                    if not rels:
+                        return jsonify({**result, 'error': 'Nessuna release trovata'}), 200
+
+                    # preferisci formato/anno se possibile
+                    def score(r):
+                        s = 0
+                        fmts = r.get('format') or []
+                        if desired_format and any(desired_format.lower() == (f or '').lower() for f in fmts):
+                            s -= 10
+                        try:
+                            y_req = int(mp.get('year')) if mp.get('year') else None
+                            y_rel = int(r.get('year')) if r.get('year') else None
+                            if y_req and y_rel:
+                                s += abs(y_req - y_rel)  # più vicino all'anno
+                        except Exception:
+                            pass
+                        if mp.get('catno') and (r.get('catno') or '').lower() == mp['catno'].lower():
+                            s -= 5
+                        if mp.get('label') and (r.get('label') or [''])[0].lower() == mp['label'].lower():
+                            s -= 3
+                        return s
+
+                    rels = sorted(rels, key=score)
+                    top = rels[0]
+                    release_id = top.get('id')
+                    result['release'] = {
+                        'id': release_id,
+                        'title': top.get('title'),
+                        'year': top.get('year'),
+                        'country': top.get('country'),
+                        'labels': top.get('label'),
+                        'formats': top.get('format') or []
+                    }
+                    used_search = True
+                    if release_id:
+                        await asyncio.to_thread(hlp.resolution_cache_put, app.config['DATABASE'], 'discogs',
+                                                {search_key: result['release'], f'release:{release_id}': result['release']})
 
             if not release_id:
                 return jsonify({**result, 'error': 'Release ID non determinato'}), 200
 
+            # salva l'id scelto nei market_params dell'item: le stime successive saltano la ricerca.
+            # Solo quella chiave, sul valore attuale: l'utente può aver modificato l'item durante le chiamate
+            if used_search and item.get('user_id') == session.get('user_id'):
+                mp['discogs_release_id'] = str(release_id)
+
+                def save_release_id():
+                    conn = db.get_db_connection(items_db()); cur = conn.cursor()
+                    mp_expr = stg.dialect(cur).json_set_text('market_params', 'discogs_release_id')
+                    cur.execute(f"UPDATE items SET market_params = {mp_expr} WHERE id = ? AND user_id = ?",
+                                (str(release_id), item_id, item['user_id']))
+                    rev.bump(cur, item['user_id'], item_id)
+                    conn.commit(); conn.close()
+                await asyncio.to_thread(save_release_id)
+                result['query']['release_id_saved'] = True
+
             # ---- 2) Price suggestions ----
             ps_url = f"{base_api}/marketplace/price_suggestions/{release_id}"
-            ps_headers = dict(headers)
             ps_params = {}
             if not token and key and sec:
                 ps_params.update({'key': key, 'secret': sec})
@@ -1305,15 +1506,6 @@ def create_app(db_path: str = "database.db") -> Flask:
                 'auth': 'token' if token else ('key/secret' if (key and sec) else 'none')
             }
 
-            suggestions = None
-            try:
-                pr = requests.get(ps_url, headers=ps_headers, params=ps_params, timeout=12)
-                pr.raise_for_status()
-                suggestions = pr.json()  # { "Mint (M)": {"currency":"USD","value":xx}, ... }
-            except Exception as e:
-                # non bloccare il flusso: alcuni ID non hanno suggestions
-                result['query']['price_suggestions_error'] = str(e)
-
             # ---- 3) Marketplace stats (num_for_sale, lowest_price) ----
             stats_url = f"{base_api}/marketplace/stats/{release_id}"
             st_params = {}
@@ -1325,13 +1517,21 @@ def create_app(db_path: str = "database.db") -> Flask:
                 'auth': 'token' if token else ('key/secret' if (key and sec) else 'none')
             }
 
-            market_stats = None
-            try:
-                sr = requests.get(stats_url, headers=headers, params=st_params, timeout=12)
-                sr.raise_for_status()
-                market_stats = sr.json()  # {'num_for_sale':..., 'lowest_price':{'value','currency'}, ...}
-            except Exception as e:
-                result['query']['marketplace_stats_error'] = str(e)
+            # suggestions e stats in parallelo; nessuna delle due blocca il flusso
+            # (alcuni ID non hanno suggestions)
+            async def fetch_json(url, params):
+                r = await asv.http_get('discogs', url, headers=headers, params=params, timeout=12)
+                r.raise_for_status()
+                return r.json()
+
+            (suggestions, ps_err), (market_stats, st_err) = await asv.gather(
+                fetch_json(ps_url, ps_params),  # { "Mint (M)": {"currency":"USD","value":xx}, ... }
+                fetch_json(stats_url, st_params),  # {'num_for_sale':..., 'lowest_price':{'value','currency'}, ...}
+            )
+            if ps_err:
+                result['query']['price_suggestions_error'] = str(ps_err)
+            if st_err:
+                result['query']['marketplace_stats_error'] = str(st_err)
 
             # ---- 4) Sintesi prezzi (media/min/max/mediana) ----
             price_stats = None
@@ -1369,6 +1569,7 @@ def create_app(db_path: str = "database.db") -> Flask:
                 'currency': (price_stats or {}).get('currency') or (result['market_stats'] or {}).get('currency')
             }
 
+            await record_price(item, 'discogs', price_stats)
             return jsonify(result), 200
 
         except requests.HTTPError as e:
@@ -1380,17 +1581,13 @@ def create_app(db_path: str = "database.db") -> Flask:
 
     @app.route('/api/lego-estimate')
     @require_login
-    def lego_estimate():
-        import os, re, requests
+    async def lego_estimate():
+        import os, re
         item_id = request.args.get('item_id', type=int)
         if not item_id:
             return jsonify({'error': 'Missing item_id'}), 400
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
-        row = cur.fetchone(); conn.close()
-        if not row: return jsonify({'error':'Item not found'}), 404
-        item = dict(row)
+        item = await asyncio.to_thread(fetch_item, items_db(), item_id)
+        if item is None: return jsonify({'error':'Item not found'}), 404
 
         name = (item.get('name') or '').strip()
         category = (item.get('category') or '').strip().lower()
@@ -1402,17 +1599,18 @@ def create_app(db_path: str = "database.db") -> Flask:
 
         result = {'source':'Rebrickable API','query':None,'best':None,'results':[],'inferred':inferred}
         api_key = os.getenv('REBRICKABLE_API_KEY')
-        base_url = 'https://rebrickable.com/api/v3/lego/sets/'
+        base_url = f"{hlp.provider_base('rebrickable')}/lego/sets/"
         params = {'search': name, 'page_size': 10}
 
         if not api_key:
+            mtr.count_fallback('rebrickable')
             result['query'] = {'url': base_url, 'params': params, 'note':'Missing REBRICKABLE_API_KEY'}
             if inferred: result['best'] = {'set_num': f'{inferred}-1', 'set_number': inferred, 'name': name, 'source':'inferred'}
             return jsonify(result), 200
 
         try:
             headers = {'Authorization': f'key {api_key}'}
-            r = requests.get(base_url, headers=headers, params=params, timeout=8)
+            r = await asv.http_get('rebrickable', base_url, headers=headers, params=params, timeout=8)
             r.raise_for_status()
             data = r.json()
             items = data.get('results') or []
@@ -1431,13 +1629,14 @@ def create_app(db_path: str = "database.db") -> Flask:
             result['best'] = best or ({'set_num': f'{inferred}-1', 'set_number': inferred, 'name': name, 'source':'inferred'} if inferred else None)
             return jsonify(result), 200
         except Exception as e:
+            mtr.count_fallback('rebrickable')
             result['query'] = {'url': base_url, 'params': params, 'error': str(e)}
             if inferred: result['best'] = {'set_num': f'{inferred}-1', 'set_number': inferred, 'name': name, 'source':'inferred'}
             return jsonify(result), 200
 
     @app.route('/api/justtcg-estimate')
     @require_login
-    def justtcg_estimate():
+    async def justtcg_estimate():
         """
         TCG pricing via JustTCG.
         Env: JUSTTCG_API_KEY
@@ -1447,16 +1646,12 @@ def create_app(db_path: str = "database.db") -> Flask:
         if not item_id:
             return jsonify({'error': 'Missing item_id'}), 400
 
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items WHERE id=?", (item_id,))
-        row = cur.fetchone(); conn.close()
-        if not row: return jsonify({'error':'Item not found'}), 404
-        item = dict(row)
+        item = await asyncio.to_thread(fetch_item, items_db(), item_id)
+        if item is None: return jsonify({'error':'Item not found'}), 404
 
-        import os, re, requests, statistics as _st
+        import os, re, statistics as _st
         API = os.getenv('JUSTTCG_API_KEY')
-        base_url = 'https://api.justtcg.com/v1/cards'
+        base_url = f"{hlp.provider_base('justtcg')}/cards"
         if not API:
             return jsonify({
                 'source':'JustTCG Cards API',
@@ -1516,14 +1711,14 @@ def create_app(db_path: str = "database.db") -> Flask:
                 'card': None, 'variants': [], 'stats': None}
 
         try:
-            r = requests.get(base_url, headers={'x-api-key': API}, params=params, timeout=10)
+            r = await asv.http_get('justtcg', base_url, headers={'x-api-key': API}, params=params, timeout=10)
             r.raise_for_status()
             js = r.json() or {}
             data = js.get('data') or []
             # Se non trova nulla, rilasso i filtri di printing/condition
             if not data and not tcgplayer_id:
                 alt = dict(params); alt.pop('printing', None); alt.pop('condition', None)
-                rr = requests.get(base_url, headers={'x-api-key': API}, params=alt, timeout=10)
+                rr = await asv.http_get('justtcg', base_url, headers={'x-api-key': API}, params=alt, timeout=10)
                 rr.raise_for_status()
                 data = (rr.json() or {}).get('data') or []
                 result['query']['alt_params'] = alt
@@ -1564,6 +1759,7 @@ def create_app(db_path: str = "database.db") -> Flask:
                         'max':   round(max(prices),2),
                         'currency': 'USD'
                     }
+                    await record_price(item, 'justtcg', result['stats'])
             return jsonify(result), 200
         except Exception as e:
             result['error'] = str(e)
@@ -1571,18 +1767,14 @@ def create_app(db_path: str = "database.db") -> Flask:
 
     @app.route('/api/stockx-estimate')
     @require_login
-    def stockx_estimate():
+    async def stockx_estimate():
         item_id = request.args.get('item_id', type=int)
         if not item_id:
             return jsonify({'error':'Missing item_id'}), 400
-        conn = db.get_db_connection(app.config['DATABASE'])
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items WHERE id = ?", (item_id,))
-        row = conn.fetchone(); conn.close()
-        if not row: return jsonify({'error':'Item not found'}), 404
-        item = dict(row)
+        item = await asyncio.to_thread(fetch_item, items_db(), item_id)
+        if item is None: return jsonify({'error':'Item not found'}), 404
 
-        import os, requests, statistics as _st
+        import os, statistics as _st
         q_parts = [item.get('name') or '']
         if item.get('brand'): q_parts.append(item['brand'])
         if item.get('condition'): q_parts.append(item['condition'])
@@ -1601,11 +1793,12 @@ def create_app(db_path: str = "database.db") -> Flask:
         # 1) RapidAPI
         RAPID_KEY = os.getenv('STOCKX_RAPIDAPI_KEY')
         RAPID_HOST = os.getenv('STOCKX_RAPIDAPI_HOST','stockx-data.p.rapidapi.com')
+        RAPID_BASE = (os.getenv('STOCKX_RAPIDAPI_BASE') or f'https://{RAPID_HOST}').rstrip('/')
         if RAPID_KEY and q:
             try:
                 h = {'X-RapidAPI-Key': RAPID_KEY, 'X-RapidAPI-Host': RAPID_HOST}
-                s_url = f'https://{RAPID_HOST}/search'; s_params={'query': q}
-                sr = requests.get(s_url, headers=h, params=s_params, timeout=10); sr.raise_for_status(); sjs = sr.json()
+                s_url = f'{RAPID_BASE}/search'; s_params={'query': q}
+                sr = await asv.http_get('stockx', s_url, headers=h, params=s_params, timeout=10); sr.raise_for_status(); sjs = sr.json()
                 items = sjs.get('data') or sjs.get('products') or sjs.get('hits') or (sjs if isinstance(sjs, list) else [])
                 if not items: raise RuntimeError('no search result')
                 top = items[0]
@@ -1617,8 +1810,8 @@ def create_app(db_path: str = "database.db") -> Flask:
                 market = None; used_ep=None; used_params=None
                 for ep, params in [('product-details', {'productId': pid} if pid else None), ('product', {'urlKey': urlKey} if urlKey else None)]:
                     if not params: continue
-                    d_url = f'https://{RAPID_HOST}/{ep}'
-                    dr = requests.get(d_url, headers=h, params=params, timeout=10)
+                    d_url = f'{RAPID_BASE}/{ep}'
+                    dr = await asv.http_get('stockx', d_url, headers=h, params=params, timeout=10)
                     if dr.status_code >= 400: continue
                     dj = dr.json()
                     m = dj.get('market') or dj.get('Product') or dj.get('data') or dj
@@ -1640,6 +1833,7 @@ def create_app(db_path: str = "database.db") -> Flask:
                 if market:
                     result['query']={'via':'RapidAPI','search':{'url':s_url,'params':s_params},'detail_endpoint':used_ep,'detail_params':used_params}
                     result['product']=product; result['market']=market; result['stats']=_stats(market) or {'count':0,'currency':'USD'}
+                    await record_price(item, 'stockx', result['stats'])
                     return jsonify(result), 200
             except Exception as e:
                 result['rapidapi_error'] = str(e)
@@ -1648,14 +1842,14 @@ def create_app(db_path: str = "database.db") -> Flask:
         try:
             if q:
                 headers={'User-Agent':'Mozilla/5.0','Accept':'application/json, text/plain, */*','x-requested-with':'XMLHttpRequest'}
-                s_url='https://stockx.com/api/browse'; s_params={'_search': q}
-                sr=requests.get(s_url, headers=headers, params=s_params, timeout=10); sr.raise_for_status(); sjs=sr.json()
+                s_url=f"{hlp.provider_base('stockx')}/browse"; s_params={'_search': q}
+                sr=await asv.http_get('stockx', s_url, headers=headers, params=s_params, timeout=10); sr.raise_for_status(); sjs=sr.json()
                 prods = sjs.get('Products') or []
                 if prods:
                     top=prods[0]; urlKey=top.get('urlKey') or top.get('url') or top.get('slug'); name=top.get('title') or top.get('name')
                     if urlKey:
-                        d_url=f'https://stockx.com/api/products/{urlKey}'; d_params={'includes':'market'}
-                        dr=requests.get(d_url, headers=headers, params=d_params, timeout=10); dr.raise_for_status(); dj=dr.json()
+                        d_url=f"{hlp.provider_base('stockx')}/products/{urlKey}"; d_params={'includes':'market'}
+                        dr=await asv.http_get('stockx', d_url, headers=headers, params=d_params, timeout=10); dr.raise_for_status(); dj=dr.json()
                         p=dj.get('Product') or {}; market=p.get('market') or {}
                         cand={'lastSale':market.get('lastSale'),'lowestAsk':market.get('lowestAsk'),'highestBid':market.get('highestBid'),
                             'deadstockSold':market.get('deadstockSold'),'volatility':market.get('volatility'),'pricePremium':market.get('pricePremium')}
@@ -1666,35 +1860,26 @@ def create_app(db_path: str = "database.db") -> Flask:
                                 except: pass
                         result['query']={'via':'browse','search':{'url':s_url,'params':s_params},'detail':{'url':d_url,'params':d_params}}
                         result['product']={'urlKey':urlKey,'name':name}; result['market']=cand; result['stats']=_stats(cand) or {'count':0,'currency':'USD'}
+                        await record_price(item, 'stockx', result['stats'])
                         return jsonify(result), 200
         except Exception as e:
             result['browse_error']=str(e)
 
         # 3) Fallback
+        mtr.count_fallback('stockx')
         base_val = float(item.get('purchase_price') or 0) or None
         if base_val is not None:
             market={'lastSale': base_val*1.05, 'lowestAsk': base_val*1.1, 'highestBid': base_val*0.95}
             result['market']=market; result['stats']=_stats(market)
         return jsonify(result), 200
 
-    @app.route('/api/code-resolve', methods=['POST'])
-    @require_login
-    def api_code_resolve():
+    def resolve_code(code_type: str, code: str, platform: str = '') -> dict:
         """
-        Risolve 'code_type' + 'code' per ottenere market_params normalizzati,
-        puntando (per ora) a PriceCharting (videogiochi, focus Game Boy).
-        Body: { category, code_type, code, platform? }
+        Risolve 'code_type' + 'code' in market_params normalizzati, puntando (per ora) a
+        PriceCharting (videogiochi, focus Game Boy). Ritorna {'normalized', 'query'} oppure
+        {'error', 'query'}. Non usa il contesto della richiesta: può girare sul pool dei provider.
         """
-        import os, requests, datetime as dt
-
-        data = request.get_json(silent=True) or {}
-        category = (data.get('category') or '').lower()
-        code_type = (data.get('code_type') or '').upper()
-        code = (data.get('code') or '').strip()
-        platform = (data.get('platform') or '').strip()
-
-        if not code_type or not code:
-            return jsonify({'error': 'Missing code_type or code'}), 400
+        import requests
 
         # Sorgente
         token = os.getenv('PRICECHARTING_TOKEN') or os.getenv('PRICE_CHARTING_TOKEN') or 'demo'
@@ -1703,7 +1888,7 @@ def create_app(db_path: str = "database.db") -> Flask:
         # 1) se EAN/UPC → endpoint "product by barcode"
         # 2) se DMG/Serial → search q=... + console=Game Boy (se dedotta)
         # NB: gli endpoint possono variare: adattati alla tua implementazione corrente
-        base = "https://www.pricecharting.com/api"
+        base = hlp.provider_base('pricecharting')
         query_used = {'source': 'PriceCharting'}
 
         try:
@@ -1720,12 +1905,12 @@ def create_app(db_path: str = "database.db") -> Flask:
             if code_type in ('EAN','UPC'):
                 url = f"{base}/product"
                 params = {'t': token, 'barcode': code}
-                r = requests.get(url, params=params, timeout=12)
+                r = mtr.http_get('pricecharting', url, params=params, timeout=12)
                 query_used.update({'endpoint': 'product', 'params': {'barcode': code}})
                 r.raise_for_status()
                 p = r.json() if r.text else None
                 if not p or not isinstance(p, dict):
-                    return jsonify({'error':'Nessun prodotto per barcode', 'query': query_used}), 200
+                    return {'error': 'Nessun prodotto per barcode', 'query': query_used}
 
                 normalized['title'] = p.get('product-name') or p.get('title')
                 normalized['platform'] = p.get('console-name') or p.get('console')
@@ -1742,7 +1927,7 @@ def create_app(db_path: str = "database.db") -> Flask:
                     'pricecharting_id': p.get('id')
                 }
                 normalized['market_params'] = {k:v for k,v in market_params.items() if v not in (None,'')}
-                return jsonify({'normalized': normalized, 'query': query_used})
+                return {'normalized': normalized, 'query': query_used}
 
             # 2) DMG / SERIAL → search
             # Deduci console “Game Boy” per DMG
@@ -1750,24 +1935,24 @@ def create_app(db_path: str = "database.db") -> Flask:
             url = f"{base}/search"
             params = {'t': token, 'q': code}
             if console: params['console'] = console
-            r = requests.get(url, params=params, timeout=12)
+            r = mtr.http_get('pricecharting', url, params=params, timeout=12)
             query_used.update({'endpoint': 'search', 'params': {'q': code, 'console': console or None}})
 
             r.raise_for_status()
             arr = r.json() if r.text else []
             if not arr:
-                return jsonify({'error':'Nessun risultato dalla ricerca', 'query': query_used}), 200
+                return {'error': 'Nessun risultato dalla ricerca', 'query': query_used}
 
             # pick best (primo)
             top = arr[0] if isinstance(arr, list) else None
             if not top or not isinstance(top, dict):
-                return jsonify({'error':'Risultato inaspettato', 'query': query_used}), 200
+                return {'error': 'Risultato inaspettato', 'query': query_used}
 
             # eventuale dettaglio prodotto
             prod_id = top.get('id')
             if prod_id:
                 url2 = f"{base}/products"
-                r2 = requests.get(url2, params={'t': token, 'id': prod_id}, timeout=12)
+                r2 = mtr.http_get('pricecharting', url2, params={'t': token, 'id': prod_id}, timeout=12)
                 # /products può restituire array o singolo — gestiamo entrambi
                 det = r2.json() if r2.text else {}
                 p = (det[0] if isinstance(det, list) and det else (det if isinstance(det, dict) else {}))
@@ -1790,12 +1975,114 @@ def create_app(db_path: str = "database.db") -> Flask:
             normalized['market_params'] = {k:v for k,v in market_params.items() if v not in (None,'')}
 
             # conserva per il pulsante "Applica"
-            return jsonify({'normalized': normalized, 'query': query_used})
+            return {'normalized': normalized, 'query': query_used}
 
         except requests.HTTPError as e:
-            return jsonify({'error': f"HTTP {e.response.status_code}: {e.response.text[:160]}", 'query': query_used}), 200
+            return {'error': f"HTTP {e.response.status_code}: {e.response.text[:160]}", 'query': query_used}
         except Exception as e:
-            return jsonify({'error': str(e), 'query': query_used}), 200
+            return {'error': str(e), 'query': query_used}
+
+    def code_cache_key(code_type: str, code: str, platform: str) -> str:
+        return hlp.cache_key({'code_type': code_type, 'code': code, 'platform': platform})
+
+    def resolve_code_cached(code_type: str, code: str, platform: str = '') -> dict:
+        """resolve_code con cache persistente (provider_resolution_cache) dei soli esiti positivi."""
+        days = float(os.getenv('CODE_RESOLVE_CACHE_DAYS') or 90)
+        key = code_cache_key(code_type, code, platform)
+        cached = hlp.resolution_cache_get(app.config['DATABASE'], 'code-resolve', key, days)
+        if cached:
+            return {**cached, 'cached': True}
+        res = resolve_code(code_type, code, platform)
+        if res.get('normalized'):
+            hlp.resolution_cache_put(app.config['DATABASE'], 'code-resolve', {key: res})
+        return res
+
+    @app.route('/api/code-resolve', methods=['POST'])
+    @require_login
+    def api_code_resolve():
+        """
+        Risolve 'code_type' + 'code' per ottenere market_params normalizzati (vedi resolve_code).
+        Body: { category, code_type, code, platform? }
+        """
+        data = request.get_json(silent=True) or {}
+        code_type = str(data.get('code_type') or '').upper()
+        code = str(data.get('code') or '').strip()
+        platform = str(data.get('platform') or '').strip()
+
+        if not code_type or not code:
+            return jsonify({'error': 'Missing code_type or code'}), 400
+        return jsonify(resolve_code_cached(code_type, code, platform)), 200
+
+    @app.route('/api/code-resolve/batch', methods=['POST'])
+    @require_login
+    def api_code_resolve_batch():
+        """
+        Risoluzione in blocco (es. scansione di uno scatolone di giochi).
+        Body: { codes: [{code_type, code, platform?}, ...], platform? }
+
+        I codici duplicati sono risolti una volta sola; quelli già noti arrivano dalla cache,
+        gli altri sono risolti in parallelo (al più CODE_RESOLVE_PARALLELISM alla volta).
+        Risposta NDJSON in streaming, una riga per codice appena pronta:
+            {"type": "start", "total", "unique", "cached"}
+            {"type": "result", "code_type", "code", "platform", "indexes": [...], "cached", "normalized" | "error", "query"}
+            {"type": "end", "resolved", "errors", "seconds"}
+        """
+        data = request.get_json(silent=True) or {}
+        codes = data.get('codes')
+        if not isinstance(codes, list) or not codes:
+            return jsonify({'error': 'Missing codes'}), 400
+        if len(codes) > app.config['CODE_RESOLVE_MAX_BATCH']:
+            return jsonify({'error': f"Too many codes (max {app.config['CODE_RESOLVE_MAX_BATCH']})"}), 400
+
+        default_platform = str(data.get('platform') or '').strip()
+        unique = {}   # (code_type, code, platform) -> [indici nella richiesta]
+        for i, entry in enumerate(codes):
+            entry = entry if isinstance(entry, dict) else {}
+            # i codici a barre possono arrivare come numeri JSON
+            code_type = str(entry.get('code_type') or '').upper()
+            code = str(entry.get('code') or '').strip()
+            if not code_type or not code:
+                continue
+            unique.setdefault((code_type, code, str(entry.get('platform') or default_platform).strip()), []).append(i)
+
+        days = float(os.getenv('CODE_RESOLVE_CACHE_DAYS') or 90)
+        parallelism = int(os.getenv('CODE_RESOLVE_PARALLELISM') or 4)
+        db_string = app.config['DATABASE']
+        t0 = time.perf_counter()
+        hits = hlp.resolution_cache_get_many(db_string, 'code-resolve', [code_cache_key(*ident) for ident in unique], days)
+        cached, todo = {}, []
+        for ident in unique:
+            hit = hits.get(code_cache_key(*ident))
+            if hit:
+                cached[ident] = hit
+            else:
+                todo.append(ident)
+
+        def line(obj) -> str:
+            return json.dumps(obj, ensure_ascii=False) + '\n'
+
+        def generate():
+            counts = {'resolved': 0, 'errors': 0}
+
+            def emit(ident, res, from_cache):
+                counts['resolved' if res.get('normalized') else 'errors'] += 1
+                return line({'type': 'result', 'code_type': ident[0], 'code': ident[1], 'platform': ident[2] or None,
+                             'indexes': unique[ident], 'cached': from_cache, **res})
+
+            yield line({'type': 'start', 'total': len(codes), 'unique': len(unique), 'cached': len(cached)})
+            for ident, res in cached.items():
+                yield emit(ident, res, True)
+            calls = [lambda ident=ident: resolve_code(*ident) for ident in todo]
+            for i, res, err in hlp.iter_parallel(calls, parallelism):
+                ident = todo[i]
+                if err is not None:
+                    res = {'error': str(err), 'query': {'source': 'PriceCharting'}}
+                elif res.get('normalized'):
+                    hlp.resolution_cache_put(db_string, 'code-resolve', {code_cache_key(*ident): res})
+                yield emit(ident, res, False)
+            yield line({'type': 'end', **counts, 'seconds': round(time.perf_counter() - t0, 3)})
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
     @app.route('/api/global-catalog/ensure-or-resolve', methods=['POST'])
     @require_login
@@ -1806,21 +2093,61 @@ def create_app(db_path: str = "database.db") -> Flask:
         category = data.get('category') or ''
         market_params = json.dumps(data.get('market_params') or {}, ensure_ascii=False)
         hint_name = data.get('hint_name') or None
-        gid = gc.ensure_global_by_identifiers(market_params, category, hint_name)
+        gid = gc.ensure_global_by_identifiers(app.config['DATABASE'], market_params, category, hint_name)
         return jsonify({'global_id': gid}), 200
 
+    @app.route('/api/global-catalog/link', methods=['GET', 'POST'])
+    @require_login
+    def api_gc_link():
+        """
+        Collega in batch gli items senza global_id al catalogo globale (vedi gc.link_items).
+
+        Un utente collega i propri items; l'admin può indicare user_id oppure all=true.
+        POST esegue (o riprende) il run, al massimo max_chunks chunk per chiamata;
+        GET restituisce lo stato/avanzamento dell'ultimo run.
+
+        Body/query params:
+            user_id, all: ambito del run (solo admin)
+            chunk_size: items per chunk (default 500)
+            max_chunks: chunk da elaborare in questa chiamata (default: fino alla fine)
+            restart: ignora il run interrotto e ricomincia
+        """
+        data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+        user_id = session.get('user_id')
+        if hlp.is_admin_user():
+            if str(data.get('all') or '').lower() in ('1', 'true'):
+                user_id = None
+            elif data.get('user_id'):
+                try:
+                    user_id = int(data.get('user_id'))
+                except (TypeError, ValueError):
+                    return jsonify({'error': 'Invalid user_id'}), 400
+        if request.method == 'GET':
+            return jsonify(gc.link_status(app.config['DATABASE'], user_id) or {}), 200
+        try:
+            chunk_size = int(data.get('chunk_size') or 500)
+            max_chunks = int(data['max_chunks']) if data.get('max_chunks') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid chunk_size or max_chunks'}), 400
+        state = gc.link_items(app.config['DATABASE'], user_id, chunk_size, max_chunks, bool(data.get('restart')))
+        return jsonify(state), 200
+
     @app.route('/api/global-catalog/<int:gid>/refresh', methods=['POST'])
     @require_login
     def api_gc_refresh(gid):
+        import statistics
         # Legge market_params & category dal GC
-        conn = db.get_db_connection(); cur = conn.cursor()
-        cur.execute("SELECT category, market_params FROM global_catalog WHERE id=?", (gid,))
-        row = cur.fetchone(); conn.close()
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
+        cur.execute("SELECT category, canonical_name, market_params FROM global_catalog WHERE id=?", (gid,))
+        row = cur.fetchone()
         if not row:
+            conn.close()
             return jsonify({'error':'Global not found'}), 404
-        category = row['category'] if isinstance(row, dict) else row[0]
-        mp = json.loads((row['market_params'] if isinstance(row, dict) else row[1]) or "{}")
+        category = row['category']
+        mp = json.loads(row['market_params'] or "{}")
         name_hint = (mp.get('title') or mp.get('name') or '').strip()
+        pc_local = pcg.find_for_item(cur, mp, row['canonical_name'])
+        conn.close()
 
         results = {}
 
@@ -1844,31 +2171,41 @@ def create_app(db_path: str = "database.db") -> Flask:
                 'itemFilter(0).value':'true',
                 'siteid': site_id
             }
-            r = requests.get("https://svcs.ebay.com/services/search/FindingService/v1", params=payload, timeout=8)
+            r = mtr.http_get('ebay', hlp.provider_base('ebay'), params=payload, timeout=8)
             r.raise_for_status()
             data = r.json()
             items = (((data or {}).get('findCompletedItemsResponse') or [{}])[0].get('searchResult') or [{}])[0].get('item', [])
-            prices = []
+            priced = []   # (prezzo, valuta)
             for it in items:
                 selling = ((it.get('sellingStatus') or [{}])[0])
                 if (selling.get('sellingState') or [''])[0] != 'EndedWithSales':
                     continue
                 curr_price = ((it.get('sellingStatus') or [{}])[0].get('currentPrice') or [{}])[0]
                 price_val  = float(curr_price.get('__value__', '0') or 0)
+                price_cur  = curr_price.get('@currencyId')
                 conv       = ((it.get('sellingStatus') or [{}])[0].get('convertedCurrentPrice') or [{}])[0]
                 if conv and conv.get('__value__'):
                     price_val = float(conv.get('__value__', price_val) or price_val)
-                prices.append(price_val)
+                    price_cur = conv.get('@currencyId', price_cur)
+                priced.append((price_val, price_cur))
+            # valuta dello snapshot: la più frequente (quella del sito); gli altri prezzi vengono convertiti
+            currencies = [c for _, c in priced if c]
+            snap_currency = max(set(currencies), key=currencies.count) if currencies else None
+            prices = []
+            for price_val, price_cur in priced:
+                rate = hlp.exchange_rate(price_cur or snap_currency, snap_currency)
+                if rate is not None:
+                    prices.append(price_val * rate)
             if prices:
-                import statistics
                 stats = {
                     'avg': sum(prices)/len(prices),
                     'median': statistics.median(prices),
                     'min': min(prices),
                     'max': max(prices),
-                    'samples_count': len(prices)
+                    'samples_count': len(prices),
+                    'currency': snap_currency
                 }
-                hlp.record_price_snapshot(gid, 'ebay', stats, {'url':'FindingService', 'params': payload})
+                hlp.record_price_snapshot(app.config['DATABASE'], gid, 'ebay', stats, {'url':'FindingService', 'params': payload}, prices)
                 results['ebay'] = stats
         except Exception:
             pass
@@ -1877,22 +2214,27 @@ def create_app(db_path: str = "database.db") -> Flask:
         try:
             tok = os.environ.get('PRICECHARTING_TOKEN') or ''
             q = (name_hint or '').strip()
-            if q:
-                r = requests.get('https://www.pricecharting.com/api/product', params={'q': q, 't': tok}, timeout=8)
+            jsn, meta = {}, {'endpoint':'/api/product','q':q}
+            if pc_local:
+                # price guide locale: niente chiamata all'API
+                jsn, meta = pcg.as_api(pc_local[0]), {'source':'price_guide','match':pc_local[1],'id':pc_local[0]['id']}
+            elif q:
+                r = mtr.http_get('pricecharting', f"{hlp.provider_base('pricecharting')}/product", params={'q': q, 't': tok}, timeout=8)
                 r.raise_for_status()
                 jsn = r.json() if r.headers.get('Content-Type','').startswith('application/json') else {}
+            if jsn:
                 # calcolo semplice (es. loose/complete/new se presenti)
                 vals = [float(jsn.get(k) or 0) for k in ['loose-price','cib-price','new-price'] if jsn.get(k)]
                 if vals:
-                    import statistics
                     stats = {
                         'avg': sum(vals)/len(vals),
                         'median': statistics.median(vals),
                         'min': min(vals),
                         'max': max(vals),
-                        'samples_count': len(vals)
+                        'samples_count': len(vals),
+                        'currency': 'USD'
                     }
-                    hlp.record_price_snapshot(gid, 'pricecharting', stats, {'endpoint':'/api/product','q':q})
+                    hlp.record_price_snapshot(app.config['DATABASE'], gid, 'pricecharting', stats, meta)
                     results['pricecharting'] = stats
         except Exception:
             pass
@@ -1904,7 +2246,7 @@ def create_app(db_path: str = "database.db") -> Flask:
     def api_gc_prices(gid):
         source = request.args.get('source')  # opzionale
         since  = request.args.get('since')   # 'YYYY-MM-DD' opzionale
-        conn = db.get_db_connection(); cur = conn.cursor()
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
         sql = "SELECT ref_date, source, samples_count, avg, median, min, max FROM global_catalog_prices WHERE global_id=?"
         params = [gid]
         if source:
@@ -1915,31 +2257,52 @@ def create_app(db_path: str = "database.db") -> Flask:
         cur.execute(sql, params)
         rows = [dict(r) for r in cur.fetchall()]
         conn.close()
-        return jsonify(rows), 200
+        return rsp.negotiate(rows)
+
+    @app.route('/api/global-catalog/<int:gid>/percentiles', methods=['GET'])
+    @require_login
+    def api_gc_percentiles(gid):
+        """Real price percentiles merged from the snapshot sketches (?days=365&source=ebay&currency=EUR)."""
+        days = max(1, min(3650, request.args.get('days', default=365, type=int)))
+        currency = (request.args.get('currency') or 'EUR').strip().upper()
+        if hlp.exchange_rate(currency, 'EUR') is None:
+            return jsonify({'error': 'Unsupported currency'}), 400
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
+        pct = hlp.price_percentiles(cur, gid, days, request.args.get('source') or None, currency)
+        conn.close()
+        return jsonify({'global_id': gid, **pct}), 200
 
     @app.route('/api/global-catalog/search', methods=['GET'])
     @require_login
     def api_gc_search():
-        q = (request.args.get('q') or '').strip().lower()
-        cat = (request.args.get('category') or '').strip().lower()
-        conn = db.get_db_connection(); cur = conn.cursor()
-        sql = "SELECT id, canonical_name, category, catalog_key FROM global_catalog WHERE 1=1"
-        params = []
-        if q:
-            sql += " AND (LOWER(canonical_name) LIKE ? OR LOWER(catalog_key) LIKE ?)"
-            params.extend([f'%{q}%', f'%{q}%'])
-        if cat:
-            sql += " AND LOWER(category)=?"; params.append(cat)
-        sql += " ORDER BY updated_at DESC LIMIT 50"
-        cur.execute(sql, params)
-        rows = [dict(r) for r in cur.fetchall()]
-        conn.close()
-        return jsonify(rows), 200
+        """
+        Ricerca nel catalogo globale per rilevanza (indice trigram) con paginazione keyset.
+
+        Query params:
+            q: testo da cercare in nome, catalog_key e identificatori
+            category: filtro categoria (opzionale)
+            limit: dimensione pagina (default 50, max 200)
+            cursor: next_cursor della pagina precedente
+        """
+        q = (request.args.get('q') or '').strip()
+        cat = (request.args.get('category') or '').strip()
+        try:
+            limit = max(1, min(200, int(request.args.get('limit') or 50)))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit'}), 400
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
+        try:
+            rows, next_cursor = gc.search(cur, q, cat, limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        finally:
+            conn.close()
+        return jsonify({'items': rows, 'next_cursor': next_cursor}), 200
 
     @app.route('/api/global-catalog/<int:gid>/summary', methods=['GET'])
     @require_login
     def api_gc_summary(gid):
-        conn = db.get_db_connection(); cur = conn.cursor()
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
         cur.execute("SELECT id, canonical_name, category, identifiers, market_params, info_links FROM global_catalog WHERE id=?", (gid,))
         gc = cur.fetchone()
         if not gc: conn.close(); return jsonify({'error':'Not found'}), 404
@@ -1949,13 +2312,13 @@ def create_app(db_path: str = "database.db") -> Flask:
         """, (gid,))
         prices = [dict(r) for r in cur.fetchall()]
         conn.close()
-        return jsonify({
+        return rsp.negotiate({
             'id': gc['id'], 'canonical_name': gc['canonical_name'], 'category': gc['category'],
             'identifiers': json.loads(gc['identifiers'] or '{}'),
             'market_params': json.loads(gc['market_params'] or '{}'),
             'info_links': json.loads(gc['info_links'] or '[]'),
             'prices': prices
-        }), 200
+        })
 
     @app.route('/api/global-catalog/<int:gid>/info-links', methods=['PUT'])
     @require_login
@@ -1973,7 +2336,7 @@ def create_app(db_path: str = "database.db") -> Flask:
                 else: continue
                 if u.startswith('http://') or u.startswith('https://'):
                     clean.append(u)
-        conn = db.get_db_connection(); cur = conn.cursor()
+        conn = db.get_db_connection(app.config['DATABASE']); cur = conn.cursor()
         cur.execute("UPDATE global_catalog SET info_links=?, updated_at=? WHERE id=?",
                     (json.dumps(clean, ensure_ascii=False), datetime.utcnow().isoformat(), gid))
         conn.commit(); conn.close()
@@ -1995,6 +2358,13 @@ def create_app(db_path: str = "database.db") -> Flask:
         return dashboard.api_dashboard_trend(app.config['DATABASE'])
 
 
+    # METRICS (formato testo Prometheus, per worker)
+    @app.route('/metrics')
+    @require_login
+    @require_admin
+    def metrics():
+        return mtr.metrics_response()
+
     # PLATFORM INFO
     @app.route('/api/platform/overview')
     def api_platform_overview():
@@ -2002,10 +2372,25 @@ def create_app(db_path: str = "database.db") -> Flask:
 
     return app
 
+def create_asgi_app(db_path: str = None):
+    """
+    ASGI entry point (asgiref WsgiToAsgi): the async estimator views run on their own thread pool,
+    so they never hold up the small pool that serves every other route (see asv.asgi).
+
+    Example:
+        ASGI=1 python app.py        # or uvicorn.run(create_asgi_app(), port=5000)
+    """
+    return asv.asgi(create_app(db_path))
+
 if __name__ == '__main__':
     # When executed directly, run the app on localhost for development
-    app = create_app()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if os.getenv('ASGI'):
+        # ASGI server (pip install uvicorn aiohttp): estimate calls no longer hold a thread each
+        import uvicorn
+        uvicorn.run(create_asgi_app(), host='0.0.0.0', port=5000)
+    else:
+        app = create_app()
+        app.run(host='0.0.0.0', port=5000, debug=True)
 
 
 
@@ -1,5 +1,19 @@
+from app.metrics import mtr
+from app.sqltrace import sqt
 from app.db import db
+from app.storage import stg
+from app.writer import wrq
 from app.helpers import hlp
+from app.usercontext import ucx
+from app.sharding import shd
 from app.globalcatalog import gc
 from app.home import platform
-from app.profile import dashboard, prf
\ No newline at end of file
+from app.profile import dashboard, prf
+from app.response import rsp
+from app.revisions import rev
+from app.dedupe import ddp
+from app.priceguide import pcg
+from app.discogsdump import dsd
+from app.pricehistory import phs
+from app.asyncviews import asv
+from app.sketch import skt
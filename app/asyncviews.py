@@ -0,0 +1,188 @@
+from app.helpers import hlp
+from app.metrics import mtr
+from werkzeug.exceptions import HTTPException
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import weakref
+
+# Dipendenza opzionale: senza aiohttp le chiamate ai provider girano sul pool dei provider (hlp._pool)
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Connessioni HTTP contemporanee verso i provider per event loop (non thread: socket in attesa)
+PROVIDER_MAX_CONNECTIONS = int(os.getenv('PROVIDER_MAX_CONNECTIONS') or 1000)
+# Thread per le view sincrone servite dall'app ASGI (tutto tranne le view async)
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS') or 16)
+# Thread per le view async sotto ASGI: uno per stima in volo (attende l'event loop di servizio)
+ASGI_ASYNC_THREADS = int(os.getenv('ASGI_ASYNC_THREADS') or PROVIDER_MAX_CONNECTIONS)
+
+_sessions = weakref.WeakKeyDictionary()  # event loop -> aiohttp.ClientSession
+_loop = None                              # event loop di servizio per le view async sotto WSGI
+_loop_lock = threading.Lock()
+
+
+class _Response():
+    """Risposta aiohttp già letta, con l'interfaccia di requests usata dagli stimatori (status_code, text, json, raise_for_status)."""
+
+    def __init__(self, status_code: int, url: str, body: bytes, charset: str):
+        self.status_code = status_code
+        self.url = url
+        self.content = body
+        self.encoding = charset or 'utf-8'
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class asv():
+    """
+    View async per gli endpoint che aspettano i provider esterni (/api/*-estimate).
+
+    Una view `async def` attende la rete con asv.http_get (aiohttp.ClientSession condivisa per
+    event loop): le chiamate ai provider di una stima partono insieme e restano in volo come socket.
+    Flask esegue la view sull'event loop di servizio di asv (un thread per processo) e il thread
+    della richiesta aspetta il risultato, sia sotto WSGI (app.run, gunicorn sync...) sia sotto
+    asv.asgi(app) (create_asgi_app in app.py, es. `ASGI=1 python app.py` con uvicorn), dove le
+    view async hanno un pool di thread separato da quello delle route sincrone.
+    Il lavoro su SQLite dentro le view async va fatto con asyncio.to_thread, che conserva il
+    contesto della richiesta: un lock di scrittura bloccherebbe l'intero event loop.
+    """
+
+    def install(app):
+        # Flask esegue le view async sull'event loop di servizio, non su un event loop nuovo per richiesta
+        app.async_to_sync = asv.async_to_sync
+
+    # --- client HTTP ---
+    def _session():
+        loop = asyncio.get_running_loop()
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            session = _sessions[loop] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=PROVIDER_MAX_CONNECTIONS, ttl_dns_cache=300))
+        return session
+
+    async def http_get(provider: str, url: str, params: dict = None, headers: dict = None, timeout: float = None):
+        """
+        Versione async di mtr.http_get (stesse metriche per provider, stessa interfaccia della
+        risposta). Senza aiohttp la chiamata bloccante va sul pool dei provider.
+        """
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                hlp._pool(), functools.partial(mtr.http_get, provider, url, params=params, headers=headers, timeout=timeout))
+        params = {k: v if isinstance(v, str) else str(v) for k, v in (params or {}).items() if v is not None}   # come requests
+        t0 = time.perf_counter()
+        outcome = 'error'
+        try:
+            async with asv._session().get(url, params=params, headers=headers,
+                                          timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                body = await r.read()
+            outcome = 'ok' if r.status < 400 else f'http_{r.status // 100}xx'
+            return _Response(r.status, str(r.url), body, r.charset)
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise
+        finally:
+            mtr.observe_provider(provider, time.perf_counter() - t0, outcome)
+
+    async def gather(*aws) -> list:
+        """Come hlp.run_parallel per le coroutine: [(risultato, eccezione)] nello stesso ordine."""
+        out = []
+        for r in await asyncio.gather(*aws, return_exceptions=True):
+            out.append((None, r) if isinstance(r, Exception) else (r, None))
+        return out
+
+    async def close_sessions():
+        for session in list(_sessions.values()):
+            await session.close()
+        _sessions.clear()
+
+    # --- WSGI: view async sull'event loop di servizio ---
+    def _service_loop():
+        global _loop
+        if _loop is None:
+            with _loop_lock:
+                if _loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name='async-views', daemon=True).start()
+                    _loop = loop
+        return _loop
+
+    def run(coro):
+        """Esegue la coroutine sull'event loop di servizio con il contesto corrente (richiesta Flask) e ne attende il risultato."""
+        loop = asv._service_loop()
+        ctx = contextvars.copy_context()
+        result = concurrent.futures.Future()
+
+        def start():
+            task = loop.create_task(coro, context=ctx)
+            task.add_done_callback(lambda t: result.cancel() if t.cancelled() else
+                                   result.set_exception(t.exception()) if t.exception() else result.set_result(t.result()))
+        loop.call_soon_threadsafe(start)
+        return result.result()
+
+    def async_to_sync(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return asv.run(func(*args, **kwargs))
+        return wrapper
+
+    # --- ASGI ---
+    def asgi(app):
+        """
+        Applicazione ASGI: asgiref.wsgi.WsgiToAsgi, con le view async servite da Flask
+        (app.ensure_sync -> asv.async_to_sync) come sotto WSGI. Una view async tiene il suo
+        thread finché aspetta i provider, quindi gira su un pool a parte (ASGI_ASYNC_THREADS):
+        le route CRUD restano sui loro ASGI_WSGI_THREADS thread e non si accodano alle stime.
+        """
+        from asgiref.sync import SyncToAsync
+        from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+        # WsgiToAsgi esegue l'app con thread_sensitive=True, cioè una richiesta alla volta su un solo thread
+        run_wsgi_app = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+        instances = {}
+        for is_async, threads in ((False, ASGI_WSGI_THREADS), (True, ASGI_ASYNC_THREADS)):
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-async' if is_async else 'wsgi')
+            if is_async:
+                threading.Thread(target=asv._prestart, args=(pool, threads), name='asgi-prestart', daemon=True).start()
+            instances[is_async] = type('instance', (WsgiToAsgiInstance,), {
+                'run_wsgi_app': SyncToAsync(run_wsgi_app, thread_sensitive=False, executor=pool)})
+
+        class application(WsgiToAsgi):
+            async def __call__(self, scope, receive, send):
+                instance = instances[scope['type'] == 'http' and asv._is_async_view(app, scope)]
+                await instance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+        return application(app)
+
+    def _prestart(pool, threads: int):
+        # avvia subito tutti i thread del pool: altrimenti ognuno parte dentro submit, sull'event loop
+        # del server, durante la prima raffica di stime (e le route CRUD aspettano il loop)
+        release = threading.Event()
+        for _ in range(threads):
+            pool.submit(release.wait)
+        release.set()
+
+    def _is_async_view(app, scope) -> bool:
+        try:
+            endpoint, _ = app.url_map.bind('').match(scope['path'], scope['method'])
+        except HTTPException:
+            return False
+        return inspect.iscoroutinefunction(app.view_functions.get(endpoint))
@@ -1,21 +1,132 @@
 import sqlite3
+import time
+from app.metrics import mtr
+from app.sqltrace import sqt
+from app.storage import stg, sqlite_dialect
+
+# Colonne di global_catalog indicizzate in global_catalog_fts (ricerca trigram)
+GC_FTS_COLUMNS = ('canonical_name', 'catalog_key', 'ident_ean', 'ident_serial', 'ident_tcg_id',
+                  'ident_discogs_id', 'ident_pc_id', 'ident_lego_set', 'ident_stockx_slug')
+
+
+class MeteredCursor(sqlite3.Cursor):
+    """Cursore che misura ogni statement eseguito (metriche per richiesta e tracing SQL)."""
+
+    def _observe(self, sql, parameters, seconds: float):
+        mtr.observe_sql(seconds)
+        sqt.record(self.connection, sql, parameters, seconds)
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(sql, parameters, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe(sql, None, time.perf_counter() - t0)
+
+
+class MeteredConnection(sqlite3.Connection):
+
+    dialect = sqlite_dialect
+
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
 
 class db():
 
+    # Errori del driver, comuni a SQLite e PostgreSQL (vedi app/storage.py)
+    IntegrityError = stg.IntegrityError
+    OperationalError = stg.OperationalError
+
     def get_db_connection(db_string):
-        """Helper to get a connection to the SQLite database."""
-        conn = sqlite3.connect(db_string)
-        # Return rows as dictionaries for easier handling
-        conn.row_factory = sqlite3.Row
+        """Helper to get a connection to the database (SQLite path or postgresql:// DSN)."""
+        if stg.is_postgres(db_string):
+            conn = stg.connect_postgres(db_string)
+        elif stg.shared_for(db_string):
+            # shard degli items: tabelle condivise (users, global_catalog, ...) in sola lettura come "shared"
+            conn = sqlite3.connect(stg.sqlite_uri(db_string), factory=MeteredConnection, uri=True)
+            conn.execute("ATTACH DATABASE ? AS shared", (stg.sqlite_uri(stg.shared_for(db_string), 'ro'),))
+            conn.row_factory = sqlite3.Row
+        else:
+            conn = sqlite3.connect(db_string, factory=MeteredConnection)
+            # Return rows as dictionaries for easier handling
+            conn.row_factory = sqlite3.Row
+        sqt.connection_opened()
         return conn
 
+    def schema_version(cur) -> int:
+        """Return the applied schema version (0 on a fresh or pre-migrations database)."""
+        try:
+            cur.execute("SELECT MAX(version) FROM schema_version")
+            row = cur.fetchone()
+            return row[0] or 0
+        except sqlite3.OperationalError:
+            return 0
+
     def init_db(db_string):
         """
-        Initializes the database by creating necessary tables if they don't exist
-        and ensuring a default admin user is present.
+        Bring the database schema up to date by applying the pending migrations
+        listed in MIGRATIONS, in order. On an up-to-date database this costs a
+        single SELECT on schema_version.
         """
         conn = db.get_db_connection(db_string)
         cur = conn.cursor()
+        if stg.is_postgres(db_string):
+            try:
+                stg.init_postgres(cur, MIGRATIONS[-1][0], [name for _, name, _ in MIGRATIONS])
+                conn.commit()
+            finally:
+                conn.close()
+            return
+        try:
+            if db.schema_version(cur) >= MIGRATIONS[-1][0]:
+                return
+            # Lock in scrittura e ricontrolla: un altro worker potrebbe aver migrato nel frattempo
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            current = db.schema_version(cur)
+            for version, name, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                step(cur)
+                cur.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    # === MIGRATIONS ===
+    # Ogni step riceve il cursore ed è eseguito nella transazione di init_db.
+    # Non modificare gli step già rilasciati: aggiungerne uno nuovo in coda a MIGRATIONS.
+
+    def _m001_baseline(cur):
+        """
+        Schema originale (users, items, global_catalog, prezzi globali, admin di default).
+        Idempotente, così può essere applicato anche a database creati prima delle migrazioni.
+        """
         # Create users table
         cur.execute(
             """
@@ -111,34 +222,8 @@ class db():
         );
         """)
         
-        # eBay price history per-item (one record per day)
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS ebay_price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                item_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
-                avg REAL,
-                median REAL,
-                min REAL,
-                max REAL,
-                count INTEGER,
-                currency TEXT,
-                keywords TEXT,
-                site_id TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(item_id, date)
-            )
-            """
-        )
-
-        # --- DROP ebay_price_history se esiste ---
-        cur.execute("""
-            SELECT name FROM sqlite_master WHERE type='table' AND name='ebay_price_history'
-                    """)
-        if cur.fetchone():
-            cur.execute("DROP TABLE ebay_price_history")
-
+        # ebay_price_history non è più usata (sostituita da item_price_history): rimuovila dai database esistenti
+        cur.execute("DROP TABLE IF EXISTS ebay_price_history")
 
         # Attempt to add missing columns for backward compatibility. This ensures that
         # databases created before new fields were introduced continue to work.
@@ -204,5 +289,257 @@ class db():
         cur.execute("CREATE INDEX IF NOT EXISTS idx_gcp_gid_date ON global_catalog_prices(global_id, ref_date)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_gcp_source ON global_catalog_prices(source)")
 
-        conn.commit()
-        conn.close()
\ No newline at end of file
+    def _m002_item_revisions(cur):
+        # Revisione per utente della collezione (ETag / sync incrementale di /api/items)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS item_revisions (
+                user_id INTEGER PRIMARY KEY,
+                rev INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+        # Change log per la sync incrementale: ultima modifica per (user_id, item_id)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS item_changes (
+                user_id INTEGER NOT NULL,
+                item_id INTEGER NOT NULL,
+                rev INTEGER NOT NULL,
+                op TEXT NOT NULL,                -- 'upsert' | 'delete'
+                PRIMARY KEY (user_id, item_id)
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_item_changes_user_rev ON item_changes(user_id, rev)")
+
+    def _m003_finance_snapshots(cur):
+        # --- Dashboard snapshots (manual/optional) ---
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_finance_daily (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                spent REAL DEFAULT 0,
+                sold  REAL DEFAULT 0,
+                items_bought INTEGER DEFAULT 0,
+                items_sold   INTEGER DEFAULT 0,
+                inventory_value REAL DEFAULT 0,
+                note TEXT
+            )
+        """)
+
+
+    def _m004_global_catalog_fts(cur):
+        # Indice full-text (trigram) per la ricerca nel catalogo globale: external content
+        # su global_catalog, allineato dai trigger su insert/update/delete.
+        cols = ', '.join(GC_FTS_COLUMNS)
+        new_vals = ', '.join(f'new.{c}' for c in GC_FTS_COLUMNS)
+        old_vals = ', '.join(f'old.{c}' for c in GC_FTS_COLUMNS)
+        cur.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS global_catalog_fts USING fts5(
+                {cols}, content='global_catalog', content_rowid='id', tokenize='trigram'
+            )
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_gc_fts_ai AFTER INSERT ON global_catalog BEGIN
+                INSERT INTO global_catalog_fts (rowid, {cols}) VALUES (new.id, {new_vals});
+            END
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_gc_fts_ad AFTER DELETE ON global_catalog BEGIN
+                INSERT INTO global_catalog_fts (global_catalog_fts, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+            END
+        """)
+        # solo le colonne indicizzate: gli UPDATE di updated_at/info_links non toccano l'indice
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_gc_fts_au AFTER UPDATE OF {cols} ON global_catalog BEGIN
+                INSERT INTO global_catalog_fts (global_catalog_fts, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+                INSERT INTO global_catalog_fts (rowid, {cols}) VALUES (new.id, {new_vals});
+            END
+        """)
+        cur.execute("INSERT INTO global_catalog_fts (global_catalog_fts) VALUES ('rebuild')")
+
+    def _m005_items_indexes(cur):
+        # Ogni query per utente filtra su items.user_id: senza indici era sempre SCAN items.
+        # Gli indici (user_id, data, importo) coprono anche gli aggregati di dashboard/trend.
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_items_user_purchase ON items(user_id, purchase_date, purchase_price_curr_ref)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_items_user_sale ON items(user_id, sale_date, sale_price)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_items_global ON items(global_id)")
+        cur.execute("ANALYZE items")
+
+    def _m006_catalog_link_runs(cur):
+        # Stato del linker batch items -> global_catalog (gc.link_items), per riprendere un run interrotto
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_link_runs (
+                scope TEXT PRIMARY KEY,          -- 'all' | 'user:<id>'
+                last_item_id INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                scanned INTEGER NOT NULL DEFAULT 0,
+                linked INTEGER NOT NULL DEFAULT 0,
+                created INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'running',   -- 'running' | 'done'
+                started_at TEXT,
+                updated_at TEXT
+            )
+        """)
+
+    def _m007_global_catalog_identifiers(cur):
+        # Indice (kind, value) -> global_id di tutti gli identificatori forti noti di una voce:
+        # un solo lookup indicizzato trova la voce per qualsiasi identificatore, non solo per catalog_key.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS global_catalog_identifiers (
+                kind TEXT NOT NULL,              -- nome della colonna ident_* senza prefisso (ean, discogs_id, ...)
+                value TEXT NOT NULL,
+                global_id INTEGER NOT NULL,
+                PRIMARY KEY (kind, value)
+            ) WITHOUT ROWID
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_gci_global_id ON global_catalog_identifiers(global_id)")
+        kinds = [c for c in GC_FTS_COLUMNS if c.startswith('ident_')]
+        for col in kinds:
+            cur.execute(f"""
+                INSERT OR IGNORE INTO global_catalog_identifiers (kind, value, global_id)
+                SELECT '{col[6:]}', {col}, id FROM global_catalog WHERE {col} IS NOT NULL AND {col} <> '' ORDER BY id
+            """)
+        # Allineamento automatico: un identificatore già noto resta della voce che l'ha registrato per prima
+        inserts = '\n'.join(
+            f"INSERT OR IGNORE INTO global_catalog_identifiers (kind, value, global_id) "
+            f"SELECT '{col[6:]}', new.{col}, new.id WHERE new.{col} IS NOT NULL AND new.{col} <> '';"
+            for col in kinds
+        )
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_gci_ai AFTER INSERT ON global_catalog BEGIN\n{inserts}\nEND")
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_gci_au AFTER UPDATE OF {', '.join(kinds)} ON global_catalog BEGIN\n{inserts}\nEND")
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_gci_ad AFTER DELETE ON global_catalog BEGIN
+                DELETE FROM global_catalog_identifiers WHERE global_id = old.id;
+            END
+        """)
+
+    def _m008_catalog_duplicates(cur):
+        # Coppie candidate duplicate del catalogo globale trovate da ddp.find_duplicates (a_id < b_id)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_duplicate_candidates (
+                a_id INTEGER NOT NULL,
+                b_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                name_sim REAL,
+                params_sim REAL,
+                status TEXT NOT NULL DEFAULT 'open',   -- 'open' | 'merged' | 'dismissed'
+                created_at TEXT,
+                PRIMARY KEY (a_id, b_id)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_cdc_status_score ON catalog_duplicate_candidates(status, score)")
+
+    def _m009_provider_resolution_cache(cur):
+        # Cache delle risoluzioni costose presso i provider (es. ricerca Discogs -> release),
+        # chiave = provider + hash dei parametri normalizzati (hlp.cache_key)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS provider_resolution_cache (
+                provider TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                value TEXT NOT NULL,             -- JSON
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (provider, cache_key)
+            ) WITHOUT ROWID
+        """)
+
+    def _m010_pricecharting_guide(cur):
+        # Price guide PriceCharting importata da CSV (pcg.import_csv): gli stimatori la consultano
+        # prima dell'API. Prezzi in centesimi USD come nel CSV; upc senza zeri iniziali (pcg.norm_upc).
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pricecharting_guide (
+                id INTEGER PRIMARY KEY,          -- id prodotto PriceCharting
+                product_name TEXT NOT NULL,
+                console_name TEXT,
+                norm_title TEXT NOT NULL,
+                norm_console TEXT NOT NULL,
+                upc TEXT,
+                loose_price INTEGER,
+                cib_price INTEGER,
+                new_price INTEGER,
+                graded_price INTEGER,
+                box_only_price INTEGER,
+                manual_only_price INTEGER,
+                retail_loose_sell INTEGER,
+                retail_cib_sell INTEGER,
+                retail_new_sell INTEGER,
+                sales_volume INTEGER,
+                release_date TEXT,
+                imported_at TEXT
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pcg_upc ON pricecharting_guide(upc) WHERE upc IS NOT NULL")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pcg_title ON pricecharting_guide(norm_title, norm_console)")
+
+    def _m011_item_price_history(cur):
+        # Storico prezzi per item (phs): una riga per (item, fonte, giorno); day = giorni dal 1970-01-01,
+        # span = 1/7/30 per le righe giornaliere o accorpate per settimana/mese (phs.compact)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS item_price_history (
+                item_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                span INTEGER NOT NULL DEFAULT 1,
+                samples INTEGER,
+                avg REAL,
+                median REAL,
+                min REAL,
+                max REAL,
+                currency TEXT,
+                PRIMARY KEY (item_id, source, day)
+            ) WITHOUT ROWID
+        """)
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_iph_item_ad AFTER DELETE ON items BEGIN
+                DELETE FROM item_price_history WHERE item_id = old.id;
+            END
+        """)
+
+    def _m012_price_sketches(cur):
+        # t-digest serializzato (skt.from_samples) dei prezzi grezzi di ogni snapshot: i percentili
+        # si ottengono fondendo gli sketch di più giorni/fonti senza conservare i campioni
+        cur.execute("PRAGMA table_info(global_catalog_prices)")
+        if 'sketch' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE global_catalog_prices ADD COLUMN sketch BLOB")
+
+    def _m013_users_profile_version(cur):
+        # Versione del profilo utente, incrementata a ogni modifica: invalida le copie in cache (ucx)
+        cur.execute("PRAGMA table_info(users)")
+        if 'profile_version' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE users ADD COLUMN profile_version INTEGER NOT NULL DEFAULT 0")
+
+    def _m014_price_currency(cur):
+        # Valuta dei prezzi di ogni snapshot: gli sketch di fonti/siti diversi vanno convertiti prima
+        # del merge. Gli snapshot esistenti restano senza valuta (non usati da hlp.price_percentiles)
+        cur.execute("PRAGMA table_info(global_catalog_prices)")
+        if 'currency' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE global_catalog_prices ADD COLUMN currency TEXT")
+
+    def _m015_catalog_generation(cur):
+        # Generazione del catalogo globale, incrementata da ogni operazione che cancella/rimappa voci
+        # (ddp.merge): invalida le LRU di risoluzione (gc) di tutti i processi
+        cur.execute("CREATE TABLE IF NOT EXISTS catalog_generation (id INTEGER PRIMARY KEY CHECK (id = 1), gen INTEGER NOT NULL)")
+        cur.execute("INSERT OR IGNORE INTO catalog_generation (id, gen) VALUES (1, 0)")
+
+# (version, name, step) in ordine di applicazione
+MIGRATIONS = [
+    (1, 'baseline', db._m001_baseline),
+    (2, 'item_revisions', db._m002_item_revisions),
+    (3, 'finance_snapshots', db._m003_finance_snapshots),
+    (4, 'global_catalog_fts', db._m004_global_catalog_fts),
+    (5, 'items_indexes', db._m005_items_indexes),
+    (6, 'catalog_link_runs', db._m006_catalog_link_runs),
+    (7, 'global_catalog_identifiers', db._m007_global_catalog_identifiers),
+    (8, 'catalog_duplicates', db._m008_catalog_duplicates),
+    (9, 'provider_resolution_cache', db._m009_provider_resolution_cache),
+    (10, 'pricecharting_guide', db._m010_pricecharting_guide),
+    (11, 'item_price_history', db._m011_item_price_history),
+    (12, 'price_sketches', db._m012_price_sketches),
+    (13, 'users_profile_version', db._m013_users_profile_version),
+    (14, 'price_currency', db._m014_price_currency),
+    (15, 'catalog_generation', db._m015_catalog_generation),
+]
@@ -0,0 +1,281 @@
+import json
+import random
+import re
+import time
+import unicodedata
+import zlib
+from datetime import datetime
+from app.db import db
+from app.globalcatalog import gc, IDENT_COLUMNS
+from app.revisions import rev
+from app.storage import stg
+from app.sharding import shd
+
+# MinHash/LSH: NUM_PERM = BANDS * ROWS. Con 16 bande da 4 righe una coppia con Jaccard s
+# diventa candidata con probabilità 1 - (1 - s^4)^16 (~50% a s=0.5, >99% a s=0.8).
+NUM_PERM = 64
+BANDS = 16
+ROWS = 4
+MIN_SCORE = 0.6
+# Bucket più grandi di così (nomi generici) generano coppie inutili: si confronta solo il prefisso
+MAX_BUCKET = 50
+SHINGLE = 3
+# Chiavi dei market_params che non contano come parametri: duplicano il nome o sono
+# identificatori forti (confrontati a parte, vedi ddp.conflicting)
+SKIP_KEYS = ('title', 'name', 'album', 'serial', 'serial_number', 'ean', 'barcode', 'upc', 'tcgplayer_id',
+             'justtcg_id', 'discogs_release_id', 'discogs_master_id', 'pricecharting_id', 'set_number',
+             'stockx_slug', 'stockx_urlKey')
+
+_PRIME = (1 << 61) - 1
+
+
+class ddp():
+    """
+    Ricerca offline di voci quasi duplicate in global_catalog (es. chiavi "sig:" nate da nomi
+    leggermente diversi) e merge amministrativo.
+
+    find_duplicates: firma MinHash per voce su shingle del nome normalizzato + token dei
+    market_params, blocking LSH per categoria (niente confronto O(n²)), punteggio esatto sulle
+    coppie candidate e salvataggio in catalog_duplicate_candidates.
+    merge: riassegna items e prezzi della voce assorbita in un'unica transazione.
+    """
+
+    def normalize_name(name: str) -> str:
+        text = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().lower()
+        return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+    def features(row) -> tuple:
+        """(shingle del nome, token dei parametri, identificatori forti) di una voce."""
+        name = ddp.normalize_name(row['canonical_name'])
+        padded = f' {name} '
+        shingles = {padded[i:i + SHINGLE] for i in range(max(1, len(padded) - SHINGLE + 1))}
+        try:
+            mp = json.loads(row['market_params'] or '{}')
+        except (TypeError, ValueError):
+            mp = {}
+        params = set()
+        if isinstance(mp, dict):
+            for k, v in mp.items():
+                if k in SKIP_KEYS or v in (None, '') or isinstance(v, (dict, list)):
+                    continue
+                # token per parola: 'The Beatles' e 'Beatles' restano simili
+                params.update(f'{k}:{word}' for word in ddp.normalize_name(str(v)).split())
+        idents = {c: row[c] for c in IDENT_COLUMNS if row[c]}
+        return shingles, params, idents
+
+    def permutations(num_perm: int, seed: int = 1) -> list:
+        rnd = random.Random(seed)
+        return [(rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def minhash(tokens, perms: list) -> tuple:
+        hashes = [zlib.crc32(t.encode('utf-8')) for t in tokens] or [0]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in perms)
+
+    def jaccard(a: set, b: set):
+        if not a and not b:
+            return None
+        return len(a & b) / len(a | b)
+
+    def conflicting(a: dict, b: dict) -> bool:
+        """Due voci con lo stesso tipo di identificatore forte ma valori diversi sono prodotti diversi."""
+        return any(a[c] != b[c] for c in a.keys() & b.keys())
+
+    def score(fa: tuple, fb: tuple) -> tuple:
+        name_sim = ddp.jaccard(fa[0], fb[0]) or 0.0
+        params_sim = ddp.jaccard(fa[1], fb[1])
+        total = name_sim if params_sim is None else 0.7 * name_sim + 0.3 * params_sim
+        return total, name_sim, params_sim
+
+    def find_duplicates(db_string, min_score: float = MIN_SCORE, bands: int = BANDS, rows: int = ROWS,
+                        category: str = None, progress=None) -> dict:
+        """
+        Calcola le coppie candidate e sostituisce quelle 'open' in catalog_duplicate_candidates
+        (le coppie già 'dismissed' o 'merged' non vengono riproposte). Ritorna un riepilogo.
+        """
+        t0 = time.perf_counter()
+        perms = ddp.permutations(bands * rows)
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        sql = f"SELECT id, canonical_name, category, market_params, {', '.join(IDENT_COLUMNS)} FROM global_catalog"
+        params = []
+        if category:
+            sql += " WHERE LOWER(category) = ?"; params.append(category.lower())
+        cur.execute(sql, params)
+
+        feats, buckets, n = {}, {}, 0
+        for row in cur:
+            f = ddp.features(row)
+            feats[row['id']] = f
+            sig = ddp.minhash(f[0] | f[1], perms)
+            cat = (row['category'] or '').lower()
+            for band in range(bands):
+                buckets.setdefault((cat, band, sig[band * rows:(band + 1) * rows]), []).append(row['id'])
+            n += 1
+            if progress and n % 10000 == 0:
+                progress({'phase': 'signatures', 'entries': n})
+
+        pairs = set()
+        for ids in buckets.values():
+            if len(ids) < 2:
+                continue
+            ids = ids[:MAX_BUCKET]
+            for i in range(len(ids)):
+                for j in range(i + 1, len(ids)):
+                    a, b = ids[i], ids[j]
+                    pairs.add((a, b) if a < b else (b, a))
+
+        found = []
+        for a, b in pairs:
+            fa, fb = feats[a], feats[b]
+            if ddp.conflicting(fa[2], fb[2]):
+                continue
+            total, name_sim, params_sim = ddp.score(fa, fb)
+            if total >= min_score:
+                found.append((a, b, round(total, 4), round(name_sim, 4),
+                              None if params_sim is None else round(params_sim, 4)))
+
+        now = datetime.now().isoformat()
+        cur.execute("DELETE FROM catalog_duplicate_candidates WHERE status = 'open'")
+        cur.executemany("""
+            INSERT INTO catalog_duplicate_candidates (a_id, b_id, score, name_sim, params_sim, status, created_at)
+            VALUES (?, ?, ?, ?, ?, 'open', ?)
+            ON CONFLICT DO NOTHING
+        """, [(*f, now) for f in found])
+        conn.commit()
+        cur.execute("SELECT COUNT(*) FROM catalog_duplicate_candidates WHERE status = 'open'")
+        stored = cur.fetchone()[0]
+        conn.close()
+        return {'entries': n, 'candidate_pairs': len(pairs), 'above_threshold': len(found), 'stored': stored,
+                'seconds': round(time.perf_counter() - t0, 2)}
+
+    def list_candidates(cur, status: str = 'open', limit: int = 100, db_string=None) -> list:
+        cur.execute("""
+            SELECT c.a_id, a.canonical_name AS a_name, c.b_id, b.canonical_name AS b_name, COALESCE(a.category, b.category) AS category,
+                   c.score, c.name_sim, c.params_sim, c.status,
+                   (SELECT COUNT(*) FROM items WHERE global_id = c.a_id) AS a_items,
+                   (SELECT COUNT(*) FROM items WHERE global_id = c.b_id) AS b_items
+            FROM catalog_duplicate_candidates c
+            LEFT JOIN global_catalog a ON a.id = c.a_id   -- dopo un merge una delle due voci non esiste più
+            LEFT JOIN global_catalog b ON b.id = c.b_id
+            WHERE c.status = ?
+            ORDER BY c.score DESC LIMIT ?
+        """, (status, limit))
+        rows = [dict(r) for r in cur.fetchall()]
+        if rows and db_string and shd.enabled(db_string):
+            # items negli shard: i conteggi della query (tabella items condivisa) vanno rifatti
+            gids = list({r['a_id'] for r in rows} | {r['b_id'] for r in rows})
+            counts = dict.fromkeys(gids, 0)
+            for path in shd.all(db_string):
+                sconn = db.get_db_connection(path)
+                for gid, n in sconn.execute(f"SELECT global_id, COUNT(*) FROM items WHERE global_id IN "
+                                            f"({','.join('?' * len(gids))}) GROUP BY global_id", gids).fetchall():
+                    counts[gid] += n
+                sconn.close()
+            for r in rows:
+                r['a_items'], r['b_items'] = counts[r['a_id']], counts[r['b_id']]
+        return rows
+
+    def dismiss(cur, a_id: int, b_id: int) -> bool:
+        a_id, b_id = min(a_id, b_id), max(a_id, b_id)
+        cur.execute("UPDATE catalog_duplicate_candidates SET status = 'dismissed' WHERE a_id = ? AND b_id = ?", (a_id, b_id))
+        return cur.rowcount > 0
+
+    def _move_items(cur, keep_id: int, merge_ids: list) -> int:
+        """Sposta items.global_id da merge_ids a keep_id (con revisione per utente); ritorna gli items spostati."""
+        marks = ','.join('?' * len(merge_ids))
+        cur.execute(f"SELECT id, user_id FROM items WHERE global_id IN ({marks})", merge_ids)
+        by_user = {}
+        for item_id, user_id in cur.fetchall():
+            by_user.setdefault(user_id, []).append(item_id)
+        cur.execute(f"UPDATE items SET global_id = ? WHERE global_id IN ({marks})", [keep_id, *merge_ids])
+        moved = cur.rowcount
+        rev.bump_many(cur, by_user)
+        return moved
+
+    def merge(db_string, keep_id: int, merge_ids: list) -> dict:
+        """
+        Fonde le voci merge_ids in keep_id in un'unica transazione (con lo sharding gli items
+        vengono spostati subito dopo, una transazione per shard):
+        - items.global_id e global_catalog_prices passano a keep_id (in caso di snapshot dello
+          stesso giorno/fonte vince quello di keep_id);
+        - identificatori e catalog_key delle voci assorbite restano risolvibili verso keep_id
+          (global_catalog_identifiers, kind 'key'), così non si ricreano al prossimo ensure;
+        - info_links uniti, voci assorbite cancellate, candidate aggiornate.
+        """
+        merge_ids = sorted({int(m) for m in merge_ids} - {int(keep_id)})
+        if not merge_ids:
+            raise ValueError('merge_ids must contain at least one id different from keep_id')
+        marks = ','.join('?' * len(merge_ids))
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        try:
+            cur.execute(stg.dialect(cur).begin_write)
+            cur.execute(f"SELECT id, catalog_key, info_links FROM global_catalog WHERE id IN (?, {marks})", [keep_id, *merge_ids])
+            entries = {r['id']: r for r in cur.fetchall()}
+            missing = [i for i in [keep_id, *merge_ids] if i not in entries]
+            if missing:
+                raise LookupError(f'global catalog entries not found: {missing}')
+
+            # con lo sharding gli items si spostano shard per shard dopo il commit del catalogo
+            sharded = shd.enabled(db_string)
+            items_moved = 0 if sharded else ddp._move_items(cur, keep_id, merge_ids)
+
+            # prima via gli snapshot che violerebbero UNIQUE(global_id, ref_date, source): quelli già
+            # presenti su keep_id e, tra le voci assorbite, tutti tranne il primo (così basta un UPDATE semplice, portabile anche su PostgreSQL)
+            cur.execute(f"""
+                DELETE FROM global_catalog_prices
+                WHERE global_id IN ({marks}) AND (
+                    EXISTS (SELECT 1 FROM global_catalog_prices k
+                            WHERE k.global_id = ? AND k.ref_date = global_catalog_prices.ref_date
+                              AND k.source = global_catalog_prices.source)
+                    OR EXISTS (SELECT 1 FROM global_catalog_prices o
+                               WHERE o.global_id IN ({marks}) AND o.id < global_catalog_prices.id
+                                 AND o.ref_date = global_catalog_prices.ref_date
+                                 AND o.source = global_catalog_prices.source))
+            """, [*merge_ids, keep_id, *merge_ids])
+            cur.execute(f"UPDATE global_catalog_prices SET global_id = ? WHERE global_id IN ({marks})", [keep_id, *merge_ids])
+            prices_moved = cur.rowcount
+
+            # PRIMARY KEY (kind, value): spostare global_id non può collidere
+            cur.execute(f"UPDATE global_catalog_identifiers SET global_id = ? WHERE global_id IN ({marks})", [keep_id, *merge_ids])
+            cur.executemany("""
+                INSERT INTO global_catalog_identifiers (kind, value, global_id) VALUES ('key', ?, ?)
+                ON CONFLICT(kind, value) DO UPDATE SET global_id = excluded.global_id
+            """, [(entries[m]['catalog_key'], keep_id) for m in merge_ids if entries[m]['catalog_key']])
+
+            links = []
+            for i in [keep_id, *merge_ids]:
+                try:
+                    for link in json.loads(entries[i]['info_links'] or '[]'):
+                        if link not in links:
+                            links.append(link)
+                except (TypeError, ValueError):
+                    pass
+            cur.execute("UPDATE global_catalog SET info_links = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(links, ensure_ascii=False), datetime.utcnow().isoformat(), keep_id))
+            cur.execute(f"DELETE FROM global_catalog WHERE id IN ({marks})", merge_ids)
+            # invalida le LRU di risoluzione degli altri worker (gc.generation)
+            cur.execute("UPDATE catalog_generation SET gen = gen + 1 WHERE id = 1")
+
+            cur.executemany("UPDATE catalog_duplicate_candidates SET status = 'merged' WHERE a_id = ? AND b_id = ?",
+                            [(min(keep_id, m), max(keep_id, m)) for m in merge_ids])
+            cur.execute(f"""
+                DELETE FROM catalog_duplicate_candidates
+                WHERE status <> 'merged' AND (a_id IN ({marks}) OR b_id IN ({marks}))
+            """, [*merge_ids, *merge_ids])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if sharded:
+            for path in shd.all(db_string):
+                sconn = db.get_db_connection(path); scur = sconn.cursor()
+                try:
+                    scur.execute(stg.dialect(scur).begin_write)
+                    items_moved += ddp._move_items(scur, keep_id, merge_ids)
+                    sconn.commit()
+                finally:
+                    sconn.close()
+        gc.cache_clear()
+        return {'keep_id': keep_id, 'merged_ids': merge_ids, 'items_moved': items_moved, 'prices_moved': prices_moved}
+
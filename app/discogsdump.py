@@ -0,0 +1,196 @@
+from app.db import db
+from app.globalcatalog import gc, IDENT_COLUMNS
+from datetime import datetime
+import gzip
+import json
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+# Release per transazione durante l'import del dump
+DUMP_BATCH = 10000
+# Release per lookup raggruppato degli identificatori già noti (gc.find_many)
+LOOKUP_CHUNK = 500
+# Formati Discogs -> categoria del catalogo globale; gli altri formati vengono saltati
+FORMAT_CATEGORIES = {'vinyl': 'vinyl', 'cd': 'cd'}
+
+
+class dsd():
+    """
+    Import del dump mensile delle release Discogs (discogs_YYYYMMDD_releases.xml[.gz]) in global_catalog.
+
+    Il file viene letto con iterparse e ogni <release> viene svuotata appena letta, insieme alla
+    radice, così la memoria resta costante anche su dump da decine di GB. Le voci hanno
+    catalog_key 'discogs:<id>' e ident_discogs_id/ident_ean valorizzati; quelle già presenti per
+    uno qualsiasi degli identificatori non vengono ricreate. Una transazione ogni DUMP_BATCH
+    release; lo stato sta in catalog_link_runs (scope 'discogs-dump:<file>'), per riprendere
+    un import interrotto dalla release successiva all'ultimo blocco salvato.
+    """
+
+    def scope(path: str) -> str:
+        return f"discogs-dump:{os.path.basename(path)}"
+
+    def open_dump(path: str):
+        return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+    def iter_releases(fh):
+        """Genera gli elementi <release> completi, liberando la memoria di quelli già letti."""
+        root = None
+        for event, elem in ET.iterparse(fh, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event == 'end' and elem.tag == 'release':
+                yield elem
+                elem.clear()
+                root.clear()
+
+    def barcode(elem):
+        for ident in elem.iterfind('identifiers/identifier'):
+            if (ident.get('type') or '').lower() == 'barcode':
+                digits = re.sub(r'\D', '', ident.get('value') or '')
+                if len(digits) in (12, 13):
+                    return digits
+        return None
+
+    def parse_release(elem, formats: dict):
+        """(catalog_key, category, canonical_name, market_params, idmap) di una release, o None se da saltare."""
+        rid = (elem.get('id') or '').strip()
+        title = (elem.findtext('title') or '').strip()
+        if not rid or not title:
+            return None
+        fmt = next((f.get('name') for f in elem.iterfind('formats/format')
+                    if (f.get('name') or '').lower() in formats), None)
+        if fmt is None:
+            return None
+        artists = [(a.findtext('name') or '').strip() for a in elem.iterfind('artists/artist')]
+        artist = ', '.join(a for a in artists if a)
+        label = elem.find('labels/label')
+        released = (elem.findtext('released') or '').strip()
+        ean = dsd.barcode(elem)
+        mp = {
+            'artist': artist or None,
+            'album': title,
+            'year': released[:4] if released[:4].isdigit() else None,
+            'country': (elem.findtext('country') or '').strip() or None,
+            'label': label.get('name') if label is not None else None,
+            'catno': label.get('catno') if label is not None else None,
+            'format': fmt,
+            'discogs_release_id': rid,
+            'ean': ean,
+        }
+        mp = {k: v for k, v in mp.items() if v}
+        idmap = {'ident_discogs_id': rid, 'ident_ean': ean}
+        name = f"{artist} - {title}" if artist else title
+        return f"discogs:{rid}", formats[fmt.lower()], name, mp, idmap
+
+    def import_dump(db_string, path: str, batch_size: int = DUMP_BATCH, formats: dict = None,
+                    max_releases: int = None, restart: bool = False, progress=None) -> dict:
+        """
+        Importa (o riprende) il dump. max_releases limita le release lette in questa esecuzione
+        (utile per import a tappe). Ritorna lo stato del run con il throughput di questa esecuzione.
+        """
+        formats = formats or FORMAT_CATEGORIES
+        scope = dsd.scope(path)
+        now = datetime.now().isoformat()
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        cur.execute("SELECT * FROM catalog_link_runs WHERE scope = ?", (scope,))
+        row = cur.fetchone()
+        if row is None or row['status'] == 'done' or restart:
+            # last_item_id = ultimo id release salvato, scanned = release lette (posizione di ripresa),
+            # linked = release già presenti nel catalogo, created = voci nuove, skipped = altri formati
+            state = {'scope': scope, 'last_item_id': 0, 'total': 0, 'scanned': 0, 'linked': 0,
+                     'created': 0, 'skipped': 0, 'status': 'running', 'started_at': now, 'updated_at': now}
+            cur.execute("""
+                INSERT INTO catalog_link_runs
+                    (scope, last_item_id, total, scanned, linked, created, skipped, status, started_at, updated_at)
+                VALUES (:scope, :last_item_id, :total, :scanned, :linked, :created, :skipped, :status, :started_at, :updated_at)
+                ON CONFLICT(scope) DO UPDATE SET
+                    last_item_id = excluded.last_item_id, total = excluded.total, scanned = excluded.scanned,
+                    linked = excluded.linked, created = excluded.created, skipped = excluded.skipped,
+                    status = excluded.status, started_at = excluded.started_at, updated_at = excluded.updated_at
+            """, state)
+            conn.commit()
+        else:
+            state = dict(row)
+
+        cols = ', '.join(IDENT_COLUMNS)
+        insert_sql = f"""
+            INSERT INTO global_catalog (catalog_key, canonical_name, category, identifiers, market_params,
+                info_links, created_at, updated_at, {cols})
+            VALUES ({', '.join('?' * (8 + len(IDENT_COLUMNS)))})
+            ON CONFLICT(catalog_key) DO NOTHING
+        """
+
+        def flush(batch: list, last_id: str, read: int):
+            for i in range(0, len(batch), LOOKUP_CHUNK):
+                chunk = batch[i:i + LOOKUP_CHUNK]
+                pairs = [[('discogs_id', r[4]['ident_discogs_id'])] + ([('ean', r[4]['ident_ean'])] if r[4]['ident_ean'] else [])
+                         + [('key', r[0])] for r in chunk]
+                known = gc.find_many(cur, {p for ps in pairs for p in ps})
+                keys = {r[0] for r, ps in zip(chunk, pairs) if not any(p in known for p in ps)}
+                if keys:
+                    cur.execute(f"SELECT catalog_key FROM global_catalog WHERE catalog_key IN ({','.join('?' * len(keys))})", list(keys))
+                    existing = {k for (k,) in cur.fetchall()}
+                else:
+                    existing = set()
+                rows, seen = [], set()
+                for r in chunk:
+                    key, category, name, mp, idmap = r
+                    if key not in keys or key in existing or key in seen:
+                        state['linked'] += 1
+                        continue
+                    seen.add(key)
+                    mp_json = json.dumps(mp, ensure_ascii=False)
+                    rows.append((key, name, category, mp_json, mp_json, '[]', now, now,
+                                 *[idmap.get(c) for c in IDENT_COLUMNS]))
+                cur.executemany(insert_sql, rows)
+                state['created'] += len(rows)
+            state['scanned'] += read
+            state['last_item_id'] = int(last_id) if str(last_id).isdigit() else state['last_item_id']
+            state['updated_at'] = datetime.now().isoformat()
+            cur.execute("""
+                UPDATE catalog_link_runs SET last_item_id = :last_item_id, scanned = :scanned, linked = :linked,
+                    created = :created, skipped = :skipped, updated_at = :updated_at
+                WHERE scope = :scope
+            """, state)
+            conn.commit()
+
+        t0 = time.perf_counter()
+        resume_at, position, read, this_run = state['scanned'], 0, 0, 0
+        batch, last_id, finished = [], None, True
+        fh = dsd.open_dump(path)
+        try:
+            for elem in dsd.iter_releases(fh):
+                position += 1
+                if position <= resume_at:
+                    continue  # già importata da un'esecuzione precedente
+                if max_releases is not None and this_run >= max_releases:
+                    finished = False
+                    break
+                this_run += 1
+                read += 1
+                last_id = elem.get('id')
+                parsed = dsd.parse_release(elem, formats)
+                if parsed is None:
+                    state['skipped'] += 1
+                else:
+                    batch.append(parsed)
+                if read >= batch_size:
+                    flush(batch, last_id, read)
+                    batch, read = [], 0
+                    if progress:
+                        progress({**state, 'rows_per_s': round(this_run / (time.perf_counter() - t0), 1)})
+            if read:
+                flush(batch, last_id, read)
+            if finished:
+                state['status'] = 'done'
+                cur.execute("UPDATE catalog_link_runs SET status = 'done', updated_at = ? WHERE scope = ?",
+                            (datetime.now().isoformat(), scope))
+                conn.commit()
+        finally:
+            fh.close()
+            conn.close()
+        secs = time.perf_counter() - t0
+        return {**state, 'releases_this_run': this_run, 'seconds': round(secs, 2),
+                'rows_per_s': round(this_run / secs, 1) if secs else None}
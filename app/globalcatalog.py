@@ -1,52 +1,427 @@
 from app import hlp,db
+from app.revisions import rev
+from app.storage import stg
+from app.sharding import shd
+from collections import OrderedDict
 from datetime import datetime, date
+from flask import g, has_request_context
+import base64
 import json
+import threading
+
+# Pesi bm25 per colonna di global_catalog_fts (stesso ordine di db.GC_FTS_COLUMNS)
+FTS_WEIGHTS = (10.0, 5.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+# Sotto questa lunghezza il tokenizer trigram non può rispondere: si ripiega su LIKE
+FTS_MIN_QUERY = 3
+
+# Colonne denormalizzate degli identificatori forti (chiavi di hlp.normalize_identifiers)
+IDENT_COLUMNS = ('ident_ean', 'ident_serial', 'ident_tcg_id', 'ident_discogs_id',
+                 'ident_pc_id', 'ident_lego_set', 'ident_stockx_slug')
+# Ordine di priorità degli identificatori (lo stesso di hlp.preferred_catalog_key)
+IDENT_PRIORITY = ('ident_tcg_id', 'ident_lego_set', 'ident_discogs_id', 'ident_stockx_slug',
+                  'ident_pc_id', 'ident_ean', 'ident_serial')
+# LRU (db, kind, value) -> global_id delle risoluzioni recenti, condivisa tra le richieste del worker.
+# Valida per una generazione del catalogo (catalog_generation, letta una volta per richiesta):
+# un merge in un altro worker incrementa la generazione e le voci di questo worker vengono scartate
+RESOLVE_CACHE_SIZE = 4096
+_resolve_cache = OrderedDict()
+_resolve_generation = {}   # db -> generazione a cui si riferiscono le voci in _resolve_cache
+_resolve_lock = threading.Lock()
+
+# Items per chunk del linker batch (8 + 7 parametri per riga nell'UPSERT multi-riga)
+LINK_CHUNK_SIZE = 500
+LINK_CHUNK_MAX = 2000
+
 
 class gc():
-    def ensure_global_by_identifiers(market_params: str, category: str, hint_name: str = None) -> int:
+    def ensure_global_by_identifiers(db_string, market_params: str, category: str, hint_name: str = None) -> int:
         idmap = hlp.normalize_identifiers(category, market_params)
         catalog_key = hlp.preferred_catalog_key(category, idmap)
+        # ('key', catalog_key): alias delle voci assorbite da un merge (ddp.merge), priorità minima
+        pairs = gc._strong_ids(idmap) + [('key', catalog_key)]
+        is_admin = hlp.is_admin_user()
+        generation = gc.generation(db_string)
+        if not is_admin:
+            gid = gc.cache_get(db_string, pairs, generation)
+            if gid is not None:
+                return gid
+
+        now = datetime.now().isoformat()
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        # Match su qualsiasi identificatore forte già noto (global_catalog_identifiers)
+        gid = gc.find_by_identifiers(cur, pairs)
+        if gid is not None:
+            # UPDATE consentito solo ad admin: aggiunge/aggiorna gli id forti della voce trovata
+            sets = [f"{col}=?" for col in IDENT_COLUMNS if idmap.get(col)]
+            if is_admin and sets:
+                cur.execute(f"UPDATE global_catalog SET {', '.join(sets)}, updated_at=? WHERE id=?",
+                            [idmap[col] for col in IDENT_COLUMNS if idmap.get(col)] + [datetime.utcnow().isoformat(), gid])
+                conn.commit()
+        else:
+            # CREATE (consentito a tutti). Il conflitto su catalog_key resta possibile per le chiavi
+            # "sig:" senza identificatori forti o per una creazione concorrente: in quel caso
+            # l'update è un no-op su updated_at che serve solo a far tornare l'id con RETURNING.
+            cols = ', '.join(IDENT_COLUMNS)
+            cur.execute(f"""
+                INSERT INTO global_catalog (catalog_key, canonical_name, category, identifiers, market_params, info_links,
+                    created_at, updated_at, {cols})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(IDENT_COLUMNS))})
+                ON CONFLICT(catalog_key) DO UPDATE SET updated_at = global_catalog.updated_at
+                RETURNING id
+            """, (
+                catalog_key, hlp.generate_canonical_name(category, hint_name), category,
+                market_params, market_params, json.dumps([], ensure_ascii=False), now, now,
+                *[idmap.get(c) for c in IDENT_COLUMNS]
+            ))
+            gid = cur.fetchone()[0]
+            conn.commit()
+        conn.close()
+        gc.cache_put(db_string, pairs, gid, generation)
+        return gid
+
+    # --- lookup per identificatori (global_catalog_identifiers) + LRU in memoria ---
+
+    def _strong_ids(idmap: dict) -> list:
+        """[(kind, value)] degli identificatori presenti, in ordine di priorità (come preferred_catalog_key)."""
+        return [(col[6:], idmap[col]) for col in IDENT_PRIORITY if idmap.get(col)]
+
+    def find_by_identifiers(cur, pairs: list):
+        """global_id della voce che possiede uno degli identificatori (il più prioritario vince), o None."""
+        if not pairs:
+            return None
+        where = ' OR '.join(['(kind = ? AND value = ?)'] * len(pairs))
+        order = ' '.join(f"WHEN '{col[6:]}' THEN {i}" for i, col in enumerate(IDENT_PRIORITY))
+        cur.execute(f"""
+            SELECT global_id FROM global_catalog_identifiers WHERE {where}
+            ORDER BY CASE kind {order} ELSE {len(IDENT_PRIORITY)} END LIMIT 1
+        """, [v for pair in pairs for v in pair])
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def find_many(cur, pairs) -> dict:
+        """{(kind, value): global_id} per un insieme di identificatori, una query raggruppata per kind."""
+        by_kind = {}
+        for kind, value in pairs:
+            by_kind.setdefault(kind, []).append(value)
+        if not by_kind:
+            return {}
+        where = ' OR '.join(f"(kind = ? AND value IN ({','.join('?' * len(values))}))" for values in by_kind.values())
+        cur.execute(f"SELECT kind, value, global_id FROM global_catalog_identifiers WHERE {where}",
+                    [v for kind, values in by_kind.items() for v in (kind, *values)])
+        return {(kind, value): gid for kind, value, gid in cur.fetchall()}
+
+    def generation(db_string) -> int:
+        """Generazione corrente del catalogo (catalog_generation), letta al più una volta per richiesta."""
+        cached = g.setdefault('_gc_generation', {}) if has_request_context() else {}
+        if db_string not in cached:
+            conn = db.get_db_connection(db_string); cur = conn.cursor()
+            cur.execute("SELECT gen FROM catalog_generation WHERE id = 1")
+            row = cur.fetchone()
+            conn.close()
+            cached[db_string] = row[0] if row else 0
+        return cached[db_string]
+
+    def cache_get(db_string, pairs: list, generation: int):
+        with _resolve_lock:
+            if _resolve_generation.get(db_string) != generation:
+                # catalogo rimappato (anche da un altro processo): le risoluzioni di questo db non valgono più
+                for key in [k for k in _resolve_cache if k[0] == db_string]:
+                    del _resolve_cache[key]
+                _resolve_generation[db_string] = generation
+                return None
+            for pair in pairs:
+                gid = _resolve_cache.get((db_string, pair))
+                if gid is not None:
+                    _resolve_cache.move_to_end((db_string, pair))
+                    return gid
+        return None
+
+    def cache_put(db_string, pairs: list, gid: int, generation: int):
+        with _resolve_lock:
+            if _resolve_generation.get(db_string, generation) != generation:
+                return   # risolto con una generazione ormai superata
+            _resolve_generation[db_string] = generation
+            for pair in pairs:
+                _resolve_cache[(db_string, pair)] = gid
+                _resolve_cache.move_to_end((db_string, pair))
+            while len(_resolve_cache) > RESOLVE_CACHE_SIZE:
+                _resolve_cache.popitem(last=False)
+
+    def cache_clear():
+        """
+        Da chiamare quando cambia l'associazione identificatore -> voce (merge/cancellazione).
+        Svuota solo la cache di questo processo: gli altri worker se ne accorgono dalla
+        generazione del catalogo, che va incrementata nella stessa transazione della modifica.
+        """
+        with _resolve_lock:
+            _resolve_cache.clear()
+            _resolve_generation.clear()
+
+    def _group_by_identifiers(links: list) -> list:
+        """Partiziona i link (vedi link_items) in gruppi che condividono, anche transitivamente, un identificatore."""
+        parent = list(range(len(links)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
 
-        conn = db.get_db_connection(); cur = conn.cursor()
-        # Cerca per catalog_key
-        cur.execute("SELECT id FROM global_catalog WHERE catalog_key = ? LIMIT 1", (catalog_key,))
+        owner = {}
+        for i, link in enumerate(links):
+            for pair in link[3]:
+                j = owner.setdefault(pair, i)
+                if j != i:
+                    parent[find(i)] = find(j)
+        groups = {}
+        for i, link in enumerate(links):
+            groups.setdefault(find(i), []).append(link)
+        return list(groups.values())
+
+    def link_items(db_string, user_id: int = None, chunk_size: int = LINK_CHUNK_SIZE, max_chunks: int = None,
+                   restart: bool = False, progress=None) -> dict:
+        """
+        Collega in batch gli items senza global_id alle voci di global_catalog (tutti gli items o
+        solo quelli di user_id). Per ogni chunk: normalizza gli identificatori, cerca le voci per
+        qualsiasi identificatore noto (global_catalog_identifiers), crea le voci mancanti
+        con un solo UPSERT multi-riga (RETURNING degli id), risolve gli id e aggiorna items.global_id in blocco.
+
+        Il run è riprendibile: lo stato (ultimo item processato e contatori) è salvato in
+        catalog_link_runs a ogni chunk, una nuova chiamata riparte da lì. max_chunks limita il
+        lavoro per chiamata; progress(state) è invocata dopo ogni chunk.
+        Gli items senza identificatori forti non vengono collegati (skipped).
+
+        Con lo sharding gli items si leggono/aggiornano negli shard (id unici tra shard, quindi la
+        ripresa per id resta valida): le voci nuove vengono committate prima dei link negli shard.
+        """
+        scope = f'user:{user_id}' if user_id else 'all'
+        chunk_size = max(1, min(LINK_CHUNK_MAX, int(chunk_size or LINK_CHUNK_SIZE)))
+        where = "global_id IS NULL" + (" AND user_id = ?" if user_id else "")
+        scope_params = (user_id,) if user_id else ()
+        now = datetime.now().isoformat()
+
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        item_dbs = [shd.for_user(db_string, user_id)] if user_id else shd.all(db_string)
+        sharded = item_dbs != [db_string]
+        item_conns = [conn] if not sharded else [db.get_db_connection(path) for path in item_dbs]
+        if restart:
+            cur.execute("DELETE FROM catalog_link_runs WHERE scope = ?", (scope,))
+        cur.execute("SELECT * FROM catalog_link_runs WHERE scope = ?", (scope,))
         row = cur.fetchone()
-        if row:
-            gid = row['id'] if isinstance(row, dict) else row[0]
-            # UPDATE consentito solo ad admin
-            if hlp.is_admin_user():
-                sets = []
-                params = []
-                for col, val in idmap.items():
-                    if val:
-                        sets.append(f"{col}=?"); params.append(val)
-                if sets:
-                    params.extend([datetime.utcnow().isoformat(), gid])
-                    cur.execute(f"UPDATE global_catalog SET {', '.join(sets)}, updated_at=? WHERE id=?", params)
-                    conn.commit()
-            conn.close(); return gid
-
-        # CREATE (consentito a tutti)
-        canonical_name = hlp.generate_canonical_name(category, hint_name)
-        cur.execute("""
-            INSERT INTO global_catalog (catalog_key, canonical_name, category, identifiers, market_params, info_links, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            catalog_key, canonical_name, category,
-            market_params, market_params, json.dumps([], ensure_ascii=False),
-            datetime.now().isoformat(), datetime.now().isoformat()
-        ))
-        gid = cur.lastrowid
-
-        # Denormalizza gli id forti
-        sets = []
+        if row is None or row['status'] == 'done':
+            total = sum(ic.execute(f"SELECT COUNT(*) FROM items WHERE {where}", scope_params).fetchone()[0]
+                        for ic in item_conns)
+            state = {'scope': scope, 'last_item_id': 0, 'total': total, 'scanned': 0, 'linked': 0,
+                     'created': 0, 'skipped': 0, 'status': 'running', 'started_at': now, 'updated_at': now}
+            cur.execute("""
+                INSERT INTO catalog_link_runs
+                    (scope, last_item_id, total, scanned, linked, created, skipped, status, started_at, updated_at)
+                VALUES (:scope, :last_item_id, :total, :scanned, :linked, :created, :skipped, :status, :started_at, :updated_at)
+                ON CONFLICT(scope) DO UPDATE SET
+                    last_item_id = excluded.last_item_id, total = excluded.total, scanned = excluded.scanned,
+                    linked = excluded.linked, created = excluded.created, skipped = excluded.skipped,
+                    status = excluded.status, started_at = excluded.started_at, updated_at = excluded.updated_at
+            """, state)
+            conn.commit()
+        else:
+            state = dict(row)
+
+        cols = ', '.join(IDENT_COLUMNS)
+        row_sql = f"({', '.join('?' * (8 + len(IDENT_COLUMNS)))})"
+        chunks = 0
+        try:
+            while max_chunks is None or chunks < max_chunks:
+                # prossimo chunk per id (con più shard: i primi chunk_size tra quelli di ogni shard)
+                rows, conn_of = [], {}
+                for ic in item_conns:
+                    for r in ic.execute(f"""
+                        SELECT id, user_id, name, category, market_params FROM items
+                        WHERE {where} AND id > ? ORDER BY id LIMIT ?
+                    """, (*scope_params, state['last_item_id'], chunk_size)).fetchall():
+                        rows.append(r)
+                        conn_of[r['id']] = ic
+                rows = sorted(rows, key=lambda r: r['id'])[:chunk_size]
+                if not rows:
+                    state['status'] = 'done'
+                    break
+
+                pending = {}   # catalog_key -> valori per l'INSERT delle voci nuove
+                links = []     # [item_id, user_id, catalog_key, pairs, gid]
+                for r in rows:
+                    category = r['category'] or ''
+                    idmap = hlp.normalize_identifiers(category, r['market_params'])
+                    if not any(idmap.values()):
+                        state['skipped'] += 1
+                        continue
+                    key = hlp.preferred_catalog_key(category, idmap)
+                    links.append([r['id'], r['user_id'], key, gc._strong_ids(idmap) + [('key', key)], None,
+                                  category, r['name'], r['market_params'], idmap])
+
+                # match su qualsiasi identificatore noto, poi per catalog_key solo per i rimanenti
+                known = gc.find_many(cur, {p for link in links for p in link[3]})
+                for link in links:
+                    link[4] = next((known[p] for p in link[3] if p in known), None)
+                # items del chunk che condividono un identificatore sono la stessa voce anche con
+                # catalog_key diverse (es. ean+discogs e solo ean): una sola voce per gruppo
+                for group in gc._group_by_identifiers(links):
+                    gid = next((link[4] for link in group if link[4] is not None), None)
+                    unresolved = [link for link in group if link[4] is None]
+                    if gid is not None or not unresolved:
+                        for link in unresolved:
+                            link[4] = gid
+                        continue
+                    first = unresolved[0]
+                    category, name, mp = first[5], first[6], first[7] or '{}'
+                    idmap = {}
+                    for link in unresolved:
+                        for col in IDENT_COLUMNS:
+                            if link[8].get(col) and not idmap.get(col):
+                                idmap[col] = link[8][col]
+                    key = hlp.preferred_catalog_key(category, idmap)
+                    for link in unresolved:
+                        link[2] = key
+                    if key not in pending:
+                        pending[key] = (key, hlp.generate_canonical_name(category, name), category, mp, mp,
+                                        '[]', now, now, *[idmap.get(c) for c in IDENT_COLUMNS])
+
+                if pending:
+                    keys = list(pending)
+                    cur.execute(f"SELECT id, catalog_key FROM global_catalog WHERE catalog_key IN ({','.join('?' * len(keys))})", keys)
+                    gid_by_key = {k: gid for gid, k in cur.fetchall()}
+                    missing = [k for k in keys if k not in gid_by_key]
+                    if missing:
+                        # DO NOTHING copre le voci create nel frattempo da altre richieste
+                        cur.execute(f"""
+                            INSERT INTO global_catalog (catalog_key, canonical_name, category, identifiers, market_params,
+                                info_links, created_at, updated_at, {cols})
+                            VALUES {', '.join([row_sql] * len(missing))}
+                            ON CONFLICT(catalog_key) DO NOTHING
+                            RETURNING id, catalog_key
+                        """, [v for k in missing for v in pending[k]])
+                        created = {k: gid for gid, k in cur.fetchall()}
+                        state['created'] += len(created)
+                        gid_by_key.update(created)
+                        if len(gid_by_key) < len(keys):
+                            lost = [k for k in keys if k not in gid_by_key]
+                            cur.execute(f"SELECT id, catalog_key FROM global_catalog WHERE catalog_key IN ({','.join('?' * len(lost))})", lost)
+                            gid_by_key.update({k: gid for gid, k in cur.fetchall()})
+                    for link in links:
+                        if link[4] is None:
+                            link[4] = gid_by_key[link[2]]
+
+                if links:
+                    if sharded:
+                        conn.commit()   # le voci del catalogo devono esistere prima dei link negli shard
+                    for ic in item_conns:
+                        mine = [link for link in links if conn_of[link[0]] is ic]
+                        if not mine:
+                            continue
+                        icur = ic.cursor()
+                        icur.executemany("UPDATE items SET global_id = ? WHERE id = ?", [(link[4], link[0]) for link in mine])
+                        by_user = {}
+                        for link in mine:
+                            by_user.setdefault(link[1], []).append(link[0])
+                        rev.bump_many(icur, by_user)
+                        if ic is not conn:
+                            ic.commit()
+                    state['linked'] += len(links)
+
+                state['scanned'] += len(rows)
+                state['last_item_id'] = rows[-1]['id']
+                state['updated_at'] = datetime.now().isoformat()
+                cur.execute("""
+                    UPDATE catalog_link_runs SET last_item_id = :last_item_id, scanned = :scanned, linked = :linked,
+                        created = :created, skipped = :skipped, updated_at = :updated_at
+                    WHERE scope = :scope
+                """, state)
+                conn.commit()
+                chunks += 1
+                if progress:
+                    progress(dict(state))
+
+            if state['status'] == 'done':
+                cur.execute("UPDATE catalog_link_runs SET status = 'done', updated_at = ? WHERE scope = ?",
+                            (datetime.now().isoformat(), scope))
+                conn.commit()
+        finally:
+            for ic in item_conns:
+                if ic is not conn:
+                    ic.close()
+            conn.close()
+        return state
+
+    def link_status(db_string, user_id: int = None):
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        cur.execute("SELECT * FROM catalog_link_runs WHERE scope = ?", (f'user:{user_id}' if user_id else 'all',))
+        row = cur.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def _encode_cursor(values: list) -> str:
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def _decode_cursor(token: str, score_types: tuple) -> list:
+        """
+        Decodifica un next_cursor: deve essere [score, id] con score del tipo atteso dal
+        ramo di ricerca (bm25 numerico o updated_at testuale) e id intero. ValueError altrimenti.
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if (not isinstance(values, list) or len(values) != 2
+                or isinstance(values[0], bool) or not isinstance(values[0], score_types)
+                or isinstance(values[1], bool) or not isinstance(values[1], int)):
+            raise ValueError('Invalid cursor')
+        return values
+
+    def search(cur, q: str, category: str = '', limit: int = 50, cursor: str = None):
+        """
+        Ricerca nel catalogo globale. Con q di almeno FTS_MIN_QUERY caratteri usa l'indice
+        trigram global_catalog_fts (nomi, catalog_key, ident_*) ordinando per bm25; altrimenti
+        (o su backend senza FTS, es. PostgreSQL) LIKE/elenco per updated_at più recente.
+        Paginazione keyset: ritorna (rows, next_cursor), next_cursor è None sull'ultima pagina.
+        Solleva ValueError se cursor non è valido.
+        """
+        q = (q or '').strip()
+        use_fts = len(q) >= FTS_MIN_QUERY and stg.dialect(cur).has_fts
+        after = gc._decode_cursor(cursor, (int, float) if use_fts else (str,)) if cursor else None
         params = []
-        for col, val in idmap.items():
-            if val:
-                sets.append(f"{col}=?"); params.append(val)
-        if sets:
-            params.extend([gid])
-            cur.execute(f"UPDATE global_catalog SET {', '.join(sets)} WHERE id=?", params)
-
-        conn.commit(); conn.close()
-        return gid
+        if use_fts:
+            weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+            sql = f"""
+                WITH hits AS (
+                    SELECT rowid AS id, bm25(global_catalog_fts, {weights}) AS score
+                    FROM global_catalog_fts WHERE global_catalog_fts MATCH ?
+                )
+                SELECT g.id, g.canonical_name, g.category, g.catalog_key, h.score
+                FROM hits h JOIN global_catalog g ON g.id = h.id
+                WHERE 1=1
+            """
+            params.append('"' + q.replace('"', '""') + '"')
+            if after:
+                sql += " AND (h.score, g.id) > (?, ?)"; params.extend(after)
+            order = " ORDER BY h.score, g.id"
+        else:
+            sql = """
+                SELECT id, canonical_name, category, catalog_key, COALESCE(updated_at, '') AS score
+                FROM global_catalog g WHERE 1=1
+            """
+            if q:
+                sql += " AND (LOWER(canonical_name) LIKE ? OR LOWER(catalog_key) LIKE ?)"
+                params.extend([f'%{q.lower()}%', f'%{q.lower()}%'])
+            if after:
+                sql += " AND (COALESCE(updated_at, ''), id) < (?, ?)"; params.extend(after)
+            order = " ORDER BY COALESCE(updated_at, '') DESC, id DESC"
+        if category:
+            sql += " AND LOWER(g.category) = ?"; params.append(category.lower())
+        sql += order + " LIMIT ?"; params.append(limit + 1)
+        cur.execute(sql, params)
+        rows = [dict(r) for r in cur.fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = gc._encode_cursor([rows[-1]['score'], rows[-1]['id']])
+        for r in rows:
+            r.pop('score', None)
+        return rows, next_cursor
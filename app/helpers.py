@@ -1,7 +1,47 @@
+import hashlib
 import json
+import os
+import threading
+from datetime import datetime, date, timedelta
+from flask import session
+from app.db import db
+from app.sketch import skt
+from app.storage import stg
+from app.writer import wrq
+
+# Base URL delle API dei provider di prezzo; sovrascrivibili via env
+# (es. per puntare agli stub locali di bench/stub_providers.py)
+PROVIDER_BASES = {
+    'ebay': ('EBAY_FINDING_URL', 'https://svcs.ebay.com/services/search/FindingService/v1'),
+    'pricecharting': ('PRICECHARTING_API_BASE', 'https://www.pricecharting.com/api'),
+    'discogs': ('DISCOGS_API_BASE', 'https://api.discogs.com'),
+    'rebrickable': ('REBRICKABLE_API_BASE', 'https://rebrickable.com/api/v3'),
+    'justtcg': ('JUSTTCG_API_BASE', 'https://api.justtcg.com/v1'),
+    'stockx': ('STOCKX_API_BASE', 'https://stockx.com/api'),
+}
+
+# Static approximate exchange rates relative to EUR. These can be updated as needed.
+# Values represent how many EUR equals one unit of the currency. Example: 1 USD ≈ 0.93 EUR.
+EUR_RATES = {
+    'EUR': 1.0,
+    'USD': 0.93,
+    'JPY': 0.0062,
+    'GBP': 1.17,
+    'CNY': 0.13
+}
+
+# Pool condiviso per le chiamate ai provider eseguite in parallelo (hlp.run_parallel)
+PROVIDER_POOL_SIZE = int(os.getenv('PROVIDER_POOL_SIZE') or 8)
+_provider_pool = None
+_provider_pool_lock = threading.Lock()
 
 class hlp():
 
+    def provider_base(provider: str) -> str:
+        """Base URL (senza slash finale) dell'API del provider indicato."""
+        env_key, default = PROVIDER_BASES[provider]
+        return (os.getenv(env_key) or default).rstrip('/')
+
     def convert_currency(amount: float, from_currency: str, to_currency: str) -> float:
         """
         Convert an amount from one currency to another using exchangerate.host free API.
@@ -20,27 +60,26 @@ class hlp():
         # If currencies are missing or identical, return original amount
         if not from_currency or not to_currency or from_currency == to_currency:
             return amount
-        # Static approximate exchange rates relative to EUR. These can be updated as needed.
-        # Values represent how many EUR equals one unit of the currency. Example: 1 USD ≈ 0.93 EUR.
-        rates = {
-            'EUR': 1.0,
-            'USD': 0.93,
-            'JPY': 0.0062,
-            'GBP': 1.17,
-            'CNY': 0.13
-        }
-        from_cur = from_currency.upper()
-        to_cur = to_currency.upper()
-        if from_cur in rates and to_cur in rates:
-            # Convert amount to EUR then to target
+        rate = hlp.exchange_rate(from_currency, to_currency)
+        if rate is not None:
             try:
-                eur_amount = amount * rates[from_cur]
-                return eur_amount / rates[to_cur]
+                return amount * rate
             except Exception:
                 return amount
         # If unknown currency, return original amount
         return amount
 
+    def exchange_rate(from_currency: str, to_currency: str):
+        """Fattore di conversione da from_currency a to_currency (EUR_RATES), None se una delle due è ignota."""
+        from_cur = (from_currency or '').upper()
+        to_cur = (to_currency or '').upper()
+        if from_cur and from_cur == to_cur:
+            return 1.0
+        if from_cur in EUR_RATES and to_cur in EUR_RATES:
+            # Convert amount to EUR then to target
+            return EUR_RATES[from_cur] / EUR_RATES[to_cur]
+        return None
+
     def _parse_links_field(val):
         """Accetta stringa JSON o lista; restituisce sempre una lista di stringhe http/https."""
         if not val:
@@ -82,6 +121,8 @@ class hlp():
             mp = json.loads(market_params_json or "{}")
         except Exception:
             mp = {}
+        if not isinstance(mp, dict):
+            mp = {}   # es. items salvati senza market_params ('null')
         # Mappa minima (estendibile)
         out['ident_serial']       = (mp.get('serial') or mp.get('serial_number') or '').strip() or None
         out['ident_ean']          = (mp.get('ean') or mp.get('barcode') or mp.get('upc') or '').strip() or None
@@ -106,24 +147,138 @@ class hlp():
         import hashlib
         return "sig:" + hashlib.sha1(sig.encode('utf-8')).hexdigest()[:16]
 
-    def record_price_snapshot(global_id: int, source: str, stats: dict, query_obj: dict):
+    def record_price_snapshot(db_string, global_id: int, source: str, stats: dict, query_obj: dict, samples: list = None):
         """
         Salva/aggiorna 1 record/giorno/fonte su global_catalog_prices.
-        stats atteso: {'avg','median','min','max','samples_count'}
+        stats atteso: {'avg','median','min','max','samples_count','currency'}
+        samples: prezzi grezzi della fonte (nella valuta di stats), salvati solo come sketch t-digest
+        (vedi hlp.price_percentiles)
         """
-        conn = get_db_connection(); cur = conn.cursor()
         ref_date = date.today().isoformat()
-        cur.execute("""
-            INSERT INTO global_catalog_prices (global_id, ref_date, source, samples_count, avg, median, min, max, query, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+        sketch = skt.from_samples(samples)
+        wrq.run(db_string, lambda cur: cur.execute(f"""
+            INSERT INTO global_catalog_prices (global_id, ref_date, source, samples_count, avg, median, min, max, currency, query, sketch, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {stg.dialect(cur).now()})
             ON CONFLICT(global_id, ref_date, source) DO UPDATE SET
             samples_count=excluded.samples_count,
             avg=excluded.avg, median=excluded.median, min=excluded.min, max=excluded.max,
-            query=excluded.query
+            currency=excluded.currency, query=excluded.query, sketch=excluded.sketch
         """, (
             global_id, ref_date, source,
             int(stats.get('samples_count') or stats.get('count') or 0),
             stats.get('avg'), stats.get('median'), stats.get('min'), stats.get('max'),
-            json.dumps(query_obj or {}, ensure_ascii=False)
-        ))
+            (stats.get('currency') or '').upper() or None,
+            json.dumps(query_obj or {}, ensure_ascii=False),
+            sketch
+        )))
+
+    def price_percentiles(cur, global_id: int, days: int = 365, source: str = None, currency: str = 'EUR') -> dict:
+        """
+        Percentili reali dei prezzi di una voce del catalogo globale in `currency`: fonde gli sketch
+        degli snapshot degli ultimi `days` giorni (tutte le fonti o solo `source`), ciascuno convertito
+        dalla propria valuta. Gli snapshot senza valuta o con una valuta non convertibile sono
+        esclusi (contati in 'skipped').
+        """
+        since = (date.today() - timedelta(days=days)).isoformat()
+        currency = (currency or 'EUR').upper()
+        sql = "SELECT source, currency, sketch FROM global_catalog_prices WHERE global_id = ? AND ref_date >= ? AND sketch IS NOT NULL"
+        params = [global_id, since]
+        if source:
+            sql += " AND source = ?"; params.append(source)
+        cur.execute(sql, params)
+        rows, factors, skipped = [], [], 0
+        for r in cur.fetchall():
+            rate = hlp.exchange_rate(r['currency'], currency)
+            if rate is None:
+                skipped += 1
+                continue
+            rows.append(r); factors.append(rate)
+        digest = skt.merge([r['sketch'] for r in rows], factors)
+        return {**skt.percentiles(digest), 'currency': currency, 'samples': digest.count, 'snapshots': len(rows),
+                'skipped': skipped, 'sources': sorted({r['source'] for r in rows}), 'since': since}
+
+    def _pool():
+        global _provider_pool
+        if _provider_pool is None:
+            with _provider_pool_lock:
+                if _provider_pool is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    _provider_pool = ThreadPoolExecutor(max_workers=PROVIDER_POOL_SIZE, thread_name_prefix='provider')
+        return _provider_pool
+
+    def run_parallel(*calls) -> list:
+        """
+        Esegue le callable (senza argomenti) sul pool condiviso dei provider e ritorna
+        [(risultato, eccezione)] nello stesso ordine: un errore non interrompe le altre.
+        """
+        futures = [hlp._pool().submit(call) for call in calls]
+        out = []
+        for f in futures:
+            try:
+                out.append((f.result(), None))
+            except Exception as e:
+                out.append((None, e))
+        return out
+
+    def iter_parallel(calls, limit: int = None):
+        """
+        Come run_parallel, ma genera (indice, risultato, eccezione) man mano che le chiamate
+        terminano, con al più `limit` chiamate in volo (default PROVIDER_POOL_SIZE).
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        calls = list(calls)
+        limit = max(1, limit or PROVIDER_POOL_SIZE)
+        pending, nxt = {}, 0
+        while nxt < len(calls) or pending:
+            while nxt < len(calls) and len(pending) < limit:
+                pending[hlp._pool().submit(calls[nxt])] = nxt
+                nxt += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                i = pending.pop(f)
+                try:
+                    yield i, f.result(), None
+                except Exception as e:
+                    yield i, None, e
+
+    def cache_key(params: dict) -> str:
+        """Chiave stabile per parametri di ricerca: valori normalizzati (trim, minuscolo, spazi), ordinati."""
+        norm = {str(k): ' '.join(str(v).lower().split()) for k, v in (params or {}).items() if v not in (None, '')}
+        return hashlib.sha1(json.dumps(norm, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def resolution_cache_get(db_string, provider: str, key: str, max_age_days: float):
+        """Valore (JSON) salvato in provider_resolution_cache se più recente di max_age_days, altrimenti None."""
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        cur.execute(
+            "SELECT value FROM provider_resolution_cache WHERE provider = ? AND cache_key = ? AND created_at >= ?",
+            (provider, key, (datetime.utcnow() - timedelta(days=max_age_days)).isoformat())
+        )
+        row = cur.fetchone()
+        conn.close()
+        return json.loads(row[0]) if row else None
+
+    def resolution_cache_get_many(db_string, provider: str, keys: list, max_age_days: float) -> dict:
+        """Come resolution_cache_get per più chiavi: {cache_key: valore} delle sole chiavi in cache, una connessione."""
+        keys = list(dict.fromkeys(keys))
+        since = (datetime.utcnow() - timedelta(days=max_age_days)).isoformat()
+        found = {}
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            cur.execute(f"""
+                SELECT cache_key, value FROM provider_resolution_cache
+                WHERE provider = ? AND cache_key IN ({','.join('?' * len(chunk))}) AND created_at >= ?
+            """, (provider, *chunk, since))
+            found.update((k, json.loads(v)) for k, v in cur.fetchall())
+        conn.close()
+        return found
+
+    def resolution_cache_put(db_string, provider: str, entries: dict):
+        """Salva {cache_key: valore} per il provider (un solo commit)."""
+        now = datetime.utcnow().isoformat()
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO provider_resolution_cache (provider, cache_key, value, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(provider, cache_key) DO UPDATE SET value = excluded.value, created_at = excluded.created_at
+        """, [(provider, k, json.dumps(v, ensure_ascii=False), now) for k, v in entries.items()])
         conn.commit(); conn.close()
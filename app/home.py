@@ -1,5 +1,6 @@
 from flask import jsonify
 from app import db
+from app.sharding import shd
    
 class platform():
 
@@ -16,18 +17,18 @@ class platform():
         except Exception:
             total_users = None
 
-        # Items
+        # Items (con lo sharding sono distribuiti tra i file degli shard)
+        item_conns = [conn if path == db_string else db.get_db_connection(path) for path in shd.all(db_string)]
         try:
-            cur.execute("SELECT COUNT(*) FROM items")
-            total_items = cur.fetchone()[0]
+            total_items = sum(c.execute("SELECT COUNT(*) FROM items").fetchone()[0] for c in item_conns)
         except Exception:
             total_items = None
 
         # Top 5 tag (tags può essere JSON array o stringa 'a,b,c')
         top_tags = []
         try:
-            cur.execute("SELECT tags FROM items WHERE tags IS NOT NULL AND TRIM(tags)<>''")
-            rows = cur.fetchall()
+            rows = [r for c in item_conns
+                    for r in c.execute("SELECT tags FROM items WHERE tags IS NOT NULL AND TRIM(tags)<>''").fetchall()]
             from collections import Counter
             cnt = Counter()
             import json as _json
@@ -51,5 +52,8 @@ class platform():
         except Exception:
             top_tags = []
 
+        for c in item_conns:
+            if c is not conn:
+                c.close()
         conn.close()
         return jsonify({'total_users': total_users, 'total_items': total_items, 'top_tags': top_tags, 'ver': ver})
\ No newline at end of file
@@ -0,0 +1,170 @@
+import threading
+import time
+from flask import Response, g, has_request_context, request
+
+# Bucket (secondi) per le latenze: route Flask e chiamate verso i provider esterni
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+PREFIX = 'collectorstreet'
+
+
+class Histogram():
+    """Istogramma cumulativo in stile Prometheus (bucket + somma + conteggio)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class mtr():
+    """
+    Metriche di processo (per worker): latenza per endpoint, query SQL per richiesta,
+    chiamate HTTP verso i provider di prezzo e fallback degli stimatori.
+    Esposte in formato testo Prometheus da /metrics (solo admin).
+    """
+    _lock = threading.Lock()
+    _route_latency = {}      # (endpoint, method) -> Histogram
+    _route_status = {}       # (endpoint, method, status) -> count
+    _route_sql = {}          # endpoint -> [queries, seconds]
+    _provider_latency = {}   # provider -> Histogram
+    _provider_calls = {}     # (provider, outcome) -> count
+    _fallbacks = {}          # provider -> count
+
+    def install(app):
+        app.before_request(mtr._before_request)
+        app.after_request(mtr._after_request)
+
+    def reset():
+        with mtr._lock:
+            for d in (mtr._route_latency, mtr._route_status, mtr._route_sql,
+                      mtr._provider_latency, mtr._provider_calls, mtr._fallbacks):
+                d.clear()
+
+    # --- hook Flask ---
+    def _before_request():
+        g._mtr_t0 = time.perf_counter()
+        g._mtr_sql_count = 0
+        g._mtr_sql_time = 0.0
+
+    def _after_request(response):
+        t0 = getattr(g, '_mtr_t0', None)
+        if t0 is None:
+            return response
+        elapsed = time.perf_counter() - t0
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method
+        with mtr._lock:
+            hist = mtr._route_latency.get((endpoint, method))
+            if hist is None:
+                hist = mtr._route_latency[(endpoint, method)] = Histogram()
+            hist.observe(elapsed)
+            key = (endpoint, method, str(response.status_code))
+            mtr._route_status[key] = mtr._route_status.get(key, 0) + 1
+            sql = mtr._route_sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += g._mtr_sql_count
+            sql[1] += g._mtr_sql_time
+        response.headers['Server-Timing'] = f"app;dur={elapsed * 1000:.1f}, db;dur={g._mtr_sql_time * 1000:.1f}"
+        return response
+
+    # --- SQL ---
+    def observe_sql(seconds: float):
+        """Chiamata dai cursori di db.get_db_connection per ogni statement eseguito."""
+        if has_request_context() and hasattr(g, '_mtr_sql_count'):
+            g._mtr_sql_count += 1
+            g._mtr_sql_time += seconds
+
+    # --- provider esterni ---
+    def http_get(provider: str, url: str, **kwargs):
+        """
+        requests.get strumentato: registra latenza ed esito per provider.
+        Le eccezioni di rete vengono registrate e rilanciate al chiamante.
+        """
+        import requests
+        t0 = time.perf_counter()
+        outcome = 'error'
+        try:
+            r = requests.get(url, **kwargs)
+            outcome = 'ok' if r.status_code < 400 else f'http_{r.status_code // 100}xx'
+            return r
+        except requests.Timeout:
+            outcome = 'timeout'
+            raise
+        finally:
+            mtr.observe_provider(provider, time.perf_counter() - t0, outcome)
+
+    def observe_provider(provider: str, seconds: float, outcome: str):
+        with mtr._lock:
+            hist = mtr._provider_latency.get(provider)
+            if hist is None:
+                hist = mtr._provider_latency[provider] = Histogram()
+            hist.observe(seconds)
+            key = (provider, outcome)
+            mtr._provider_calls[key] = mtr._provider_calls.get(key, 0) + 1
+
+    def count_fallback(provider: str):
+        """Lo stimatore ha risposto con valori stub/derivati invece che dal provider."""
+        with mtr._lock:
+            mtr._fallbacks[provider] = mtr._fallbacks.get(provider, 0) + 1
+
+    # --- esposizione ---
+    def _labels(**labels) -> str:
+        inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+        return '{' + inner + '}'
+
+    def _histogram_lines(name: str, hist: Histogram, **labels) -> list:
+        out = []
+        for le, c in zip(hist.buckets, hist.counts):
+            out.append(f"{name}_bucket{mtr._labels(**labels, le=le)} {c}")
+        out.append(f"{name}_bucket{mtr._labels(**labels, le='+Inf')} {hist.total}")
+        out.append(f"{name}_sum{mtr._labels(**labels)} {hist.sum:.6f}")
+        out.append(f"{name}_count{mtr._labels(**labels)} {hist.total}")
+        return out
+
+    def render() -> str:
+        lines = []
+        with mtr._lock:
+            name = f'{PREFIX}_http_request_duration_seconds'
+            lines += [f'# HELP {name} Latency of Flask routes by endpoint.', f'# TYPE {name} histogram']
+            for (endpoint, method), hist in sorted(mtr._route_latency.items()):
+                lines += mtr._histogram_lines(name, hist, endpoint=endpoint, method=method)
+
+            name = f'{PREFIX}_http_requests_total'
+            lines += [f'# HELP {name} Requests by endpoint and status code.', f'# TYPE {name} counter']
+            for (endpoint, method, status), c in sorted(mtr._route_status.items()):
+                lines.append(f"{name}{mtr._labels(endpoint=endpoint, method=method, status=status)} {c}")
+
+            name = f'{PREFIX}_sql_queries_total'
+            lines += [f'# HELP {name} SQL statements executed while serving each endpoint.', f'# TYPE {name} counter']
+            for endpoint, (count, _) in sorted(mtr._route_sql.items()):
+                lines.append(f"{name}{mtr._labels(endpoint=endpoint)} {count}")
+            name = f'{PREFIX}_sql_seconds_total'
+            lines += [f'# HELP {name} Time spent executing SQL statements per endpoint.', f'# TYPE {name} counter']
+            for endpoint, (_, seconds) in sorted(mtr._route_sql.items()):
+                lines.append(f"{name}{mtr._labels(endpoint=endpoint)} {seconds:.6f}")
+
+            name = f'{PREFIX}_provider_request_duration_seconds'
+            lines += [f'# HELP {name} Latency of outbound calls to price providers.', f'# TYPE {name} histogram']
+            for provider, hist in sorted(mtr._provider_latency.items()):
+                lines += mtr._histogram_lines(name, hist, provider=provider)
+
+            name = f'{PREFIX}_provider_requests_total'
+            lines += [f'# HELP {name} Outbound calls to price providers by outcome.', f'# TYPE {name} counter']
+            for (provider, outcome), c in sorted(mtr._provider_calls.items()):
+                lines.append(f"{name}{mtr._labels(provider=provider, outcome=outcome)} {c}")
+
+            name = f'{PREFIX}_estimator_fallback_total'
+            lines += [f'# HELP {name} Estimates answered with stub/derived values instead of provider data.', f'# TYPE {name} counter']
+            for provider, c in sorted(mtr._fallbacks.items()):
+                lines.append(f"{name}{mtr._labels(provider=provider)} {c}")
+        return '\n'.join(lines) + '\n'
+
+    def metrics_response() -> Response:
+        return Response(mtr.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,184 @@
+from app.db import db
+from app.dedupe import ddp
+from datetime import datetime
+import csv
+import gzip
+import io
+import json
+import re
+import time
+
+# Righe per transazione durante l'import del CSV
+IMPORT_BATCH = 5000
+
+# Colonne prezzo del CSV PriceCharting -> colonne di pricecharting_guide (valori in centesimi)
+PRICE_COLUMNS = {
+    'loose-price': 'loose_price',
+    'cib-price': 'cib_price',
+    'new-price': 'new_price',
+    'graded-price': 'graded_price',
+    'box-only-price': 'box_only_price',
+    'manual-only-price': 'manual_only_price',
+    'retail-loose-sell': 'retail_loose_sell',
+    'retail-cib-sell': 'retail_cib_sell',
+    'retail-new-sell': 'retail_new_sell',
+}
+
+
+class pcg():
+    """
+    Price guide PriceCharting in locale (tabella pricecharting_guide).
+
+    import_csv: legge in streaming il CSV scaricabile da PriceCharting (anche .csv.gz) e lo
+    carica a blocchi di IMPORT_BATCH righe, una transazione per blocco (UPSERT su id).
+    find / find_for_item: lookup per id PriceCharting, UPC o titolo+console normalizzati,
+    usato dagli stimatori prima di chiamare l'API.
+    """
+
+    def norm_title(text: str) -> str:
+        return ddp.normalize_name(text)
+
+    def norm_console(text: str) -> str:
+        # 'Game Boy' e 'GameBoy' devono coincidere
+        return ddp.normalize_name(text).replace(' ', '')
+
+    def norm_upc(text) -> str:
+        # UPC-A (12 cifre) ed EAN-13 differiscono solo per lo zero iniziale
+        digits = re.sub(r'\D', '', str(text or '').split(',')[0])
+        return digits.lstrip('0') or None
+
+    def cents(value):
+        """'$12.34' / '12.34' / '' -> 1234 / 1234 / None"""
+        text = str(value or '').replace('$', '').replace(',', '').strip()
+        if not text:
+            return None
+        try:
+            return int(round(float(text) * 100))
+        except ValueError:
+            return None
+
+    def parse_row(rec: dict, now: str):
+        try:
+            pid = int(str(rec.get('id') or '').strip())
+        except ValueError:
+            return None
+        name = (rec.get('product-name') or '').strip()
+        console = (rec.get('console-name') or '').strip()
+        if not name:
+            return None
+        volume = str(rec.get('sales-volume') or '').strip()
+        return (pid, name, console, pcg.norm_title(name), pcg.norm_console(console), pcg.norm_upc(rec.get('upc')),
+                *[pcg.cents(rec.get(k)) for k in PRICE_COLUMNS],
+                int(volume) if volume.isdigit() else None, (rec.get('release-date') or '').strip() or None, now)
+
+    def open_source(source):
+        if not isinstance(source, str):
+            # file caricato (binario) o già testuale
+            return source if isinstance(source, io.TextIOBase) else io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+        if source.endswith('.gz'):
+            return gzip.open(source, 'rt', encoding='utf-8-sig', newline='')
+        return open(source, encoding='utf-8-sig', newline='')
+
+    def import_csv(db_string, source, batch_size: int = IMPORT_BATCH, progress=None) -> dict:
+        """
+        Importa il CSV (path o file object) in pricecharting_guide. Le righe già presenti vengono
+        aggiornate; un import interrotto può essere semplicemente rilanciato. Ritorna un riepilogo.
+        """
+        t0 = time.perf_counter()
+        cols = ['id', 'product_name', 'console_name', 'norm_title', 'norm_console', 'upc',
+                *PRICE_COLUMNS.values(), 'sales_volume', 'release_date', 'imported_at']
+        updates = ', '.join(f"{c}=excluded.{c}" for c in cols[1:])
+        sql = f"""
+            INSERT INTO pricecharting_guide ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})
+            ON CONFLICT(id) DO UPDATE SET {updates}
+        """
+        now = datetime.utcnow().isoformat()
+        rows, skipped, batches, batch = 0, 0, 0, []
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        fh = pcg.open_source(source)
+        try:
+            reader = csv.DictReader(fh)
+            missing = {'id', 'product-name'} - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(f"not a PriceCharting price guide CSV (missing columns: {', '.join(sorted(missing))})")
+            for rec in reader:
+                parsed = pcg.parse_row(rec, now)
+                if parsed is None:
+                    skipped += 1
+                    continue
+                batch.append(parsed)
+                if len(batch) >= batch_size:
+                    cur.executemany(sql, batch); conn.commit()
+                    rows += len(batch); batches += 1; batch = []
+                    if progress:
+                        progress({'rows': rows, 'skipped': skipped})
+            if batch:
+                cur.executemany(sql, batch); conn.commit()
+                rows += len(batch); batches += 1
+            cur.execute("ANALYZE pricecharting_guide")
+            conn.commit()
+        finally:
+            if isinstance(source, str):
+                fh.close()
+            conn.close()
+        return {'rows': rows, 'skipped': skipped, 'batches': batches, 'seconds': round(time.perf_counter() - t0, 2)}
+
+    def find(cur, pricecharting_id=None, upc=None, title: str = None, console: str = None):
+        """
+        Ritorna (riga, match) o None. Ordine: id PriceCharting, UPC, titolo+console;
+        col solo titolo si accetta la riga solo se è l'unica con quel titolo.
+        """
+        try:
+            pid = int(str(pricecharting_id).strip()) if pricecharting_id not in (None, '') else None
+        except ValueError:
+            pid = None
+        if pid is not None:
+            cur.execute("SELECT * FROM pricecharting_guide WHERE id = ?", (pid,))
+            row = cur.fetchone()
+            if row:
+                return dict(row), 'id'
+        upc = pcg.norm_upc(upc)
+        if upc:
+            cur.execute("SELECT * FROM pricecharting_guide WHERE upc = ? LIMIT 1", (upc,))
+            row = cur.fetchone()
+            if row:
+                return dict(row), 'upc'
+        title = pcg.norm_title(title or '')
+        if not title:
+            return None
+        if console:
+            cur.execute("SELECT * FROM pricecharting_guide WHERE norm_title = ? AND norm_console = ? LIMIT 1",
+                        (title, pcg.norm_console(console)))
+            row = cur.fetchone()
+            if row:
+                return dict(row), 'title+console'
+        cur.execute("SELECT * FROM pricecharting_guide WHERE norm_title = ? LIMIT 2", (title,))
+        found = cur.fetchall()
+        if len(found) == 1:
+            return dict(found[0]), 'title'
+        return None
+
+    def find_for_item(cur, market_params, name: str = None):
+        """Lookup a partire dai market_params (JSON o dict) di un item o di una voce del catalogo globale."""
+        mp = market_params
+        if not isinstance(mp, dict):
+            try:
+                mp = json.loads(mp or '{}')
+            except (TypeError, ValueError):
+                mp = {}
+        if not isinstance(mp, dict):
+            mp = {}   # es. market_params salvati come 'null'
+        return pcg.find(cur,
+                        pricecharting_id=mp.get('pricecharting_id'),
+                        upc=mp.get('upc') or mp.get('ean') or mp.get('barcode'),
+                        title=mp.get('title') or mp.get('name') or name,
+                        console=mp.get('platform') or mp.get('console'))
+
+    def as_api(row: dict) -> dict:
+        """Riga locale nel formato di risposta di /api/product (prezzi in centesimi)."""
+        out = {'status': 'success', 'id': str(row['id']), 'product-name': row['product_name'],
+               'console-name': row['console_name'], 'upc': row['upc'], 'release-date': row['release_date']}
+        for key, col in PRICE_COLUMNS.items():
+            if row[col] is not None:
+                out[key] = row[col]
+        return out
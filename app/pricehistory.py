@@ -0,0 +1,177 @@
+from app.db import db
+from app.storage import stg
+from datetime import date, timedelta
+import atexit
+import threading
+import time
+
+_EPOCH = date(1970, 1, 1)
+
+# Politica di default (sovrascritta da phs.install con i valori di app.config)
+_policy = {
+    'PRICE_HISTORY_FLUSH_SIZE': 200,        # righe in buffer oltre le quali si scrive subito
+    'PRICE_HISTORY_FLUSH_SECONDS': 5.0,     # età massima del buffer prima di una scrittura
+    'PRICE_HISTORY_DAILY_DAYS': 90,         # oltre: righe giornaliere accorpate per settimana
+    'PRICE_HISTORY_WEEKLY_DAYS': 730,       # oltre: righe settimanali accorpate per mese
+    'PRICE_HISTORY_RETENTION_DAYS': 3650,   # oltre: cancellate
+}
+# Buffer delle stime in attesa di scrittura: (db, item_id, source, day) -> valori (l'ultima stima del giorno vince)
+_buffer = {}
+_buffer_since = None
+_lock = threading.Lock()
+# db -> giorno dell'ultima compattazione eseguita da questo processo
+_compacted = {}
+
+SPAN_DAY, SPAN_WEEK, SPAN_MONTH = 1, 7, 30
+
+
+class phs():
+    """
+    Storico prezzi per item (tabella item_price_history, WITHOUT ROWID): una riga per
+    (item, fonte, giorno) con avg/median/min/max/campioni delle stime dei provider.
+
+    Le stime vengono accumulate in memoria (phs.record) e scritte a blocchi con un solo
+    executemany per transazione (phs.flush). Le righe invecchiate vengono accorpate
+    (giorno -> settimana -> mese) e poi cancellate secondo la politica di retention
+    (phs.compact, eseguita al più una volta al giorno per database).
+    """
+
+    def install(app):
+        for key, value in _policy.items():
+            app.config.setdefault(key, value)
+            _policy[key] = app.config[key]
+        atexit.register(phs.flush_all)
+
+    def to_day(d: date) -> int:
+        return (d - _EPOCH).days
+
+    def from_day(day: int) -> str:
+        return (_EPOCH + timedelta(days=day)).isoformat()
+
+    def record(db_string, item_id: int, source: str, stats: dict):
+        """Accoda la stima di oggi; scrive se il buffer è pieno o più vecchio di PRICE_HISTORY_FLUSH_SECONDS."""
+        global _buffer_since
+        if not stats or stats.get('stub') or stats.get('avg') is None:
+            return
+        key = (db_string, int(item_id), source, phs.to_day(date.today()))
+        values = (int(stats.get('count') or stats.get('samples_count') or 0), stats.get('avg'), stats.get('median'),
+                  stats.get('min'), stats.get('max'), stats.get('currency'))
+        with _lock:
+            _buffer[key] = values
+            if _buffer_since is None:
+                _buffer_since = time.monotonic()
+            due = (len(_buffer) >= _policy['PRICE_HISTORY_FLUSH_SIZE']
+                   or time.monotonic() - _buffer_since >= _policy['PRICE_HISTORY_FLUSH_SECONDS'])
+        if due:
+            phs.flush_all()
+
+    def _take(db_string=None) -> dict:
+        global _buffer_since
+        with _lock:
+            taken = {k: v for k, v in _buffer.items() if db_string is None or k[0] == db_string}
+            for k in taken:
+                del _buffer[k]
+            if not _buffer:
+                _buffer_since = None
+        by_db = {}
+        for (dbs, item_id, source, day), v in taken.items():
+            by_db.setdefault(dbs, []).append((item_id, source, day, *v))
+        return by_db
+
+    def flush(db_string):
+        """Scrive le stime in buffer per questo database (da chiamare prima di leggere lo storico)."""
+        for dbs, rows in phs._take(db_string).items():
+            phs._write(dbs, rows)
+
+    def flush_all():
+        for dbs, rows in phs._take().items():
+            phs._write(dbs, rows)
+
+    def _write(db_string, rows: list):
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        try:
+            cur.executemany("""
+                INSERT INTO item_price_history (item_id, source, day, span, samples, avg, median, min, max, currency)
+                VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(item_id, source, day) DO UPDATE SET
+                    samples = excluded.samples, avg = excluded.avg, median = excluded.median,
+                    min = excluded.min, max = excluded.max, currency = excluded.currency
+            """, rows)
+            conn.commit()
+            today = date.today()
+            if _compacted.get(db_string) != today:
+                _compacted[db_string] = today
+                phs.compact(db_string, cur=cur)
+        finally:
+            conn.close()
+
+    def _rollup(cur, span: int, bucket: str, cutoff: int) -> int:
+        """Accorpa le righe con span minore di `span` e day < cutoff nel bucket calcolato da `bucket`."""
+        dia = stg.dialect(cur)
+        w, old_w = dia.greatest('samples', '1'), dia.greatest('item_price_history.samples', '1')
+        cur.execute(f"DROP TABLE IF EXISTS {dia.temp_schema}.iph_rollup")
+        cur.execute(f"""
+            CREATE TEMP TABLE iph_rollup AS
+            SELECT item_id, source, {bucket} AS day, SUM({w}) AS samples,
+                   SUM(avg * {w}) / SUM({w}) AS avg,
+                   SUM(median * {w}) / SUM({w}) AS median,
+                   MIN(min) AS min, MAX(max) AS max, MAX(currency) AS currency
+            FROM item_price_history WHERE span < ? AND day < ?
+            GROUP BY item_id, source, {bucket}
+        """, (span, cutoff))
+        cur.execute("DELETE FROM item_price_history WHERE span < ? AND day < ?", (span, cutoff))
+        # il bucket può già esistere (accorpamento precedente): si fondono i valori pesando per campioni
+        cur.execute(f"""
+            INSERT INTO item_price_history (item_id, source, day, span, samples, avg, median, min, max, currency)
+            SELECT item_id, source, day, {span}, samples, avg, median, min, max, currency FROM iph_rollup WHERE true
+            ON CONFLICT(item_id, source, day) DO UPDATE SET
+                avg = (item_price_history.avg * {old_w} + excluded.avg * excluded.samples) / ({old_w} + excluded.samples),
+                median = (item_price_history.median * {old_w} + excluded.median * excluded.samples) / ({old_w} + excluded.samples),
+                min = COALESCE({dia.least('item_price_history.min', 'excluded.min')}, item_price_history.min, excluded.min),
+                max = COALESCE({dia.greatest('item_price_history.max', 'excluded.max')}, item_price_history.max, excluded.max),
+                samples = {old_w} + excluded.samples,
+                span = excluded.span
+        """)
+        rolled = cur.rowcount
+        cur.execute(f"DROP TABLE {dia.temp_schema}.iph_rollup")
+        return rolled
+
+    def compact(db_string, today: date = None, cur=None) -> dict:
+        """
+        Applica la politica di downsampling/retention. Si accorpano solo periodi completi
+        (settimane da lunedì, mesi di calendario), quindi rieseguirla è idempotente.
+        """
+        today = today or date.today()
+        own = cur is None
+        if own:
+            conn = db.get_db_connection(db_string); cur = conn.cursor()
+        else:
+            conn = cur.connection
+        try:
+            week_cut = today - timedelta(days=_policy['PRICE_HISTORY_DAILY_DAYS'])
+            week_cut -= timedelta(days=week_cut.weekday())
+            month_cut = (today - timedelta(days=_policy['PRICE_HISTORY_WEEKLY_DAYS'])).replace(day=1)
+            keep_from = today - timedelta(days=_policy['PRICE_HISTORY_RETENTION_DAYS'])
+            cur.execute("DELETE FROM item_price_history WHERE day < ?", (phs.to_day(keep_from),))
+            result = {'deleted': cur.rowcount}
+            # 1970-01-01 era giovedì: (day + 3) % 7 = giorni dal lunedì
+            result['weeks'] = phs._rollup(cur, SPAN_WEEK, "day - ((day + 3) % 7)", phs.to_day(week_cut))
+            result['months'] = phs._rollup(cur, SPAN_MONTH, stg.dialect(cur).month_start_day('day'), phs.to_day(month_cut))
+            conn.commit()
+        finally:
+            if own:
+                conn.close()
+        return result
+
+    def history(cur, item_id: int, source: str = None, since: str = None) -> list:
+        sql = "SELECT source, day, span, samples, avg, median, min, max, currency FROM item_price_history WHERE item_id = ?"
+        params = [item_id]
+        if source:
+            sql += " AND source = ?"; params.append(source)
+        if since:
+            sql += " AND day >= ?"; params.append(phs.to_day(date.fromisoformat(since)))
+        sql += " ORDER BY source, day"
+        cur.execute(sql, params)
+        return [{'source': r['source'], 'date': phs.from_day(r['day']), 'span': r['span'], 'count': r['samples'],
+                 'avg': r['avg'], 'median': r['median'], 'min': r['min'], 'max': r['max'], 'currency': r['currency']}
+                for r in cur.fetchall()]
@@ -1,45 +1,28 @@
 import os
 from app import db,hlp
+from app.storage import stg
+from app.sharding import shd
+from app.usercontext import ucx
 from datetime import datetime, date
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
 
 class dashboard():
 
-    # --- Dashboard snapshots (manual/optional) ---
-    def ensure_finance_snapshots_table(db_string):
-        conn = db.get_db_connection(db_string)
-        cur = conn.cursor()
-        try:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_finance_daily (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    spent REAL DEFAULT 0,
-                    sold  REAL DEFAULT 0,
-                    items_bought INTEGER DEFAULT 0,
-                    items_sold   INTEGER DEFAULT 0,
-                    inventory_value REAL DEFAULT 0,
-                    note TEXT
-                )
-            """)
-            conn.commit()
-        finally:
-            conn.close()
-
     def api_dashboard_summary(uid,db_string):
-        conn = db.get_db_connection(db_string)
+        conn = db.get_db_connection(shd.for_user(db_string, uid))
         cur = conn.cursor()
 
         # Totale Speso
-        cur.execute("SELECT COALESCE(SUM(purchase_price_curr_ref),0) FROM items WHERE user_id=? AND purchase_price_curr_ref IS NOT NULL", (uid,))
-        tot_spent = cur.fetchone()[0]
+        # SUM senza COALESCE: il default 0 resta un intero su entrambi i backend (su PostgreSQL
+        # COALESCE(SUM(double), 0) restituirebbe 0.0)
+        cur.execute("SELECT SUM(purchase_price_curr_ref) FROM items WHERE user_id=? AND purchase_price_curr_ref IS NOT NULL", (uid,))
+        tot_spent = cur.fetchone()[0] or 0
 
-        cur.execute("SELECT COALESCE(SUM(sale_price),0) FROM items WHERE user_id=? AND sale_price IS NOT NULL", (uid,))
-        tot_sold = cur.fetchone()[0]
+        cur.execute("SELECT SUM(sale_price) FROM items WHERE user_id=? AND sale_price IS NOT NULL", (uid,))
+        tot_sold = cur.fetchone()[0] or 0
 
-        cur.execute("SELECT COALESCE(SUM(sale_price - COALESCE(purchase_price_curr_ref,0)),0) FROM items WHERE user_id=? AND sale_price IS NOT NULL", (uid,))
-        profit_realized = cur.fetchone()[0]
+        cur.execute("SELECT SUM(sale_price - COALESCE(purchase_price_curr_ref,0)) FROM items WHERE user_id=? AND sale_price IS NOT NULL", (uid,))
+        profit_realized = cur.fetchone()[0] or 0
 
         cur.execute("SELECT COUNT(*) FROM items WHERE user_id=? AND (sale_date IS NULL OR sale_date='')", (uid,))
         in_collection = cur.fetchone()[0]
@@ -50,8 +33,9 @@ class dashboard():
         """, (uid,))
         for_sale = cur.fetchone()[0]
 
-        cur.execute("""
-            SELECT AVG(julianday(COALESCE(NULLIF(sale_date,''), date('now'))) - julianday(purchase_date))
+        dia = stg.dialect(cur)
+        cur.execute(f"""
+            SELECT AVG({dia.days_between(f"COALESCE(NULLIF(sale_date,''), {dia.today()})", 'purchase_date')})
             FROM items WHERE user_id=? AND purchase_date IS NOT NULL AND purchase_date<>''
         """, (uid,))
         avg_days = cur.fetchone()[0]
@@ -73,19 +57,20 @@ class dashboard():
 
     def api_dashboard_trend(db_string):
         uid = session.get('user_id')
-        conn = db.get_db_connection(db_string)
+        conn = db.get_db_connection(shd.for_user(db_string, uid))
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT strftime('%Y-%m', purchase_date) AS ym, COALESCE(SUM(purchase_price_curr_ref),0)
+        dia = stg.dialect(cur)
+        cur.execute(f"""
+            SELECT {dia.year_month('purchase_date')} AS ym, COALESCE(SUM(purchase_price_curr_ref),0)
             FROM items
             WHERE user_id=? AND purchase_price_curr_ref IS NOT NULL AND purchase_date IS NOT NULL AND purchase_date<>''
             GROUP BY ym ORDER BY ym
         """, (uid,))
         spent = {r[0]: r[1] for r in cur.fetchall()}
 
-        cur.execute("""
-            SELECT strftime('%Y-%m', sale_date) AS ym, COALESCE(SUM(sale_price),0)
+        cur.execute(f"""
+            SELECT {dia.year_month('sale_date')} AS ym, COALESCE(SUM(sale_price),0)
             FROM items
             WHERE user_id=? AND sale_price IS NOT NULL AND sale_date IS NOT NULL AND sale_date<>''
             GROUP BY ym ORDER BY ym
@@ -132,9 +117,9 @@ class prf():
         item_count: int = 0
         first_date = None
         # Fetch only the items belonging to this user
-        conn = db.get_db_connection(db_string)
-        cur = conn.cursor()
         user_id = user.get('id') if user else None
+        conn = db.get_db_connection(shd.for_user(db_string, user_id))
+        cur = conn.cursor()
         if user_id:
             cur.execute("SELECT * FROM items WHERE user_id = ?", (user_id,))
         else:
@@ -207,13 +192,7 @@ class prf():
         Endpoint to compute and return the current logged-in user's collection statistics
         in JSON format. Used by the front-end to refresh stats manually.
         """
-        user_id = session.get('user_id')
-        conn = db.get_db_connection(db_string)
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cur.fetchone()
-        conn.close()
-        user_dict = dict(user) if user else {}
+        user_dict = ucx.current(db_string)
         stats = prf.compute_profile_stats(db_string,up_string, user_dict)
         return jsonify(stats)
 
@@ -222,8 +201,6 @@ class prf():
         Display and edit the logged-in user's profile. Supports GET (view) and POST (update).
         """
         user_id = session.get('user_id')
-        conn = db.get_db_connection(db_string)
-        cur = conn.cursor()
         if request.method == 'POST':
             form = request.form
             item_view_mode = form.get('item_view_mode')
@@ -274,23 +251,21 @@ class prf():
                     values.append(image_rel_path)
             if fields:
                 values.append(user_id)
+                conn = db.get_db_connection(db_string)
+                cur = conn.cursor()
                 cur.execute(f"UPDATE users SET {', '.join(fields)} WHERE id = ?", values)
+                ucx.invalidate(db_string, user_id, cur)
                 conn.commit()
+                conn.close()
             # Refresh user data after update
-            cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            user = cur.fetchone()
-            conn.close()
-            user_dict = dict(user) if user else {}
+            user_dict = ucx.current(db_string)
             # Compute statistics for display
             stats = prf.compute_profile_stats(db_string, up_string, user_dict)
             is_admin = user_dict.get('username') == 'admin'
             return render_template('profile.html', user=user_dict, updated=True, stats=stats, is_admin=is_admin)
         else:
             # GET request: fetch user and compute stats
-            cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            user = cur.fetchone()
-            conn.close()
-            user_dict = dict(user) if user else {}
+            user_dict = ucx.current(db_string)
             stats = prf.compute_profile_stats(db_string, up_string, user_dict)
             is_admin = user_dict.get('username') == 'admin'
             return render_template('profile.html', user=user_dict, stats=stats, is_admin=is_admin)
@@ -0,0 +1,131 @@
+import gzip
+from flask import Response, current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+# Dipendenze opzionali: se non installate si ricade su json/gzip della stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+ENCODINGS = ('br', 'gzip')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider di Flask basato su orjson (usato solo se orjson è installato)."""
+
+    def _options(self, **kwargs) -> int:
+        opts = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            opts |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            opts |= orjson.OPT_INDENT_2
+        return opts
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=self._options(**kwargs)).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options())
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class rsp():
+
+    def install(app):
+        """
+        Configura serializzazione e compressione delle risposte:
+        - orjson come JSON provider quando disponibile (fallback: json della stdlib)
+        - compressione br/gzip negoziata via Accept-Encoding sopra COMPRESS_MIN_SIZE byte
+        """
+        if orjson is not None:
+            app.json = OrjsonProvider(app)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_QUALITY', 4)
+        app.after_request(rsp.compress)
+
+    def negotiated_mimetype() -> str:
+        """Mimetype che negotiate userà per la richiesta corrente."""
+        if msgpack is not None:
+            best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES)
+            if best in MSGPACK_MIMETYPES:
+                return best
+        return 'application/json'
+
+    def negotiate(payload, status: int = 200):
+        """
+        Restituisce il payload come MessagePack se il client lo chiede esplicitamente
+        via header Accept (e msgpack è installato), altrimenti come JSON.
+        """
+        if msgpack is not None:
+            best = rsp.negotiated_mimetype()
+            if best in MSGPACK_MIMETYPES:
+                body = msgpack.packb(payload, use_bin_type=True, default=str)
+                resp = Response(body, status=status, mimetype=best)
+                resp.vary.add('Accept')
+                return resp
+        resp = jsonify(payload)
+        resp.status_code = status
+        if msgpack is not None:
+            resp.vary.add('Accept')
+        return resp
+
+    def matching_etag(etag: str) -> str:
+        """
+        Restituisce il tag in If-None-Match che corrisponde a `etag`, anche nella
+        variante compressa prodotta da compress ("<etag>-br", "<etag>-gzip"), o None.
+        """
+        for tag in (etag,) + tuple(f"{etag}-{enc}" for enc in ENCODINGS):
+            if request.if_none_match.contains(tag):
+                return tag
+        return None
+
+    def choose_encoding(accept_encoding) -> str:
+        """Sceglie la codifica migliore tra quelle supportate dal client (br > gzip)."""
+        if brotli is not None and accept_encoding['br']:
+            return 'br'
+        if accept_encoding['gzip']:
+            return 'gzip'
+        return None
+
+    def compress(response: Response) -> Response:
+        """after_request: comprime le risposte grandi se il client lo accetta."""
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        mimetype = response.mimetype or ''
+        if not (mimetype.startswith('text/') or mimetype in ('application/json', 'application/javascript') + MSGPACK_MIMETYPES):
+            return response
+        data = response.get_data()
+        if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+        encoding = rsp.choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        if encoding == 'br':
+            body = brotli.compress(data, quality=current_app.config.get('COMPRESS_BR_QUALITY', 4))
+        else:
+            body = gzip.compress(data, compresslevel=current_app.config.get('COMPRESS_LEVEL', 6))
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # ogni codifica è una rappresentazione diversa: un ETag forte non può essere condiviso
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(f"{etag}-{encoding}")
+        response.vary.add('Accept-Encoding')
+        return response
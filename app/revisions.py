@@ -0,0 +1,84 @@
+import hashlib
+from datetime import date
+
+
+class rev():
+    """
+    Numero di revisione per utente della collezione (tabella item_revisions).
+    Ogni scrittura sugli items dell'utente incrementa la revisione nella stessa
+    transazione, così /api/items può rispondere 304 senza leggere la tabella items.
+    """
+
+    def bump(cur, user_id, item_id=None, op: str = 'upsert') -> int:
+        """
+        Incrementa (o inizializza) la revisione dell'utente e, se item_id è indicato,
+        registra la modifica in item_changes ('upsert' o 'delete'). Va chiamata prima del commit.
+        """
+        if user_id is None:
+            return None
+        cur.execute("""
+            INSERT INTO item_revisions (user_id, rev) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET rev = item_revisions.rev + 1
+        """, (user_id,))
+        revision = rev.current(cur, user_id)
+        if item_id is not None:
+            # Una sola riga per item: conta solo l'ultima modifica
+            cur.execute("""
+                INSERT INTO item_changes (user_id, item_id, rev, op) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, item_id) DO UPDATE SET rev = excluded.rev, op = excluded.op
+            """, (user_id, item_id, revision, op))
+        return revision
+
+    def bump_many(cur, changes: dict, op: str = 'upsert') -> dict:
+        """
+        Come bump, per scritture batch: changes = {user_id: [item_id, ...]}. Una revisione
+        per utente, con un executemany per tabella invece di una bump per item.
+        Restituisce {user_id: revisione}.
+        """
+        changes = {uid: ids for uid, ids in changes.items() if uid is not None and ids}
+        if not changes:
+            return {}
+        users = list(changes)
+        cur.executemany("""
+            INSERT INTO item_revisions (user_id, rev) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET rev = item_revisions.rev + 1
+        """, [(uid,) for uid in users])
+        cur.execute(f"SELECT user_id, rev FROM item_revisions WHERE user_id IN ({','.join('?' * len(users))})", users)
+        revisions = {uid: r for uid, r in cur.fetchall()}
+        cur.executemany("""
+            INSERT INTO item_changes (user_id, item_id, rev, op) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, item_id) DO UPDATE SET rev = excluded.rev, op = excluded.op
+        """, [(uid, item_id, revisions[uid], op) for uid, ids in changes.items() for item_id in ids])
+        return revisions
+
+    def current(cur, user_id) -> int:
+        cur.execute("SELECT rev FROM item_revisions WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+    def items_etag(user_id, revision: int, args, mimetype: str = 'application/json') -> str:
+        """
+        ETag forte per /api/items: revisione + parametri di filtro + data odierna
+        (time_in_collection è calcolato rispetto a oggi, quindi cambia ogni giorno)
+        + mimetype negoziato (JSON e MessagePack sono rappresentazioni diverse).
+        """
+        key = "|".join([
+            str(user_id), str(revision), date.today().isoformat(), mimetype,
+            (args.get('q') or '').strip().lower(),
+            (args.get('category') or '').strip().lower(),
+            (args.get('tags') or '').strip().lower(),
+        ])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def changes_since(cur, user_id, since: int) -> tuple:
+        """
+        Restituisce (upserted_ids, deleted_ids) degli items modificati dopo la revisione `since`.
+        """
+        cur.execute(
+            "SELECT item_id, op FROM item_changes WHERE user_id = ? AND rev > ? ORDER BY rev",
+            (user_id, since)
+        )
+        upserted, deleted = [], []
+        for item_id, op in cur.fetchall():
+            (deleted if op == 'delete' else upserted).append(item_id)
+        return upserted, deleted
@@ -0,0 +1,167 @@
+from app.db import db
+from app.storage import stg
+from flask import current_app, has_app_context
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Tabelle per utente spostate nei file di shard; il resto (users, global_catalog, cache, ...) resta nel
+# database condiviso, attaccato in sola lettura alle connessioni di shard come schema "shared"
+SHARD_TABLES = ('items', 'item_revisions', 'item_changes', 'item_price_history', 'user_finance_daily')
+# Ogni shard assegna gli id degli items da k * ID_SPAN in su: id unici tra shard (e < 2^53 per il JSON)
+ID_SPAN = 1 << 40
+LAYOUT_FILE = 'layout.json'
+
+_ready = set()   # shard già inizializzati da questo processo
+_lock = threading.Lock()
+
+
+class shd():
+    """
+    Sharding opzionale delle collezioni (SHARD_COUNT > 0, solo SQLite): gli items e le tabelle
+    collegate di un utente stanno nel file SHARD_DIR/items_<k>.db con k = user_id % SHARD_COUNT,
+    quindi utenti di shard diversi non si contendono il lock di scrittura. Le connessioni a uno
+    shard vedono le tabelle condivise (users, global_catalog, ...) tramite ATTACH in sola lettura:
+    le scritture su quelle tabelle passano sempre da app.config['DATABASE'].
+
+    shd.for_user(db, user_id) restituisce il database degli items dell'utente (db stesso senza
+    sharding); shd.all(db) tutti i database con items, per i job trasversali. Un database
+    esistente si divide con shd.split (bench/shard_split.py).
+    """
+
+    def install(app):
+        app.config.setdefault('SHARD_COUNT', int(os.getenv('SHARD_COUNT', '0')))
+        app.config.setdefault('SHARD_DIR', os.getenv('SHARD_DIR'))
+
+    def _settings(db_string) -> tuple:
+        if not has_app_context() or stg.is_postgres(db_string):
+            return 0, None
+        count = int(current_app.config.get('SHARD_COUNT') or 0)
+        return count, current_app.config.get('SHARD_DIR') or shd.default_dir(db_string)
+
+    def default_dir(db_string) -> str:
+        return os.path.splitext(db_string)[0] + '_shards'
+
+    def enabled(db_string) -> bool:
+        return shd._settings(db_string)[0] > 0
+
+    def shard_path(shard_dir: str, index: int) -> str:
+        return os.path.join(shard_dir, f'items_{index:03d}.db')
+
+    def for_user(db_string, user_id) -> str:
+        count, shard_dir = shd._settings(db_string)
+        if not count or user_id is None:
+            return db_string
+        return shd.open_shard(db_string, shard_dir, count, int(user_id) % count)
+
+    def all(db_string) -> list:
+        count, shard_dir = shd._settings(db_string)
+        if not count:
+            return [db_string]
+        return [shd.open_shard(db_string, shard_dir, count, k) for k in range(count)]
+
+    def open_shard(db_string, shard_dir: str, count: int, index: int) -> str:
+        """Percorso dello shard, creato/aggiornato al primo uso nel processo e registrato per l'ATTACH."""
+        path = shd.shard_path(shard_dir, index)
+        if path in _ready:
+            return path
+        with _lock:
+            if path not in _ready:
+                shd._check_layout(shard_dir, count)
+                shd.init_shard(db_string, path, index)
+                stg.register_shard(path, db_string)
+                _ready.add(path)
+        return path
+
+    def _check_layout(shard_dir: str, count: int):
+        os.makedirs(shard_dir, exist_ok=True)
+        layout = os.path.join(shard_dir, LAYOUT_FILE)
+        if os.path.exists(layout):
+            with open(layout) as fh:
+                saved = json.load(fh).get('count')
+            if saved != count:
+                raise RuntimeError(f"SHARD_COUNT={count} but the shards in {shard_dir} were created with {saved}")
+        else:
+            with open(layout, 'w') as fh:
+                json.dump({'count': count}, fh)
+
+    def init_shard(db_string, path: str, index: int):
+        """
+        Crea (o allinea dopo nuove migrazioni) le tabelle per utente nello shard, copiando lo schema
+        di SHARD_TABLES dal database condiviso: tabelle, colonne aggiunte, indici e trigger.
+        """
+        shared = sqlite3.connect(db_string)
+        conn = sqlite3.connect(path)
+        try:
+            version = shared.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                return
+            marks = ','.join('?' * len(SHARD_TABLES))
+            objects = shared.execute(
+                f"SELECT type, name, tbl_name, sql FROM sqlite_master WHERE tbl_name IN ({marks}) AND sql IS NOT NULL "
+                "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END", SHARD_TABLES).fetchall()
+            existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+            conn.execute("BEGIN IMMEDIATE")
+            for kind, name, table, sql in objects:
+                if name not in existing:
+                    conn.execute(sql)
+                elif kind == 'table':
+                    have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+                    for _, col, col_type, notnull, default, _ in shared.execute(f"PRAGMA table_info({table})"):
+                        if col not in have:
+                            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}"
+                                         + (f" NOT NULL DEFAULT {default}" if notnull and default is not None else
+                                            f" DEFAULT {default}" if default is not None else ''))
+            if 'items' not in existing:
+                # primo id dello shard oltre gli id già esistenti nel database condiviso
+                start = index * ID_SPAN + (shared.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0] or 0)
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('items', ?)", (start,))
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        finally:
+            conn.close()
+            shared.close()
+
+    def split(db_string, shard_dir: str, count: int, keep: bool = False, progress=None) -> dict:
+        """
+        Migra un database non shardato: copia le righe di SHARD_TABLES di ogni utente nel suo shard
+        (id invariati, una transazione per shard) e poi, salvo keep, le cancella dal database
+        condiviso. Rieseguibile: le righe già copiate vengono sovrascritte.
+        """
+        t0 = time.perf_counter()
+        shd._check_layout(shard_dir, count)
+        paths = []
+        for k in range(count):
+            path = shd.shard_path(shard_dir, k)
+            shd.init_shard(db_string, path, k)
+            paths.append(path)
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        moved = {}
+        try:
+            for k, path in enumerate(paths):
+                cur.execute("ATTACH DATABASE ? AS shard", (path,))
+                cur.execute("BEGIN IMMEDIATE")
+                for table in SHARD_TABLES:
+                    col_list = ', '.join(r[1] for r in cur.execute(f"PRAGMA main.table_info({table})").fetchall())
+                    if table == 'item_price_history':
+                        # lo storico non ha user_id: segue gli items dello shard
+                        sql = (f"SELECT {', '.join('h.' + c for c in col_list.split(', '))} FROM main.item_price_history h "
+                               "JOIN main.items i ON i.id = h.item_id WHERE i.user_id % ? = ?")
+                    else:
+                        sql = f"SELECT {col_list} FROM main.{table} WHERE user_id % ? = ?"
+                    cur.execute(f"INSERT OR REPLACE INTO shard.{table} ({col_list}) {sql}", (count, k))
+                    moved[table] = moved.get(table, 0) + cur.rowcount
+                conn.commit()
+                cur.execute("DETACH DATABASE shard")
+                if progress:
+                    progress({'shard': k, 'path': path, 'moved': dict(moved)})
+            if not keep:
+                cur.execute("BEGIN IMMEDIATE")
+                for table in SHARD_TABLES:
+                    cur.execute(f"DELETE FROM {table}")
+                conn.commit()
+        finally:
+            conn.close()
+        return {'shards': paths, 'moved': moved, 'kept_in_shared': keep, 'seconds': round(time.perf_counter() - t0, 2)}
@@ -0,0 +1,140 @@
+import math
+import struct
+
+# Compressione del t-digest: ~COMPRESSION/2 centroidi al massimo, errore sui quantili estremi << 1%
+COMPRESSION = 100
+# Formato serializzato: magic, versione, compressione, min, max, n centroidi, poi n x (media float32, peso uint32)
+_HEADER = struct.Struct('<2sBHddI')
+_CENTROID = struct.Struct('<fI')
+_MAGIC = b'TD'
+
+
+class TDigest():
+    """
+    t-digest "merging" (Dunning): sketch dei quantili mergeable. I campioni vengono raccolti in
+    centroidi (media, peso) la cui dimensione massima dipende dal quantile (funzione di scala k1),
+    quindi le code (p05/p95) restano precise anche dopo molti merge. Due digest si fondono
+    concatenando i centroidi e ricomprimendo.
+    """
+
+    def __init__(self, compression: int = COMPRESSION):
+        self.compression = compression
+        self.centroids = []      # [[media, peso]] ordinati per media dopo compress()
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self) -> int:
+        return sum(w for _, w in self.centroids)
+
+    def add(self, values):
+        for v in values:
+            if v is None:
+                continue
+            v = float(v)
+            if math.isnan(v):
+                continue
+            self.centroids.append([v, 1])
+            self.min = min(self.min, v)
+            self.max = max(self.max, v)
+        self.compress()
+        return self
+
+    def merge(self, other: 'TDigest'):
+        if other.centroids:
+            self.centroids.extend([m, w] for m, w in other.centroids)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.compress()
+        return self
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k: float) -> float:
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def compress(self):
+        if len(self.centroids) <= 1:
+            return
+        self.centroids.sort(key=lambda c: c[0])
+        total = self.count
+        out = [list(self.centroids[0])]
+        done = 0   # peso dei centroidi già chiusi
+        limit = total * self._q(self._k(0) + 1)
+        for mean, weight in self.centroids[1:]:
+            last = out[-1]
+            if done + last[1] + weight <= limit:
+                last[0] += (mean - last[0]) * weight / (last[1] + weight)
+                last[1] += weight
+            else:
+                done += last[1]
+                limit = total * self._q(self._k(done / total) + 1)
+                out.append([mean, weight])
+        self.centroids = out
+
+    def quantile(self, q: float):
+        """Valore al quantile q (0..1) interpolando tra i centri dei centroidi; None se vuoto."""
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1 and self.centroids[0][1] == 1:
+            return self.centroids[0][0]
+        total = self.count
+        # punti (posizione cumulata, valore): estremi min/max e centro di ogni centroide
+        points, cum = [(0.0, self.min)], 0
+        for mean, weight in self.centroids:
+            points.append((cum + weight / 2, mean))
+            cum += weight
+        points.append((float(total), self.max))
+        target = min(max(q, 0.0), 1.0) * total
+        for (p0, v0), (p1, v1) in zip(points, points[1:]):
+            if target <= p1:
+                return v0 if p1 == p0 else v0 + (v1 - v0) * (target - p0) / (p1 - p0)
+        return self.max
+
+    def to_bytes(self) -> bytes:
+        body = b''.join(_CENTROID.pack(m, int(w)) for m, w in self.centroids)
+        return _HEADER.pack(_MAGIC, 1, self.compression, self.min, self.max, len(self.centroids)) + body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'TDigest':
+        magic, version, compression, mn, mx, n = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != 1:
+            raise ValueError('not a t-digest sketch')
+        d = cls(compression)
+        d.min, d.max = mn, mx
+        d.centroids = [list(_CENTROID.unpack_from(data, _HEADER.size + i * _CENTROID.size)) for i in range(n)]
+        return d
+
+
+class skt():
+    """Helper per gli sketch dei prezzi salvati negli snapshot di global_catalog_prices."""
+
+    def from_samples(samples) -> bytes:
+        """Sketch serializzato dei prezzi grezzi di uno snapshot (None se non ci sono campioni)."""
+        d = TDigest().add(samples or [])
+        return d.to_bytes() if d.centroids else None
+
+    def merge(blobs, factors=None) -> TDigest:
+        """
+        Fonde gli sketch serializzati (giorni e fonti diverse); quelli illeggibili vengono ignorati.
+        factors (stessa lunghezza di blobs) riscala i valori di ogni sketch, es. un cambio valuta:
+        una trasformazione lineare positiva conserva i quantili.
+        """
+        out = TDigest()
+        blobs = list(blobs)
+        for blob, factor in zip(blobs, factors if factors is not None else [1.0] * len(blobs)):
+            if not blob:
+                continue
+            try:
+                d = TDigest.from_bytes(bytes(blob))
+            except (ValueError, struct.error):
+                continue
+            # una sola compressione alla fine invece di una per sketch
+            out.centroids.extend([m * factor, w] for m, w in d.centroids)
+            out.min, out.max = min(out.min, d.min * factor), max(out.max, d.max * factor)
+        out.compress()
+        return out
+
+    def percentiles(digest: TDigest, qs=(0.05, 0.25, 0.5, 0.75, 0.95)) -> dict:
+        return {f"p{round(q * 100):02d}": (round(digest.quantile(q), 2) if digest.centroids else None) for q in qs}
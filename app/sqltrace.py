@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+
+log = logging.getLogger('collectorstreet.sql')
+
+# Default se non configurati in app.config
+SLOW_QUERY_MS = 200
+NPLUS1_THRESHOLD = 10
+
+_local = threading.local()
+# capture(all_threads=True) attive: ricevono anche gli statement di thread di lavoro e writer
+_shared_captures = []
+_shared_lock = threading.Lock()
+
+
+class sqt():
+    """
+    Tracing SQL: ogni statement eseguito dai cursori di db.get_db_connection passa da
+    sqt.record con il suo tempo. Da qui:
+    - slow query log (oltre SLOW_QUERY_MS) con EXPLAIN QUERY PLAN;
+    - rilevamento N+1 a fine richiesta (stesso statement ripetuto >= NPLUS1_THRESHOLD volte);
+    - capture()/assert_max_queries() per verificare il numero di query di un endpoint.
+    """
+
+    def install(app):
+        app.config.setdefault('SLOW_QUERY_MS', SLOW_QUERY_MS)
+        app.config.setdefault('NPLUS1_THRESHOLD', NPLUS1_THRESHOLD)
+        app.after_request(sqt._after_request)
+
+    def _config(key: str, default):
+        if has_app_context():
+            return current_app.config.get(key, default)
+        return default
+
+    def connection_opened():
+        """Conta le connessioni aperte nella richiesta corrente."""
+        if has_request_context():
+            g._sqt_connections = getattr(g, '_sqt_connections', 0) + 1
+
+    def record(conn, sql: str, parameters, seconds: float):
+        entry = (sql, parameters, seconds)
+        for captured in getattr(_local, 'captures', ()):
+            captured.append(entry)
+        if _shared_captures:
+            with _shared_lock:
+                for captured in _shared_captures:
+                    captured.append(entry)
+        if has_request_context():
+            trace = getattr(g, '_sqt_statements', None)
+            if trace is None:
+                trace = g._sqt_statements = []
+            trace.append(entry)
+        if seconds * 1000 >= sqt._config('SLOW_QUERY_MS', SLOW_QUERY_MS):
+            log.warning("slow query %.1f ms: %s params=%r plan=%s",
+                        seconds * 1000, ' '.join(sql.split()), parameters, sqt.explain(conn, sql, parameters))
+
+    def explain(conn, sql: str, parameters=()) -> list:
+        """EXPLAIN QUERY PLAN dello statement (lista di 'detail'); [] se non applicabile."""
+        head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        if not isinstance(conn, sqlite3.Connection) or head not in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE'):
+            return []
+        try:
+            # cursore sqlite3 "nudo": non deve passare di nuovo dal tracing
+            cur = conn.cursor(sqlite3.Cursor)
+            cur.execute(f"EXPLAIN QUERY PLAN {sql}", parameters or ())
+            return [row[-1] for row in cur.fetchall()]
+        except sqlite3.Error:
+            return []
+
+    def _after_request(response):
+        statements = getattr(g, '_sqt_statements', None)
+        if not statements:
+            return response
+        threshold = sqt._config('NPLUS1_THRESHOLD', NPLUS1_THRESHOLD)
+        counts = {}
+        for sql, _, _ in statements:
+            counts[sql] = counts.get(sql, 0) + 1
+        for sql, n in counts.items():
+            if n >= threshold:
+                log.warning("possible N+1 on %s %s: %d x %s (connections: %d)",
+                            request.method, request.path, n, ' '.join(sql.split()),
+                            getattr(g, '_sqt_connections', 0))
+        return response
+
+    @contextmanager
+    def capture(all_threads: bool = False):
+        """
+        Raccoglie (sql, params, seconds) di tutti gli statement eseguiti nel blocco: dello stesso
+        thread, o con all_threads=True di tutto il processo (view async con asyncio.to_thread,
+        pool dei provider, write-behind).
+        """
+        captured = []
+        if all_threads:
+            with _shared_lock:
+                _shared_captures.append(captured)
+            try:
+                yield captured
+            finally:
+                with _shared_lock:
+                    _shared_captures.remove(captured)
+            return
+        stack = getattr(_local, 'captures', None)
+        if stack is None:
+            stack = _local.captures = []
+        stack.append(captured)
+        try:
+            yield captured
+        finally:
+            stack.remove(captured)
+
+    @contextmanager
+    def assert_max_queries(limit: int):
+        """
+        Fallisce con AssertionError se il blocco esegue più di `limit` statement. Es.:
+
+            with sqt.assert_max_queries(3):
+                client.get('/api/items')
+        """
+        with sqt.capture() as captured:
+            yield captured
+        if len(captured) > limit:
+            listing = '\n'.join(f"  {i + 1}. {' '.join(sql.split())}" for i, (sql, _, _) in enumerate(captured))
+            raise AssertionError(f"expected at most {limit} queries, got {len(captured)}:\n{listing}")
@@ -0,0 +1,595 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections.abc import Mapping
+from functools import lru_cache
+from app.metrics import mtr
+from app.sqltrace import sqt
+
+try:
+    import psycopg
+except ImportError:  # opzionale: serve solo con DATABASE=postgresql://...
+    psycopg = None
+
+PG_SCHEMES = ('postgres://', 'postgresql://')
+# Connessioni PostgreSQL inattive tenute nel pool per ogni DSN (quelle in più vengono chiuse al rilascio)
+PG_POOL_SIZE = int(os.getenv('PG_POOL_SIZE', '10'))
+
+
+class sqlite_dialect():
+    """Frammenti SQL specifici di SQLite (il comportamento storico dell'app)."""
+
+    name = 'sqlite'
+    has_fts = True                    # global_catalog_fts (FTS5 trigram)
+    begin_write = "BEGIN IMMEDIATE"   # prende subito il lock di scrittura
+    temp_schema = 'temp'
+
+    def now() -> str:
+        return "datetime('now')"
+
+    def today() -> str:
+        return "date('now')"
+
+    def days_between(later: str, earlier: str) -> str:
+        return f"(julianday({later}) - julianday({earlier}))"
+
+    def year_month(expr: str) -> str:
+        return f"strftime('%Y-%m', {expr})"
+
+    def greatest(*exprs) -> str:
+        return f"MAX({', '.join(exprs)})"
+
+    def least(*exprs) -> str:
+        return f"MIN({', '.join(exprs)})"
+
+    def month_start_day(day: str) -> str:
+        """Giorno epoch (intero) del primo del mese che contiene il giorno epoch `day`."""
+        return f"CAST(strftime('%s', {day} * 86400, 'unixepoch', 'start of month') AS INTEGER) / 86400"
+
+    def json_set_text(column: str, key: str) -> str:
+        """Oggetto JSON (testo) di `column` con `key` impostata al valore stringa del parametro (?)."""
+        return f"json_set(COALESCE(NULLIF({column}, 'null'), '{{}}'), '$.{key}', ?)"
+
+
+class postgres_dialect():
+    """Frammenti SQL equivalenti per PostgreSQL (date salvate come testo ISO, come su SQLite)."""
+
+    name = 'postgresql'
+    has_fts = False                   # niente FTS5: la ricerca nel catalogo ripiega su LIKE
+    begin_write = "BEGIN"
+    temp_schema = 'pg_temp'
+
+    def now() -> str:
+        return "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+    def today() -> str:
+        return "to_char(CURRENT_DATE, 'YYYY-MM-DD')"
+
+    def days_between(later: str, earlier: str) -> str:
+        # date - date è un integer e AVG(integer) un numeric (Decimal): double come julianday su SQLite
+        return f"CAST(CAST({later} AS date) - CAST({earlier} AS date) AS double precision)"
+
+    def year_month(expr: str) -> str:
+        return f"substr({expr}, 1, 7)"
+
+    def greatest(*exprs) -> str:
+        return f"GREATEST({', '.join(exprs)})"
+
+    def least(*exprs) -> str:
+        return f"LEAST({', '.join(exprs)})"
+
+    def month_start_day(day: str) -> str:
+        return f"(CAST(date_trunc('month', DATE '1970-01-01' + {day}) AS date) - DATE '1970-01-01')"
+
+    def json_set_text(column: str, key: str) -> str:
+        return (f"CAST(jsonb_set(CAST(COALESCE(NULLIF({column}, 'null'), '{{}}') AS jsonb), '{{{key}}}', "
+                f"to_jsonb(CAST(? AS text))) AS text)")
+
+
+# --- PostgreSQL: adattatori con la stessa interfaccia di sqlite3 usata dall'app ---
+
+_TOKEN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|::|\?|:[A-Za-z_]\w*|%")
+
+
+@lru_cache(maxsize=2048)
+def _pg_sql(sql: str) -> str:
+    """Segnaposto stile sqlite3 (? e :nome) -> stile psycopg (%s e %(nome)s); % letterali raddoppiati."""
+    def repl(m):
+        tok = m.group(0)
+        if tok == '?':
+            return '%s'
+        if tok == '%':
+            return '%%'
+        if tok[0] == ':' and tok != '::':
+            return f'%({tok[1:]})s'
+        return tok.replace('%', '%%') if tok[0] in '\'"' else tok
+    return _TOKEN.sub(repl, sql)
+
+
+class Row():
+    """Riga accessibile per indice e per nome, come sqlite3.Row (dict(row) compreso)."""
+
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index: dict):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._values[self._index[key] if isinstance(key, str) else key]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and self._values == other._values and self._index == other._index
+
+    def keys(self) -> list:
+        return list(self._index)
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._index, self._values))!r})"
+
+
+def _row_factory(cursor):
+    index = {d.name: i for i, d in enumerate(cursor.description or ())}
+    return lambda values: Row(tuple(values), index)
+
+
+class PgCursor():
+
+    def __init__(self, connection, raw):
+        self.connection = connection
+        self._raw = raw
+        self.lastrowid = None   # su PostgreSQL usare INSERT ... RETURNING id
+
+    def _params(self, parameters):
+        if parameters is None:
+            return ()
+        return parameters if isinstance(parameters, Mapping) else tuple(parameters)
+
+    def execute(self, sql, parameters=()):
+        params = self._params(parameters)
+        t0 = time.perf_counter()
+        try:
+            # senza parametri psycopg non interpreta i segnaposto: l'SQL passa così com'è
+            if params:
+                self._raw.execute(_pg_sql(sql), params)
+            else:
+                self._raw.execute(sql)
+            return self
+        finally:
+            seconds = time.perf_counter() - t0
+            mtr.observe_sql(seconds)
+            sqt.record(self.connection, sql, parameters, seconds)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            self._raw.executemany(_pg_sql(sql), [self._params(p) for p in seq_of_parameters])
+            return self
+        finally:
+            seconds = time.perf_counter() - t0
+            mtr.observe_sql(seconds)
+            sqt.record(self.connection, sql, None, seconds)
+
+    @property
+    def rowcount(self) -> int:
+        return self._raw.rowcount
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def fetchone(self):
+        return self._raw.fetchone()
+
+    def fetchmany(self, size: int = 1):
+        return self._raw.fetchmany(size)
+
+    def fetchall(self) -> list:
+        return self._raw.fetchall()
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def close(self):
+        self._raw.close()
+
+
+class PgConnection():
+    """Connessione presa dal pool; close() la restituisce al pool invece di chiuderla."""
+
+    dialect = postgres_dialect
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.row_factory = None   # le righe sono sempre Row
+
+    @property
+    def isolation_level(self):
+        return None if self._raw.autocommit else ''
+
+    @isolation_level.setter
+    def isolation_level(self, value):
+        # come sqlite3: None = transazioni esplicite (BEGIN/COMMIT eseguiti dal chiamante)
+        self._raw.autocommit = value is None
+
+    def cursor(self, factory=None) -> PgCursor:
+        return PgCursor(self, self._raw.cursor(row_factory=_row_factory))
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is not None:
+            self._pool.release(self._raw)
+            self._raw = None
+
+
+class _PgPool():
+
+    def __init__(self, dsn: str, size: int):
+        self.dsn = dsn
+        self.size = size
+        self._idle = queue.LifoQueue()   # LIFO: si riusano le connessioni più "calde"
+
+    def acquire(self):
+        while True:
+            try:
+                raw = self._idle.get_nowait()
+            except queue.Empty:
+                return psycopg.connect(self.dsn)
+            if not raw.closed and not raw.broken:
+                return raw
+
+    def release(self, raw):
+        try:
+            if raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+                raw.rollback()
+            raw.autocommit = False
+        except psycopg.Error:
+            raw.close()
+            return
+        if raw.closed or self._idle.qsize() >= self.size:
+            raw.close()
+        else:
+            self._idle.put(raw)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# file di shard -> database condiviso da attaccare in sola lettura (vedi app/sharding.py)
+_shared_of = {}
+
+
+class stg():
+    """
+    Backend di storage. DATABASE è un percorso SQLite (default) oppure un DSN
+    postgresql://... : in quel caso db.get_db_connection restituisce una PgConnection presa da
+    un pool per DSN, con la stessa interfaccia di sqlite3 usata dall'app (segnaposto ?/:nome,
+    righe per indice e per nome, rowcount, commit/rollback/close).
+
+    L'SQL che differisce tra i due motori passa da stg.dialect(cur), es.
+    f"... {stg.dialect(cur).now()} ...". Per gli id generati usare INSERT ... RETURNING id
+    (supportato da entrambi) invece di cur.lastrowid.
+    """
+
+    IntegrityError = (sqlite3.IntegrityError,) + ((psycopg.IntegrityError,) if psycopg else ())
+    OperationalError = (sqlite3.OperationalError,) + ((psycopg.OperationalError,) if psycopg else ())
+
+    def is_postgres(db_string) -> bool:
+        return isinstance(db_string, str) and db_string.startswith(PG_SCHEMES)
+
+    def dialect(cur_or_conn):
+        conn = getattr(cur_or_conn, 'connection', cur_or_conn)
+        return getattr(conn, 'dialect', sqlite_dialect)
+
+    def register_shard(path: str, shared: str):
+        _shared_of[path] = shared
+
+    def shared_for(db_string):
+        """Database condiviso da attaccare alla connessione (None se db_string non è uno shard)."""
+        return _shared_of.get(db_string)
+
+    def sqlite_uri(path: str, mode: str = None) -> str:
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(path))
+        return uri + (f'?mode={mode}' if mode else '')
+
+    def connect_postgres(dsn: str) -> PgConnection:
+        if psycopg is None:
+            raise RuntimeError("DATABASE is a PostgreSQL DSN but psycopg is not installed (pip install 'psycopg[binary]')")
+        pool = _pools.get(dsn)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.setdefault(dsn, _PgPool(dsn, PG_POOL_SIZE))
+        return PgConnection(pool, pool.acquire())
+
+    def close_pools():
+        with _pools_lock:
+            pools = list(_pools.values())
+            _pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def init_postgres(cur, version: int, names: list):
+        """
+        Crea/aggiorna lo schema PostgreSQL (PG_SCHEMA, idempotente) e lo registra in schema_version
+        alla versione delle migrazioni SQLite. Va eseguita in transazione.
+        """
+        # un solo worker alla volta (stesso ruolo del BEGIN IMMEDIATE su SQLite)
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('collectorstreet.schema'))")
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+                    "applied_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'))")
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        if cur.fetchone()[0] >= version:
+            return
+        for statement in PG_SCHEMA:
+            cur.execute(statement)
+        cur.executemany("INSERT INTO schema_version (version, name) VALUES (?, ?) ON CONFLICT (version) DO NOTHING",
+                        list(enumerate(names, 1)))
+        cur.execute("INSERT INTO users (username, password) VALUES ('admin', 'admin') ON CONFLICT (username) DO NOTHING")
+
+
+_IDENT_KINDS = ('ean', 'serial', 'tcg_id', 'discogs_id', 'pc_id', 'lego_set', 'stockx_slug')
+
+# Schema PostgreSQL equivalente a quello prodotto da MIGRATIONS su SQLite (da aggiornare insieme a
+# ogni nuova migrazione). Tutto idempotente: viene riapplicato quando schema_version è indietro.
+PG_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        nickname TEXT,
+        profile_image_path TEXT,
+        vinted_link TEXT,
+        cardmarket_link TEXT,
+        ebay_link TEXT,
+        facebook_link TEXT,
+        ref_currency TEXT,
+        item_view_mode TEXT,
+        theme TEXT,
+        profile_version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        name TEXT NOT NULL,
+        description TEXT,
+        category TEXT,
+        purchase_price DOUBLE PRECISION,
+        purchase_price_curr_ref DOUBLE PRECISION,
+        purchase_date TEXT,
+        sale_price DOUBLE PRECISION,
+        sale_date TEXT,
+        marketplace_links TEXT,
+        tags TEXT,
+        image_path TEXT,
+        market_params TEXT,
+        quantity INTEGER,
+        condition TEXT,
+        currency TEXT,
+        language TEXT,
+        fair_value DOUBLE PRECISION,
+        price_p05 DOUBLE PRECISION,
+        price_p95 DOUBLE PRECISION,
+        valuation_date TEXT,
+        global_id INTEGER,
+        info_links TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_items_user_purchase ON items(user_id, purchase_date, purchase_price_curr_ref)",
+    "CREATE INDEX IF NOT EXISTS idx_items_user_sale ON items(user_id, sale_date, sale_price)",
+    "CREATE INDEX IF NOT EXISTS idx_items_global ON items(global_id)",
+    """
+    CREATE TABLE IF NOT EXISTS global_catalog (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        catalog_key TEXT UNIQUE,
+        canonical_name TEXT NOT NULL,
+        category TEXT,
+        identifiers TEXT,
+        market_params TEXT,
+        info_links TEXT,
+        created_at TEXT,
+        updated_at TEXT,
+        ident_ean TEXT,
+        ident_serial TEXT,
+        ident_tcg_id TEXT,
+        ident_discogs_id TEXT,
+        ident_pc_id TEXT,
+        ident_lego_set TEXT,
+        ident_stockx_slug TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_gc_cat ON global_catalog(category)",
+    *[f"CREATE INDEX IF NOT EXISTS idx_gc_ident_{k} ON global_catalog(ident_{k})" for k in _IDENT_KINDS],
+    """
+    CREATE TABLE IF NOT EXISTS global_catalog_prices (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        global_id INTEGER NOT NULL,
+        ref_date TEXT NOT NULL,
+        source TEXT,
+        samples_count INTEGER,
+        avg DOUBLE PRECISION,
+        median DOUBLE PRECISION,
+        min DOUBLE PRECISION,
+        max DOUBLE PRECISION,
+        query TEXT,
+        created_at TEXT,
+        sketch BYTEA,
+        currency TEXT,
+        UNIQUE (global_id, ref_date, source)
+    )
+    """,
+    "ALTER TABLE global_catalog_prices ADD COLUMN IF NOT EXISTS currency TEXT",
+    "CREATE INDEX IF NOT EXISTS idx_gcp_gid_date ON global_catalog_prices(global_id, ref_date)",
+    "CREATE INDEX IF NOT EXISTS idx_gcp_source ON global_catalog_prices(source)",
+    "CREATE TABLE IF NOT EXISTS item_revisions (user_id INTEGER PRIMARY KEY, rev INTEGER NOT NULL DEFAULT 0)",
+    """
+    CREATE TABLE IF NOT EXISTS item_changes (
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        rev INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        PRIMARY KEY (user_id, item_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_item_changes_user_rev ON item_changes(user_id, rev)",
+    """
+    CREATE TABLE IF NOT EXISTS user_finance_daily (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        spent DOUBLE PRECISION DEFAULT 0,
+        sold DOUBLE PRECISION DEFAULT 0,
+        items_bought INTEGER DEFAULT 0,
+        items_sold INTEGER DEFAULT 0,
+        inventory_value DOUBLE PRECISION DEFAULT 0,
+        note TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS catalog_link_runs (
+        scope TEXT PRIMARY KEY,
+        last_item_id INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        scanned INTEGER NOT NULL DEFAULT 0,
+        linked INTEGER NOT NULL DEFAULT 0,
+        created INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running',
+        started_at TEXT,
+        updated_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS global_catalog_identifiers (
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        global_id INTEGER NOT NULL,
+        PRIMARY KEY (kind, value)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_gci_global_id ON global_catalog_identifiers(global_id)",
+    # stessi trigger di m007: l'indice degli identificatori segue global_catalog
+    f"""
+    CREATE OR REPLACE FUNCTION gc_identifiers_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM global_catalog_identifiers WHERE global_id = OLD.id;
+            RETURN NULL;
+        END IF;
+        INSERT INTO global_catalog_identifiers (kind, value, global_id)
+        SELECT t.kind, t.value, NEW.id
+        FROM (VALUES {', '.join(f"('{k}', NEW.ident_{k})" for k in _IDENT_KINDS)}) AS t(kind, value)
+        WHERE t.value IS NOT NULL AND t.value <> ''
+        ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_gci_sync ON global_catalog",
+    f"""
+    CREATE TRIGGER trg_gci_sync AFTER INSERT OR DELETE OR UPDATE OF {', '.join(f'ident_{k}' for k in _IDENT_KINDS)}
+    ON global_catalog FOR EACH ROW EXECUTE FUNCTION gc_identifiers_sync()
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS catalog_duplicate_candidates (
+        a_id INTEGER NOT NULL,
+        b_id INTEGER NOT NULL,
+        score DOUBLE PRECISION NOT NULL,
+        name_sim DOUBLE PRECISION,
+        params_sim DOUBLE PRECISION,
+        status TEXT NOT NULL DEFAULT 'open',
+        created_at TEXT,
+        PRIMARY KEY (a_id, b_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cdc_status_score ON catalog_duplicate_candidates(status, score)",
+    "CREATE TABLE IF NOT EXISTS catalog_generation (id INTEGER PRIMARY KEY CHECK (id = 1), gen INTEGER NOT NULL)",
+    "INSERT INTO catalog_generation (id, gen) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+    """
+    CREATE TABLE IF NOT EXISTS provider_resolution_cache (
+        provider TEXT NOT NULL,
+        cache_key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (provider, cache_key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pricecharting_guide (
+        id INTEGER PRIMARY KEY,
+        product_name TEXT NOT NULL,
+        console_name TEXT,
+        norm_title TEXT NOT NULL,
+        norm_console TEXT NOT NULL,
+        upc TEXT,
+        loose_price INTEGER,
+        cib_price INTEGER,
+        new_price INTEGER,
+        graded_price INTEGER,
+        box_only_price INTEGER,
+        manual_only_price INTEGER,
+        retail_loose_sell INTEGER,
+        retail_cib_sell INTEGER,
+        retail_new_sell INTEGER,
+        sales_volume INTEGER,
+        release_date TEXT,
+        imported_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pcg_upc ON pricecharting_guide(upc) WHERE upc IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_pcg_title ON pricecharting_guide(norm_title, norm_console)",
+    """
+    CREATE TABLE IF NOT EXISTS item_price_history (
+        item_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        span INTEGER NOT NULL DEFAULT 1,
+        samples INTEGER,
+        avg DOUBLE PRECISION,
+        median DOUBLE PRECISION,
+        min DOUBLE PRECISION,
+        max DOUBLE PRECISION,
+        currency TEXT,
+        PRIMARY KEY (item_id, source, day)
+    )
+    """,
+    # come trg_iph_item_ad (m011): niente FK, le stime in buffer possono arrivare dopo la cancellazione
+    """
+    CREATE OR REPLACE FUNCTION iph_item_deleted() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM item_price_history WHERE item_id = OLD.id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_iph_item_ad ON items",
+    "CREATE TRIGGER trg_iph_item_ad AFTER DELETE ON items FOR EACH ROW EXECUTE FUNCTION iph_item_deleted()",
+]
@@ -0,0 +1,81 @@
+from app.db import db
+from collections import OrderedDict
+from flask import g, session
+import threading
+import time
+
+# Utenti in cache per processo e durata massima di una voce (copre le modifiche fatte da altri worker
+# a utenti diversi da quello della sessione, es. un admin che aggiorna un altro utente)
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60.0
+_cache = OrderedDict()   # (db, user_id) -> (profile_version, loaded_at, user dict)
+_lock = threading.Lock()
+
+
+class ucx():
+    """
+    Contesto dell'utente loggato: la riga di users viene letta al più una volta per richiesta
+    (flask.g) e riusata tra richieste da una piccola LRU di processo.
+
+    Invalidazione per versione: ogni modifica a un utente incrementa users.profile_version
+    (ucx.invalidate, nella stessa transazione). Se la modifica riguarda l'utente della sessione
+    la nuova versione viene salvata anche in sessione, così ogni worker che riceve la richiesta
+    successiva vede che la sua copia è vecchia e la ricarica.
+    """
+
+    def current(db_string) -> dict:
+        """
+        Dict dell'utente loggato ({} se non loggato o inesistente), caricato una volta per richiesta.
+        Il dict è condiviso con la cache: va trattato in sola lettura.
+        """
+        user_id = session.get('user_id')
+        if user_id is None:
+            return {}
+        cached = g.get('_ucx_user')
+        if cached is not None and cached.get('id') == user_id:
+            return cached
+        user = ucx.get(db_string, user_id, session.get('user_ver', 0))
+        g._ucx_user = user
+        return user
+
+    def get(db_string, user_id: int, min_version: int = 0) -> dict:
+        key = (db_string, user_id)
+        now = time.monotonic()
+        with _lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] >= min_version and now - entry[1] < USER_CACHE_TTL:
+                _cache.move_to_end(key)
+                return entry[2]
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        row = cur.fetchone()
+        conn.close()
+        if row is None:
+            return {}
+        user = dict(row)
+        with _lock:
+            _cache[key] = (user.get('profile_version') or 0, now, user)
+            _cache.move_to_end(key)
+            while len(_cache) > USER_CACHE_SIZE:
+                _cache.popitem(last=False)
+        return user
+
+    def invalidate(db_string, user_id: int, cur=None):
+        """
+        Da chiamare dopo aver modificato/cancellato un utente. Con cur (prima del commit) incrementa
+        anche profile_version, così gli altri worker scartano la loro copia.
+        """
+        if cur is not None:
+            cur.execute("UPDATE users SET profile_version = profile_version + 1 WHERE id = ? RETURNING profile_version",
+                        (user_id,))
+            row = cur.fetchone()
+            if row is not None and session.get('user_id') == user_id:
+                session['user_ver'] = row[0]
+        with _lock:
+            _cache.pop((db_string, user_id), None)
+        if g.get('_ucx_user') is not None and g._ucx_user.get('id') == user_id:
+            g.pop('_ucx_user')
+
+    def clear():
+        with _lock:
+            _cache.clear()
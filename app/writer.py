@@ -0,0 +1,160 @@
+from app.db import db
+from app.storage import stg
+from concurrent.futures import Future
+from flask import current_app, has_app_context
+import atexit
+import queue
+import threading
+import time
+
+# Attesa massima (secondi) di altre scritture prima del commit di gruppo e dimensione massima del gruppo
+GROUP_WAIT = 0.002
+GROUP_MAX = 256
+# Timeout della richiesta che aspetta l'esito della propria scrittura
+RESULT_TIMEOUT = 30.0
+
+_writers = {}   # db_string -> _Writer
+_writers_lock = threading.Lock()
+
+
+class _Writer(threading.Thread):
+    """Thread unico di scrittura per un database: svuota la coda e committa le operazioni a gruppi."""
+
+    def __init__(self, db_string, group_wait: float, group_max: int):
+        super().__init__(name='sqlite-writer', daemon=True)
+        self.db_string = db_string
+        self.group_wait = group_wait
+        self.group_max = group_max
+        self.queue = queue.Queue()
+        self.commits = 0
+        self.ops = 0
+
+    def run(self):
+        conn = db.get_db_connection(self.db_string)
+        conn.isolation_level = None   # transazioni esplicite (BEGIN/SAVEPOINT/COMMIT)
+        cur = conn.cursor()
+        stop = False
+        while not stop:
+            op = self.queue.get()
+            if op is None:
+                break
+            batch = [op]
+            deadline = time.monotonic() + self.group_wait
+            while len(batch) < self.group_max:
+                try:
+                    # prima ciò che è già in coda, poi si aspetta al più fino a deadline
+                    op = self.queue.get_nowait() if self.queue.qsize() else self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+            self._commit(cur, batch)
+        conn.close()
+
+    def _commit(self, cur, batch: list):
+        done = []
+        try:
+            cur.execute(stg.dialect(cur).begin_write)
+            for fn, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                # ogni operazione nel suo savepoint: un errore annulla solo quella
+                cur.execute("SAVEPOINT wrq_op")
+                try:
+                    result = fn(cur)
+                except BaseException as e:
+                    cur.execute("ROLLBACK TO wrq_op")
+                    cur.execute("RELEASE wrq_op")
+                    done.append((fut, None, e))
+                else:
+                    cur.execute("RELEASE wrq_op")
+                    done.append((fut, result, None))
+            cur.execute("COMMIT")
+        except Exception as e:
+            try:
+                cur.execute("ROLLBACK")
+            except Exception:
+                pass
+            for fn, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.commits += 1
+        self.ops += len(done)
+        # le richieste vengono sbloccate solo a commit avvenuto
+        for fut, result, err in done:
+            if err is None:
+                fut.set_result(result)
+            else:
+                fut.set_exception(err)
+
+
+class wrq():
+    """
+    Scritture su SQLite, opzionalmente in modalità write-behind (WRITE_BEHIND).
+
+    wrq.run(db, fn) esegue fn(cur) e committa. Senza write-behind apre una connessione e
+    committa subito, come prima. Con write-behind l'operazione va in coda a un unico thread
+    scrittore per database, che la esegue insieme alle altre arrivate nel frattempo in una sola
+    transazione (ogni operazione nel proprio savepoint) e risolve il Future di ciascuna a commit
+    avvenuto. Niente più contesa sul lock di scrittura tra i thread del server, e un fsync per
+    gruppo invece che per richiesta.
+
+    fn non deve committare né chiudere la connessione; il valore restituito torna al chiamante.
+    """
+
+    def install(app):
+        app.config.setdefault('WRITE_BEHIND', False)
+        app.config.setdefault('WRITE_BEHIND_GROUP_WAIT', GROUP_WAIT)
+        app.config.setdefault('WRITE_BEHIND_GROUP_MAX', GROUP_MAX)
+        atexit.register(wrq.shutdown)
+
+    def enabled() -> bool:
+        return has_app_context() and bool(current_app.config.get('WRITE_BEHIND'))
+
+    def _writer(db_string) -> _Writer:
+        w = _writers.get(db_string)
+        if w is None or not w.is_alive():
+            with _writers_lock:
+                w = _writers.get(db_string)
+                if w is None or not w.is_alive():
+                    cfg = current_app.config if has_app_context() else {}
+                    w = _Writer(db_string, cfg.get('WRITE_BEHIND_GROUP_WAIT', GROUP_WAIT), cfg.get('WRITE_BEHIND_GROUP_MAX', GROUP_MAX))
+                    w.start()
+                    _writers[db_string] = w
+        return w
+
+    def submit(db_string, fn) -> Future:
+        fut = Future()
+        wrq._writer(db_string).queue.put((fn, fut))
+        return fut
+
+    def run(db_string, fn, timeout: float = RESULT_TIMEOUT):
+        if wrq.enabled():
+            return wrq.submit(db_string, fn).result(timeout)
+        conn = db.get_db_connection(db_string); cur = conn.cursor()
+        try:
+            result = fn(cur)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def stats() -> dict:
+        return {dbs: {'commits': w.commits, 'ops': w.ops, 'queued': w.queue.qsize()} for dbs, w in _writers.items()}
+
+    def shutdown(timeout: float = 5.0):
+        """Svuota le code e ferma i thread scrittori (registrata con atexit)."""
+        with _writers_lock:
+            writers = list(_writers.values())
+            _writers.clear()
+        for w in writers:
+            w.queue.put(None)
+        for w in writers:
+            w.join(timeout)
+
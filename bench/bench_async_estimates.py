@@ -0,0 +1,203 @@
+"""
+Stimatori con provider lenti: server WSGI threaded contro app ASGI (app.create_asgi_app).
+
+Avvia gli stub dei provider (bench/stub_providers.py) con latenza alta e l'app in un processo
+separato, lancia --inflight richieste /api/*-estimate contemporanee e, mentre sono in volo,
+--crud richieste GET /api/items. Riporta per ogni server il picco di thread del processo
+dell'app (/proc/<pid>/status), le latenze delle stime e quelle delle route CRUD.
+
+Richiede aiohttp (client del test e dell'app) e uvicorn:
+    pip install aiohttp uvicorn
+
+Uso:
+    python bench/bench_async_estimates.py [--inflight 1000] [--latency-ms 2000] [--crud 200] [--server both|wsgi|asgi]
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH, '..')
+sys.path.insert(0, BENCH)
+
+import aiohttp  # noqa: E402
+
+import gen_dataset  # noqa: E402
+import stub_providers  # noqa: E402
+from load_estimators import ESTIMATORS  # noqa: E402
+
+# l'app gira in un processo a parte: il conteggio dei thread è solo suo
+SERVER = """
+import importlib.util, logging, os, sys
+spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(sys.argv[1], 'app.py'))
+cs = importlib.util.module_from_spec(spec); spec.loader.exec_module(cs)
+port = int(sys.argv[3])
+if sys.argv[2] == 'asgi':
+    import uvicorn
+    uvicorn.run(cs.create_asgi_app(), host='127.0.0.1', port=port, log_level='warning', backlog=4096, timeout_keep_alive=120)
+else:
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, cs.create_app(), threaded=True)
+    server.socket.listen(4096)
+    server.serve_forever()
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'nothing listening on port {port}')
+
+
+def threads_of(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as fh:
+            for line in fh:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def pick_targets(db_path: str) -> list:
+    conn = sqlite3.connect(db_path)
+    uid = conn.execute("SELECT id FROM users WHERE username = ?", (gen_dataset.BENCH_USER[0],)).fetchone()[0]
+    targets = []
+    for name, (path, cats) in ESTIMATORS.items():
+        sql, params = "SELECT id FROM items WHERE user_id = ?", [uid]
+        if cats:
+            sql += f" AND category IN ({','.join('?' * len(cats))})"; params += cats
+        ids = [r[0] for r in conn.execute(sql + " LIMIT 200", params)]
+        if ids:
+            targets.append((name, path, ids))
+    conn.close()
+    return targets
+
+
+def quantiles(values: list) -> str:
+    if not values:
+        return '-'
+    lat = sorted(v * 1000 for v in values)
+    q = lambda p: lat[min(len(lat) - 1, int(len(lat) * p))]
+    return f"p50 {statistics.median(lat):.0f} ms  p95 {q(0.95):.0f} ms  p99 {q(0.99):.0f} ms"
+
+
+async def storm(base: str, pid: int, targets: list, args) -> dict:
+    rnd = random.Random(args.seed)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+    # unsafe: il cookie di sessione arriva da un indirizzo IP
+    async with aiohttp.ClientSession(base, connector=connector, timeout=timeout, cookie_jar=aiohttp.CookieJar(unsafe=True)) as client:
+        async with client.post('/login', json={'username': gen_dataset.BENCH_USER[0], 'password': gen_dataset.BENCH_USER[1]}) as r:
+            r.raise_for_status()
+        peak = [threads_of(pid)]
+        est, crud = [], []
+
+        async def sample():
+            while True:
+                peak[0] = max(peak[0], threads_of(pid))
+                await asyncio.sleep(0.05)
+
+        async def call(name: str, url: str, out: list):
+            t0 = time.perf_counter()
+            try:
+                async with client.get(url) as r:
+                    await r.read()
+                    status = r.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = 'error'
+            out.append((name, time.perf_counter() - t0, status))
+
+        sampler = asyncio.create_task(sample())
+        t0 = time.perf_counter()
+        calls = []
+        for i in range(args.inflight):
+            name, path, ids = targets[i % len(targets)]
+            calls.append(asyncio.create_task(call(name, f'{path}?item_id={rnd.choice(ids)}', est)))
+        # CRUD mentre le stime aspettano i provider, a --crud-concurrency alla volta
+        await asyncio.sleep(min(0.5, args.latency_ms / 4000))
+        sem = asyncio.Semaphore(args.crud_concurrency)
+
+        async def crud_call():
+            async with sem:
+                await call('/api/items', '/api/items', crud)
+        await asyncio.gather(*(crud_call() for _ in range(args.crud)))
+        crud_wall = time.perf_counter() - t0
+        await asyncio.gather(*calls)
+        wall = time.perf_counter() - t0
+        sampler.cancel()
+    return {'est': est, 'crud': crud, 'peak_threads': peak[0], 'wall': wall, 'crud_wall': crud_wall}
+
+
+def run_server(kind: str, db_path: str, env: dict, targets: list, args) -> dict:
+    port = free_port()
+    cmd = [sys.executable, '-c', SERVER, ROOT, kind, str(port)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**env, 'DATABASE_URL': db_path})
+    try:
+        wait_port(port)
+        return asyncio.run(storm(f'http://127.0.0.1:{port}', proc.pid, targets, args))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def report(kind: str, out: dict, args):
+    print(f"[{kind}] {args.inflight} estimates in flight, {out['wall']:.1f}s wall, peak app threads {out['peak_threads']}")
+    by_name = {}
+    for name, secs, status in out['est'] + out['crud']:
+        by_name.setdefault(name, []).append((secs, status))
+    for name, rows in by_name.items():
+        bad = sum(1 for _, st in rows if st != 200)
+        print(f"  {name:<14} n={len(rows):<6} non-200={bad:<5} {quantiles([s for s, _ in rows])}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--inflight', type=int, default=1000)
+    ap.add_argument('--latency-ms', type=float, default=2000)
+    ap.add_argument('--crud', type=int, default=200)
+    ap.add_argument('--crud-concurrency', type=int, default=8)
+    ap.add_argument('--items', type=int, default=2000)
+    ap.add_argument('--server', choices=('both', 'wsgi', 'asgi'), default='both')
+    ap.add_argument('--seed', type=int, default=11)
+    args = ap.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'async.db')
+    gen_dataset.generate(db_path, args.items, max(2, args.items // 500), 0.2, 0.1, 1, 90, args.seed)
+    targets = pick_targets(db_path)
+
+    stub_port = free_port()
+    stubs = subprocess.Popen([sys.executable, os.path.join(BENCH, 'stub_providers.py'), '--port', str(stub_port),
+                              '--latency-ms', str(args.latency_ms), '--jitter-ms', '0'], stdout=subprocess.DEVNULL)
+    try:
+        wait_port(stub_port)
+        env = {**os.environ, **stub_providers.env_for(f'http://127.0.0.1:{stub_port}')}
+        for kind in (('wsgi', 'asgi') if args.server == 'both' else (args.server,)):
+            report(kind, run_server(kind, db_path, env, targets, args), args)
+    finally:
+        stubs.terminate()
+        stubs.wait()
+
+
+if __name__ == '__main__':
+    main()
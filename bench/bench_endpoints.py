@@ -0,0 +1,95 @@
+"""
+Benchmark degli endpoint "caldi" su un dataset generato con bench/gen_dataset.py.
+
+Gli endpoint vengono chiamati tramite il test client di Flask, loggati come utente
+'bench' (quello con più items). Per ogni endpoint riporta min/mediana/p95 in ms,
+numero di query SQL per richiesta e dimensione della risposta.
+
+Uso:
+    python bench/gen_dataset.py --size 100k --db /tmp/cs_100k.db
+    python bench/bench_endpoints.py --db /tmp/cs_100k.db [--runs 10] [--save bench/baseline_100k.json]
+
+bench/baseline_1k.json e bench/baseline_100k.json sono le misure di riferimento (codice di
+partenza, dataset con la data di riferimento di gen_dataset) con cui confrontare le ottimizzazioni.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from app import sqt  # noqa: E402
+
+ENDPOINTS = [
+    ('get_items', '/api/items'),
+    ('get_items_filtered', '/api/items?category=vinyl&tags=raro'),
+    ('export_csv', '/api/export/csv'),
+    ('profile_stats', '/api/profile/stats'),
+    ('dashboard_summary', '/api/dashboard/summary'),
+    ('dashboard_trend', '/api/dashboard/trend'),
+    ('platform_overview', '/api/platform/overview'),
+]
+
+
+def load_app(db_path: str):
+    spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_app(os.path.abspath(db_path))
+
+
+def bench(client, url: str, runs: int) -> dict:
+    timings, queries, size, status = [], 0, 0, None
+    client.get(url)  # warm-up
+    for _ in range(runs):
+        with sqt.capture() as captured:
+            t0 = time.perf_counter()
+            r = client.get(url)
+            timings.append((time.perf_counter() - t0) * 1000)
+        status, size, queries = r.status_code, len(r.data), len(captured)
+    timings.sort()
+    return {
+        'status': status,
+        'min_ms': round(timings[0], 2),
+        'median_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'queries': queries,
+        'bytes': size,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', default='/tmp/cs_bench.db')
+    ap.add_argument('--runs', type=int, default=10)
+    ap.add_argument('--user', default='bench')
+    ap.add_argument('--password', default='bench')
+    ap.add_argument('--save', help='salva i risultati (baseline) in questo file JSON')
+    args = ap.parse_args()
+
+    app = load_app(args.db)
+    client = app.test_client()
+    r = client.post('/login', json={'username': args.user, 'password': args.password})
+    if r.status_code != 200:
+        raise SystemExit(f"login failed for {args.user}: {r.status_code}")
+
+    results = {}
+    print(f"{'endpoint':<22}{'status':>7}{'min':>10}{'median':>10}{'p95':>10}{'queries':>9}{'bytes':>12}")
+    for name, url in ENDPOINTS:
+        res = results[name] = bench(client, url, args.runs)
+        print(f"{name:<22}{res['status']:>7}{res['min_ms']:>10}{res['median_ms']:>10}{res['p95_ms']:>10}"
+              f"{res['queries']:>9}{res['bytes']:>12}")
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump({'db': args.db, 'runs': args.runs, 'results': results}, fh, indent=2)
+        print(f"saved {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark serializzazione e compressione del payload di /api/items.
+
+Genera N item con la stessa forma restituita da get_items e misura:
+- tempo di serializzazione (json stdlib vs orjson vs msgpack, se installati)
+- byte in uscita (raw, gzip, brotli)
+
+Uso:
+    python bench/bench_payload.py [--items 10000] [--repeat 5]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+CATEGORIES = ['vinyl', 'cd', 'videogames', 'trading card', 'lego', 'sneakers', 'action figure', 'other']
+CURRENCIES = ['EUR', 'USD', 'GBP', 'JPY']
+
+
+def fake_items(n: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    out = []
+    for i in range(1, n + 1):
+        price = round(rnd.uniform(2, 500), 2)
+        sold = rnd.random() < 0.3
+        out.append({
+            'id': i,
+            'name': f"Item {i} {rnd.choice(['Deluxe', 'Limited', 'First Press', 'Promo', ''])}".strip(),
+            'description': 'Lorem ipsum dolor sit amet ' * rnd.randint(0, 4),
+            'language': rnd.choice(['IT', 'EN', 'JP', None]),
+            'category': rnd.choice(CATEGORIES),
+            'market_params': {'title': f'Item {i}', 'year': rnd.randint(1970, 2025)},
+            'purchase_price': price,
+            'purchase_price_curr_ref': price,
+            'purchase_date': f"20{rnd.randint(10, 25)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            'sale_price': round(price * rnd.uniform(0.7, 2.0), 2) if sold else None,
+            'sale_date': '2025-06-01' if sold else None,
+            'marketplace_links': [],
+            'info_links': [],
+            'tags': ','.join(rnd.sample(['raro', 'sigillato', 'usato', 'jp', 'promo'], 2)),
+            'image_path': f'uploads/{i}.jpg',
+            'quantity': 1,
+            'condition': rnd.choice(['NM', 'LP', 'Sealed', 'Used']),
+            'currency': rnd.choice(CURRENCIES),
+            'time_in_collection': rnd.randint(0, 5000),
+            'roi': None,
+            'fair_value': 0,
+            'price_p05': 0,
+            'price_p95': 0,
+            'valuation_date': 0
+        })
+    return out
+
+
+def timed(fn, repeat: int):
+    best = None
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None or dt < best else best
+    return best, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--items', type=int, default=10000)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    payload = fake_items(args.items)
+    encoders = [('json (stdlib)', lambda: json.dumps(payload, sort_keys=True).encode('utf-8'))]
+    if orjson is not None:
+        encoders.append(('orjson', lambda: orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)))
+    if msgpack is not None:
+        encoders.append(('msgpack', lambda: msgpack.packb(payload, use_bin_type=True)))
+
+    print(f"items={args.items} repeat={args.repeat}")
+    print(f"{'encoder':<16}{'ms':>10}{'raw B':>12}{'gzip B':>12}{'gzip ms':>10}{'br B':>12}{'br ms':>10}")
+    for name, fn in encoders:
+        dt, body = timed(fn, args.repeat)
+        gz_dt, gz = timed(lambda: gzip.compress(body, compresslevel=6), args.repeat)
+        if brotli is not None:
+            br_dt, br = timed(lambda: brotli.compress(body, quality=4), args.repeat)
+            br_cols = f"{len(br):>12}{br_dt * 1000:>10.1f}"
+        else:
+            br_cols = f"{'-':>12}{'-':>10}"
+        print(f"{name:<16}{dt * 1000:>10.1f}{len(body):>12}{len(gz):>12}{gz_dt * 1000:>10.1f}{br_cols}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Throughput delle scritture concorrenti di più utenti: database unico contro collezioni divise
+in shard per utente (SHARD_COUNT), opzionalmente combinato con il write-behind (WRITE_BEHIND).
+
+Per ogni configurazione crea un database nuovo con --users utenti, avvia l'app su un server
+WSGI threaded locale e lancia --concurrency client, ognuno autenticato come un utente diverso,
+che creano item (POST /api/items) e aggiornano i propri (PUT). Riporta req/s, latenze
+p50/p95/p99 e risposte non 2xx (tipicamente "database is locked").
+
+Uso:
+    python bench/bench_shards.py [--requests 2000] [--concurrency 32] [--users 32] [--shards 0,4,8] [--write-behind]
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import wrq  # noqa: E402
+
+
+def load_app(db_path: str, shards: int, write_behind: bool):
+    spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app = module.create_app(db_path)
+    app.config['SHARD_COUNT'] = shards
+    app.config['WRITE_BEHIND'] = write_behind
+    return app
+
+
+def run_config(shards: int, write_behind: bool, args) -> dict:
+    db_path = os.path.join(tempfile.mkdtemp(), 'shards.db')
+    app = load_app(db_path, shards, write_behind)
+    admin = app.test_client()
+    admin.post('/login', json={'username': 'admin', 'password': 'admin'})
+    users = [f'bench{u:03d}' for u in range(args.users)]
+    for name in users:
+        admin.post('/api/admin/users', json={'username': name, 'password': 'pw'})
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    rnd = random.Random(args.seed)
+    local = threading.local()
+    next_user = iter(range(10 ** 9))
+    created = {}   # username -> id degli item creati
+    results = []   # (op, seconds, status)
+    lock = threading.Lock()
+
+    def session():
+        s = getattr(local, 's', None)
+        if s is None:
+            with lock:
+                local.user = users[next(next_user) % len(users)]
+            s = local.s = requests.Session()
+            s.post(f'{base}/login', json={'username': local.user, 'password': 'pw'})
+        return s, local.user
+
+    def run(i):
+        s, user = session()
+        with lock:
+            mine = created.setdefault(user, [])
+            target = rnd.choice(mine) if mine and rnd.random() < args.update_ratio else None
+        op = 'create' if target is None else 'update'
+        t0 = time.perf_counter()
+        try:
+            if target is None:
+                r = s.post(f'{base}/api/items', timeout=60, json={
+                    'name': f'Bench item {i}', 'category': 'vinyl', 'purchase_price': 10 + i % 90,
+                    'currency': 'EUR', 'tags': 'bench', 'market_params': {'artist': 'X', 'album': f'A{i}'}})
+                if r.status_code == 201:
+                    with lock:
+                        mine.append(r.json()['id'])
+            else:
+                r = s.put(f'{base}/api/items/{target}', timeout=60,
+                          json={'name': f'Bench item {target} v{i}', 'sale_price': i % 50})
+            status = r.status_code
+        except requests.RequestException:
+            status = 'error'
+        with lock:
+            results.append((op, time.perf_counter() - t0, status))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, range(args.requests)))
+    wall = time.perf_counter() - t0
+    server.shutdown()
+    wrq.shutdown()
+    return {'wall': wall, 'results': results}
+
+
+def report(name: str, out: dict, concurrency: int):
+    results = out['results']
+    print(f"[{name}] {len(results)} requests, concurrency {concurrency}, {out['wall']:.1f}s wall, "
+          f"{len(results) / out['wall']:.1f} req/s")
+    print(f"{'op':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'non-2xx':>9}")
+    by_op = {}
+    for op, secs, status in results:
+        by_op.setdefault(op, []).append((secs, status))
+    for op, rows in sorted(by_op.items()):
+        lat = sorted(s * 1000 for s, _ in rows)
+        q = lambda p: lat[min(len(lat) - 1, int(len(lat) * p))]
+        bad = sum(1 for _, st in rows if st not in (200, 201))
+        print(f"{op:<10}{len(rows):>6}{statistics.median(lat):>10.1f}{q(0.95):>10.1f}{q(0.99):>10.1f}{bad:>9}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--concurrency', type=int, default=32)
+    ap.add_argument('--users', type=int, default=32)
+    ap.add_argument('--update-ratio', type=float, default=0.5)
+    ap.add_argument('--shards', default='0,4,8', help='numeri di shard da confrontare (0 = database unico)')
+    ap.add_argument('--write-behind', action='store_true')
+    ap.add_argument('--seed', type=int, default=7)
+    args = ap.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logging.getLogger('collectorstreet.sql').setLevel(logging.ERROR)   # niente slow query log durante il carico
+
+    for shards in (int(s) for s in args.shards.split(',')):
+        name = f"shards={shards}" + (' write-behind' if args.write_behind else '')
+        report(name, run_config(shards, args.write_behind, args), args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark del costo di db.init_db all'avvio di un worker su un database grande.
+
+Crea (una volta) un database con N items e confronta:
+- init_db su database già aggiornato (atteso: una sola SELECT su schema_version)
+- riesecuzione completa dello step baseline (il vecchio comportamento ad ogni avvio)
+
+Uso:
+    python bench/bench_startup.py [--items 200000] [--db /tmp/cs_startup.db] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import db  # noqa: E402
+
+
+def build(path: str, n_items: int):
+    if os.path.exists(path):
+        os.remove(path)
+    db.init_db(path)
+    conn = db.get_db_connection(path)
+    cur = conn.cursor()
+    rows = (
+        (1, f'Item {i}', 'vinyl', 10.0 + i % 90, '2020-01-01', 'EUR')
+        for i in range(n_items)
+    )
+    cur.executemany(
+        "INSERT INTO items (user_id, name, category, purchase_price, purchase_date, currency) VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None or dt < best else best
+    return best
+
+
+def legacy_baseline(path: str):
+    conn = db.get_db_connection(path)
+    cur = conn.cursor()
+    db._m001_baseline(cur)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--items', type=int, default=200000)
+    ap.add_argument('--db', default='/tmp/cs_startup.db')
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    build(args.db, args.items)
+    print(f"built {args.items} items in {time.perf_counter() - t0:.1f}s ({args.db})")
+
+    up_to_date = timed(lambda: db.init_db(args.db), args.repeat)
+    legacy = timed(lambda: legacy_baseline(args.db), args.repeat)
+    print(f"init_db (up to date):      {up_to_date * 1000:8.2f} ms")
+    print(f"baseline step (old start): {legacy * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
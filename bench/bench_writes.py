@@ -0,0 +1,129 @@
+"""
+Throughput delle scritture concorrenti: commit per richiesta contro write-behind (WRITE_BEHIND).
+
+Per ogni modalità crea un database nuovo, avvia l'app su un server WSGI threaded locale e
+lancia --concurrency client che creano item (POST /api/items) e ne aggiornano (PUT) a caso.
+Riporta req/s, latenze p50/p95/p99, risposte non 2xx (tipicamente "database is locked") e,
+col write-behind, commit di gruppo eseguiti e operazioni per commit.
+
+Uso:
+    python bench/bench_writes.py [--requests 2000] [--concurrency 32] [--update-ratio 0.5] [--mode both|direct|write-behind]
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import wrq  # noqa: E402
+
+
+def load_app(db_path: str, write_behind: bool):
+    spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app = module.create_app(db_path)
+    app.config['WRITE_BEHIND'] = write_behind
+    return app
+
+
+def run_mode(write_behind: bool, args) -> dict:
+    db_path = os.path.join(tempfile.mkdtemp(), 'writes.db')
+    app = load_app(db_path, write_behind)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    rnd = random.Random(args.seed)
+    local = threading.local()
+    created = []
+    results = []  # (op, seconds, status)
+    lock = threading.Lock()
+
+    def session() -> requests.Session:
+        s = getattr(local, 's', None)
+        if s is None:
+            s = local.s = requests.Session()
+            s.post(f'{base}/login', json={'username': 'admin', 'password': 'admin'})
+        return s
+
+    def run(i):
+        with lock:
+            target = rnd.choice(created) if created and rnd.random() < args.update_ratio else None
+        op = 'create' if target is None else 'update'
+        t0 = time.perf_counter()
+        try:
+            if target is None:
+                r = session().post(f'{base}/api/items', timeout=60, json={
+                    'name': f'Bench item {i}', 'category': 'vinyl', 'purchase_price': 10 + i % 90,
+                    'currency': 'EUR', 'tags': 'bench', 'market_params': {'artist': 'X', 'album': f'A{i}'}})
+                if r.status_code == 201:
+                    with lock:
+                        created.append(r.json()['id'])
+            else:
+                r = session().put(f'{base}/api/items/{target}', timeout=60,
+                                  json={'name': f'Bench item {target} v{i}', 'sale_price': i % 50})
+            status = r.status_code
+        except requests.RequestException:
+            status = 'error'
+        with lock:
+            results.append((op, time.perf_counter() - t0, status))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, range(args.requests)))
+    wall = time.perf_counter() - t0
+    stats = wrq.stats().get(db_path)
+    server.shutdown()
+    wrq.shutdown()
+    return {'wall': wall, 'results': results, 'writer': stats}
+
+
+def report(name: str, out: dict, concurrency: int):
+    results = out['results']
+    print(f"[{name}] {len(results)} requests, concurrency {concurrency}, {out['wall']:.1f}s wall, "
+          f"{len(results) / out['wall']:.1f} req/s")
+    print(f"{'op':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'non-2xx':>9}")
+    by_op = {}
+    for op, secs, status in results:
+        by_op.setdefault(op, []).append((secs, status))
+    for op, rows in sorted(by_op.items()):
+        lat = sorted(s * 1000 for s, _ in rows)
+        q = lambda p: lat[min(len(lat) - 1, int(len(lat) * p))]
+        bad = sum(1 for _, st in rows if st not in (200, 201))
+        print(f"{op:<10}{len(rows):>6}{statistics.median(lat):>10.1f}{q(0.95):>10.1f}{q(0.99):>10.1f}{bad:>9}")
+    if out['writer']:
+        w = out['writer']
+        print(f"writer: {w['ops']} ops in {w['commits']} commits ({w['ops'] / max(1, w['commits']):.1f} ops/commit)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--concurrency', type=int, default=32)
+    ap.add_argument('--update-ratio', type=float, default=0.5)
+    ap.add_argument('--mode', choices=('both', 'direct', 'write-behind'), default='both')
+    ap.add_argument('--seed', type=int, default=7)
+    args = ap.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    if args.mode in ('both', 'direct'):
+        report('direct', run_mode(False, args), args.concurrency)
+    if args.mode in ('both', 'write-behind'):
+        report('write-behind', run_mode(True, args), args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
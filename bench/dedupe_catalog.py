@@ -0,0 +1,36 @@
+"""
+Esecuzione offline della ricerca di duplicati del catalogo globale (ddp.find_duplicates)
+su un database esistente, con tempi e prime coppie candidate.
+
+Uso:
+    python bench/dedupe_catalog.py --db /tmp/cs_100k.db [--min-score 0.6] [--category vinyl] [--top 20]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import db, ddp  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', required=True)
+    ap.add_argument('--min-score', type=float, default=0.6)
+    ap.add_argument('--category')
+    ap.add_argument('--top', type=int, default=20)
+    args = ap.parse_args()
+
+    db.init_db(args.db)
+    summary = ddp.find_duplicates(args.db, args.min_score, category=args.category, progress=print)
+    print(summary)
+    conn = db.get_db_connection(args.db)
+    for c in ddp.list_candidates(conn.cursor(), 'open', args.top):
+        print(f"{c['score']:.3f}  #{c['a_id']} {c['a_name']!r} ({c['a_items']} items)  ~  "
+              f"#{c['b_id']} {c['b_name']!r} ({c['b_items']} items)")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Generatore deterministico di dataset sintetici per benchmark e test di carico.
+
+Riempie un database (schema creato da db.init_db) con:
+- utenti (il primo, 'bench'/'bench', possiede --heavy-share degli items)
+- items di tutte le categorie, con tag, valute, date di acquisto/vendita e market_params
+  coerenti con gli identificatori usati da hlp.normalize_identifiers
+- voci di global_catalog collegate agli items (items.global_id) con colonne ident_*
+- snapshot di prezzo pluriennali in global_catalog_prices
+
+Stesso seed e stessa data di riferimento (--today, default REFERENCE_DATE) => stesso database:
+le date di acquisto/vendita e gli snapshot non dipendono dal giorno in cui si genera.
+Taglie di riferimento: 1k, 100k, 1M items.
+
+Uso:
+    python bench/gen_dataset.py --items 100000 --db /tmp/cs_100k.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import db, hlp  # noqa: E402
+
+BENCH_USER = ('bench', 'bench')
+
+# "Oggi" del dataset: le baseline in bench/baseline_*.json sono state misurate con questa data
+REFERENCE_DATE = date(2025, 6, 30)
+
+CATEGORIES = {
+    'vinyl':         ['Abbey Road', 'Dark Side of the Moon', 'Rumours', 'Kind of Blue', 'Thriller', 'Nevermind'],
+    'cd':            ['OK Computer', 'Discovery', 'Mezzanine', 'Ten', 'Blue Lines', 'The Bends'],
+    'videogames':    ['Pokemon Red', 'Tetris', 'Zelda Links Awakening', 'Super Mario Land', 'Metroid II', 'Kirby Dream Land'],
+    'trading card':  ['Charizard Holo', 'Black Lotus', 'Blue-Eyes White Dragon', 'Pikachu Promo', 'Mewtwo EX', 'Dark Magician'],
+    'lego':          ['Millennium Falcon', 'Hogwarts Castle', 'Death Star', 'Taj Mahal', 'Titanic', 'Eiffel Tower'],
+    'sneakers':      ['Jordan 1 Chicago', 'Yeezy 350', 'Dunk Low Panda', 'Air Max 1', 'Travis Scott AJ1', 'New Balance 550'],
+    'action figure': ['Boba Fett Vintage', 'He-Man', 'Optimus Prime G1', 'Snake Eyes', 'Batman 1989', 'Spawn'],
+    'other':         ['Poster', 'Pin', 'Comic', 'Funko Pop', 'Keychain', 'Artbook'],
+}
+CURRENCIES = ['EUR', 'EUR', 'EUR', 'USD', 'GBP', 'JPY']
+TAGS = ['raro', 'sigillato', 'usato', 'jp', 'promo', 'prima-stampa', 'graded', 'box', 'regalo', 'vintage']
+CONDITIONS = ['Mint', 'NM', 'LP', 'MP', 'Sealed', 'Used', 'CIB', 'Loose']
+LANGUAGES = ['IT', 'EN', 'JP', 'DE', 'FR', None]
+SOURCES = {
+    'vinyl': ['discogs', 'ebay'], 'cd': ['discogs', 'ebay'], 'videogames': ['pricecharting', 'ebay'],
+    'trading card': ['justtcg', 'ebay'], 'lego': ['ebay'], 'sneakers': ['stockx', 'ebay'],
+    'action figure': ['ebay'], 'other': ['ebay'],
+}
+
+
+def market_params_for(category: str, title: str, n: int) -> dict:
+    mp = {'title': title}
+    if category in ('vinyl', 'cd'):
+        mp.update({'artist': f'Artist {n % 997}', 'album': title, 'discogs_release_id': str(100000 + n)})
+    elif category == 'videogames':
+        mp.update({'platform': 'Game Boy', 'serial': f'DMG-{n % 9000 + 1000:04d}', 'pricecharting_id': str(5000 + n)})
+    elif category == 'trading card':
+        mp.update({'tcgplayer_id': str(200000 + n)})
+    elif category == 'lego':
+        mp.update({'set_number': str(10000 + n % 90000)})
+    elif category == 'sneakers':
+        mp.update({'stockx_slug': f"{title.lower().replace(' ', '-')}-{n}"})
+    else:
+        mp.update({'ean': f'80{n:011d}'})
+    return mp
+
+
+def generate(path: str, n_items: int, n_users: int, heavy_share: float, catalog_ratio: float,
+             years: int, interval_days: int, seed: int, batch: int = 5000, today: date = REFERENCE_DATE):
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    db.init_db(path)
+    conn = db.get_db_connection(path)
+    cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=OFF")
+    cur.execute("PRAGMA synchronous=OFF")
+
+    # --- utenti ---
+    cur.execute("INSERT INTO users (username, password, nickname, ref_currency) VALUES (?, ?, ?, ?)",
+                (BENCH_USER[0], BENCH_USER[1], 'Bench', 'EUR'))
+    user_ids = [cur.lastrowid]
+    for u in range(1, n_users):
+        cur.execute("INSERT INTO users (username, password, nickname, ref_currency) VALUES (?, ?, ?, ?)",
+                    (f'user{u:06d}', 'password', f'User {u}', rnd.choice(['EUR', 'USD', 'GBP'])))
+        user_ids.append(cur.lastrowid)
+
+    # --- global catalog ---
+    cats = list(CATEGORIES.keys())
+    n_catalog = max(1, int(n_items * catalog_ratio))
+    now = today.isoformat()
+    catalog = []  # (gid, category, title, market_params)
+    rows = []
+    for n in range(n_catalog):
+        category = cats[n % len(cats)]
+        title = f"{rnd.choice(CATEGORIES[category])} #{n}"
+        mp = market_params_for(category, title, n)
+        mp_json = json.dumps(mp, ensure_ascii=False)
+        idmap = hlp.normalize_identifiers(category, mp_json)
+        rows.append((hlp.preferred_catalog_key(category, idmap), title, category, mp_json, mp_json, '[]', now, now,
+                     idmap['ident_ean'], idmap['ident_serial'], idmap['ident_tcg_id'], idmap['ident_discogs_id'],
+                     idmap['ident_pc_id'], idmap['ident_lego_set'], idmap['ident_stockx_slug']))
+        catalog.append((n + 1, category, title, mp))
+    for i in range(0, len(rows), batch):
+        cur.executemany("""
+            INSERT INTO global_catalog (catalog_key, canonical_name, category, identifiers, market_params, info_links,
+                created_at, updated_at, ident_ean, ident_serial, ident_tcg_id, ident_discogs_id, ident_pc_id,
+                ident_lego_set, ident_stockx_slug)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows[i:i + batch])
+
+    # --- snapshot di prezzo pluriennali ---
+    start = today - timedelta(days=365 * years)
+    n_snap = 0
+    rows = []
+    for gid, category, _, _ in catalog:
+        base = rnd.uniform(5, 400)
+        for source in SOURCES[category]:
+            day = start + timedelta(days=rnd.randint(0, interval_days - 1))
+            price = base
+            while day <= today:
+                price = max(1.0, price * rnd.uniform(0.95, 1.07))
+                spread = price * rnd.uniform(0.05, 0.4)
+                rows.append((gid, day.isoformat(), source, rnd.randint(1, 60), round(price, 2), round(price * 0.98, 2),
+                             round(price - spread, 2), round(price + spread, 2), '{}', day.isoformat()))
+                day += timedelta(days=interval_days)
+                if len(rows) >= batch:
+                    cur.executemany("""
+                        INSERT OR IGNORE INTO global_catalog_prices
+                            (global_id, ref_date, source, samples_count, avg, median, min, max, query, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
+                    n_snap += len(rows)
+                    rows = []
+    if rows:
+        cur.executemany("""
+            INSERT OR IGNORE INTO global_catalog_prices
+                (global_id, ref_date, source, samples_count, avg, median, min, max, query, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        n_snap += len(rows)
+
+    # --- items ---
+    rows = []
+    first_day = date(2010, 1, 1)
+    span = (today - first_day).days
+    for n in range(n_items):
+        if rnd.random() < heavy_share or len(user_ids) == 1:
+            uid = user_ids[0]
+        else:
+            uid = user_ids[rnd.randint(1, len(user_ids) - 1)]
+        gid, category, title, mp = catalog[rnd.randrange(len(catalog))]
+        currency = rnd.choice(CURRENCIES)
+        price = round(rnd.uniform(2, 600), 2)
+        pdate = first_day + timedelta(days=rnd.randint(0, span))
+        sold = rnd.random() < 0.25
+        sdate = pdate + timedelta(days=rnd.randint(1, 900)) if sold else None
+        if sdate and sdate > today:
+            sdate = today
+        rows.append((
+            uid, title, f'Descrizione {title}', category, price, round(hlp.convert_currency(price, currency, 'EUR'), 2),
+            pdate.isoformat(), round(price * rnd.uniform(0.6, 2.5), 2) if sold else None,
+            sdate.isoformat() if sdate else None, '[]', '[]', ','.join(rnd.sample(TAGS, rnd.randint(0, 3))), None,
+            rnd.randint(1, 3), rnd.choice(CONDITIONS), currency, rnd.choice(LANGUAGES),
+            json.dumps(mp, ensure_ascii=False), gid
+        ))
+        if len(rows) >= batch:
+            cur.executemany("""
+                INSERT INTO items (user_id, name, description, category, purchase_price, purchase_price_curr_ref,
+                    purchase_date, sale_price, sale_date, marketplace_links, info_links, tags, image_path, quantity,
+                    condition, currency, language, market_params, global_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            rows = []
+    if rows:
+        cur.executemany("""
+            INSERT INTO items (user_id, name, description, category, purchase_price, purchase_price_curr_ref,
+                purchase_date, sale_price, sale_date, marketplace_links, info_links, tags, image_path, quantity,
+                condition, currency, language, market_params, global_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return {'users': len(user_ids), 'items': n_items, 'catalog': n_catalog, 'snapshots': n_snap}
+
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', choices=sorted(SIZES), help='taglia predefinita (alternativa a --items)')
+    ap.add_argument('--items', type=int, default=1000)
+    ap.add_argument('--users', type=int, default=0, help='default: 1 utente ogni 500 items (min 2)')
+    ap.add_argument('--heavy-share', type=float, default=0.2, help="quota di items dell'utente bench")
+    ap.add_argument('--catalog-ratio', type=float, default=0.1, help='voci di global_catalog per item')
+    ap.add_argument('--years', type=int, default=3)
+    ap.add_argument('--interval-days', type=int, default=30, help='distanza tra snapshot di prezzo')
+    ap.add_argument('--seed', type=int, default=1234)
+    ap.add_argument('--today', type=date.fromisoformat, default=REFERENCE_DATE,
+                    help=f'data di riferimento YYYY-MM-DD (default {REFERENCE_DATE.isoformat()})')
+    ap.add_argument('--db', default='/tmp/cs_bench.db')
+    args = ap.parse_args()
+
+    n_items = SIZES[args.size] if args.size else args.items
+    n_users = args.users or max(2, n_items // 500)
+    t0 = time.perf_counter()
+    stats = generate(args.db, n_items, n_users, args.heavy_share, args.catalog_ratio,
+                     args.years, args.interval_days, args.seed, today=args.today)
+    print(f"{args.db}: {stats} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Import del dump mensile delle release Discogs nel catalogo globale (dsd.import_dump),
+con throughput (release/s) e picco di memoria.
+
+Senza --dump genera un dump sintetico con la struttura di discogs_YYYYMMDD_releases.xml.gz
+(--generate release). L'import è riprendibile: rilanciando lo stesso comando dopo
+un'interruzione (Ctrl-C o --max-releases) riparte dall'ultimo blocco salvato.
+
+Uso:
+    python bench/import_discogs.py --db /tmp/cs_100k.db --dump discogs_20250101_releases.xml.gz
+    python bench/import_discogs.py --db /tmp/cs_dd.db [--generate 200000] [--max-releases 50000] [--restart]
+"""
+import argparse
+import gzip
+import os
+import random
+import resource
+import sys
+from xml.sax.saxutils import escape, quoteattr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import db, dsd  # noqa: E402
+
+FORMATS = ['Vinyl', 'Vinyl', 'CD', 'CD', 'Cassette', 'File']
+WORDS = ['Blue', 'Night', 'Love', 'Dance', 'Dream', 'Fire', 'City', 'Ocean', 'Gold', 'Radio', 'Heart', 'Sky']
+
+
+def generate(path: str, n: int, seed: int = 11):
+    rnd = random.Random(seed)
+    with gzip.open(path, 'wt', encoding='utf-8') as fh:
+        fh.write('<releases>\n')
+        for i in range(1, n + 1):
+            title = ' '.join(rnd.sample(WORDS, 2)) + f' {i}'
+            barcode = (f'<identifiers><identifier type="Barcode" value="{rnd.randint(10**11, 10**12 - 1)}"/>'
+                       f'<identifier type="Matrix / Runout" value="A1"/></identifiers>') if rnd.random() < 0.6 else ''
+            fh.write(
+                f'<release id="{i}" status="Accepted"><images><image type="primary" uri="" width="600" height="600"/></images>'
+                f'<artists><artist><id>{i % 5000}</id><name>{escape(f"Artist {i % 5000}")}</name><anv></anv></artist></artists>'
+                f'<title>{escape(title)}</title>'
+                f'<labels><label name={quoteattr(f"Label {i % 300}")} catno="CAT{i:06d}" id="{i % 300}"/></labels>'
+                f'<formats><format name="{rnd.choice(FORMATS)}" qty="1" text=""><descriptions><description>LP</description></descriptions></format></formats>'
+                f'<genres><genre>Electronic</genre></genres><country>Italy</country>'
+                f'<released>{rnd.randint(1960, 2024)}-01-01</released>'
+                f'<master_id is_main_release="true">{i // 3}</master_id>{barcode}'
+                f'<tracklist><track><position>A1</position><title>Track</title><duration>3:30</duration></track></tracklist>'
+                f'</release>\n')
+        fh.write('</releases>\n')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', required=True)
+    ap.add_argument('--dump', help='dump Discogs delle release (.xml o .xml.gz); se assente ne genera uno sintetico')
+    ap.add_argument('--generate', type=int, default=200000)
+    ap.add_argument('--batch', type=int, default=10000)
+    ap.add_argument('--max-releases', type=int, help='ferma l\'import dopo N release (riprendibile)')
+    ap.add_argument('--restart', action='store_true', help='ignora lo stato salvato e riparte dall\'inizio del dump')
+    args = ap.parse_args()
+
+    path = args.dump
+    if not path:
+        path = os.path.splitext(args.db)[0] + '_discogs_releases.xml.gz'
+        if not os.path.exists(path):
+            generate(path, args.generate)
+            print(f"generated {args.generate} releases in {path}")
+
+    db.init_db(args.db)
+    state = dsd.import_dump(args.db, path, args.batch, max_releases=args.max_releases, restart=args.restart,
+                            progress=lambda s: print(f"  {s['scanned']} releases, {s['created']} created, "
+                                                     f"{s['rows_per_s']} releases/s", end='\r'))
+    print()
+    print({k: state[k] for k in ('status', 'scanned', 'created', 'linked', 'skipped', 'last_item_id',
+                                  'releases_this_run', 'seconds', 'rows_per_s')})
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Import della price guide PriceCharting (CSV) nella tabella locale pricecharting_guide
+(pcg.import_csv), con tempi di import e di lookup.
+
+Senza --csv genera un CSV sintetico con il formato del download PriceCharting
+(--generate righe), utile per misurare l'import su volumi realistici.
+
+Uso:
+    python bench/import_pricecharting.py --db /tmp/cs_100k.db --csv price-guide.csv[.gz]
+    python bench/import_pricecharting.py --db /tmp/cs_pc.db [--generate 100000] [--lookups 10000]
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import db, pcg  # noqa: E402
+
+HEADER = ['id', 'console-name', 'product-name', 'loose-price', 'cib-price', 'new-price', 'graded-price',
+          'box-only-price', 'manual-only-price', 'retail-loose-buy', 'retail-loose-sell', 'retail-cib-buy',
+          'retail-cib-sell', 'retail-new-buy', 'retail-new-sell', 'sales-volume', 'genre', 'release-date', 'upc']
+CONSOLES = ['GameBoy', 'Game Boy Color', 'Super Nintendo', 'Nintendo 64', 'Playstation', 'Sega Genesis', 'PAL Gameboy']
+WORDS = ['Super', 'Mario', 'Zelda', 'Pokemon', 'Red', 'Blue', 'Metroid', 'Kirby', 'Tetris', 'Land', 'World', 'Quest']
+
+
+def generate(path: str, n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    with open(path, 'w', newline='') as fh:
+        w = csv.writer(fh)
+        w.writerow(HEADER)
+        for i in range(n):
+            base = rnd.uniform(2, 300)
+            price = lambda m: f'${base * m:.2f}'
+            w.writerow([5000 + i, rnd.choice(CONSOLES), ' '.join(rnd.sample(WORDS, 3)) + f' {i}',
+                        price(1), price(1.8), price(3.5), price(6), price(0.6), price(0.3),
+                        price(0.5), price(1.1), price(0.9), price(2.0), price(1.6), price(3.9),
+                        rnd.randint(0, 500), 'Action', f'{rnd.randint(1985, 2015)}-01-01', f'{rnd.randint(10**11, 10**12 - 1)}'])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', required=True)
+    ap.add_argument('--csv', help='CSV PriceCharting (anche .gz); se assente ne genera uno sintetico')
+    ap.add_argument('--generate', type=int, default=100000)
+    ap.add_argument('--batch', type=int, default=5000)
+    ap.add_argument('--lookups', type=int, default=10000)
+    args = ap.parse_args()
+
+    path = args.csv
+    if not path:
+        path = os.path.splitext(args.db)[0] + '_pricecharting.csv'
+        generate(path, args.generate)
+        print(f"generated {args.generate} rows in {path}")
+
+    db.init_db(args.db)
+    summary = pcg.import_csv(args.db, path, args.batch,
+                             progress=lambda p: print(f"  {p['rows']} rows", end='\r'))
+    print()
+    print(summary, f"{summary['rows'] / max(summary['seconds'], 0.001):.0f} rows/s")
+
+    conn = db.get_db_connection(args.db); cur = conn.cursor()
+    cur.execute("SELECT id, product_name, console_name, upc FROM pricecharting_guide ORDER BY RANDOM() LIMIT ?", (args.lookups,))
+    sample = [dict(r) for r in cur.fetchall()]
+    for label, kwargs in (('id', lambda r: {'pricecharting_id': r['id']}),
+                          ('upc', lambda r: {'upc': r['upc']}),
+                          ('title+console', lambda r: {'title': r['product_name'], 'console': r['console_name']})):
+        t0 = time.perf_counter()
+        hits = sum(1 for r in sample if pcg.find(cur, **kwargs(r)))
+        secs = time.perf_counter() - t0
+        print(f"lookup by {label:<14} {hits}/{len(sample)} hits, {secs * 1e6 / max(len(sample), 1):.0f} us/lookup")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Audit dei tempi di import e budget di avvio a freddo del worker.
+
+Esegue in un processo pulito `python -X importtime` caricando app.py (senza avviare
+il server), poi misura create_app() su un database già migrato. Fallisce (exit 1) se:
+
+- un modulo pesante usato solo dagli stimatori (LAZY_MODULES) viene importato all'avvio:
+  va importato dentro l'handler che lo usa;
+- il tempo di import di app.py supera IMPORT_BUDGET_MS;
+- create_app() su database aggiornato supera CREATE_APP_BUDGET_MS.
+
+Budget di avvio (miglior tempo su --runs esecuzioni, macchina di sviluppo):
+    import app.py        <= 400 ms   (dominato da flask/werkzeug/jinja2)
+    create_app()         <=  50 ms   (init_db = una SELECT su schema_version)
+
+Uso:
+    python bench/importtime.py [--runs 3] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT_BUDGET_MS = 400
+CREATE_APP_BUDGET_MS = 50
+LAZY_MODULES = ('requests', 'urllib3', 'charset_normalizer', 'dotenv', 'statistics')
+
+LOADER = """
+import importlib.util, os, sys, time
+sys.path.insert(0, {root!r})
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join({root!r}, 'app.py'))
+m = importlib.util.module_from_spec(spec); spec.loader.exec_module(m)
+t1 = time.perf_counter()
+m.create_app({db!r})
+t2 = time.perf_counter()
+m.create_app({db!r})
+t3 = time.perf_counter()
+print('TIMING', (t1 - t0) * 1000, (t3 - t2) * 1000)
+"""
+
+
+def run_once(db_path: str):
+    code = LOADER.format(root=ROOT, db=db_path)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(proc.returncode)
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = [x.strip() for x in line[len('import time:'):].split('|')]
+        modules.append((name, int(self_us), int(cumulative_us)))
+    timing = [l for l in proc.stdout.splitlines() if l.startswith('TIMING')][-1].split()
+    return modules, float(timing[1]), float(timing[2])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--runs', type=int, default=3)
+    ap.add_argument('--top', type=int, default=15)
+    args = ap.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'importtime.db')
+    best = None
+    for _ in range(args.runs):
+        res = run_once(db_path)
+        if best is None or res[1] < best[1]:
+            best = res
+    modules, import_ms, create_ms = best
+
+    print(f"top {args.top} imports by cumulative time:")
+    for name, self_us, cum_us in sorted(modules, key=lambda m: -m[2])[:args.top]:
+        print(f"  {cum_us / 1000:8.1f} ms  {name}")
+    print(f"import app.py:  {import_ms:8.1f} ms (budget {IMPORT_BUDGET_MS} ms)")
+    print(f"create_app():   {create_ms:8.1f} ms (budget {CREATE_APP_BUDGET_MS} ms)")
+
+    failures = []
+    loaded = {name for name, _, _ in modules}
+    for mod in LAZY_MODULES:
+        if mod in loaded:
+            failures.append(f"'{mod}' is imported at startup; import it lazily inside the handler")
+    if import_ms > IMPORT_BUDGET_MS:
+        failures.append(f"import time {import_ms:.1f} ms exceeds budget {IMPORT_BUDGET_MS} ms")
+    if create_ms > CREATE_APP_BUDGET_MS:
+        failures.append(f"create_app {create_ms:.1f} ms exceeds budget {CREATE_APP_BUDGET_MS} ms")
+    for f in failures:
+        print("FAIL:", f)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
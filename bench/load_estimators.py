@@ -0,0 +1,143 @@
+"""
+Test di carico degli endpoint di stima/refresh contro gli stub locali dei provider.
+
+Avvia bench/stub_providers.py in-process, genera (o riusa) un dataset, avvia l'app
+su un server WSGI threaded locale e la bombarda da --concurrency client in parallelo.
+Riporta throughput e latenze (p50/p95/p99) per endpoint e le chiamate ricevute dagli stub.
+
+Uso:
+    python bench/load_estimators.py [--requests 500] [--concurrency 16] \
+        [--latency-ms 150] [--error-rate 0.02] [--rps-limit 0] [--db /tmp/cs_load.db]
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import gen_dataset  # noqa: E402
+import stub_providers  # noqa: E402
+
+ESTIMATORS = {
+    'ebay': ('/api/ebay-estimate', None),
+    'pricecharting': ('/api/pricecharting-estimate', ('videogames',)),
+    'discogs': ('/api/discogs-estimate', ('vinyl', 'cd')),
+    'lego': ('/api/lego-estimate', ('lego',)),
+    'justtcg': ('/api/justtcg-estimate', ('trading card',)),
+    'stockx': ('/api/stockx-estimate', ('sneakers',)),
+}
+
+
+def pick_targets(db_path: str, rnd: random.Random, n: int) -> list:
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM users WHERE username = ?", (gen_dataset.BENCH_USER[0],))
+    uid = cur.fetchone()[0]
+    targets = []
+    for name, (path, cats) in ESTIMATORS.items():
+        if cats:
+            cur.execute(f"SELECT id FROM items WHERE user_id = ? AND category IN ({','.join('?' * len(cats))}) LIMIT 200",
+                        (uid, *cats))
+        else:
+            cur.execute("SELECT id FROM items WHERE user_id = ? LIMIT 200", (uid,))
+        ids = [r[0] for r in cur.fetchall()]
+        if ids:
+            targets.append((name, 'GET', lambda ids=ids, path=path: f"{path}?item_id={rnd.choice(ids)}"))
+    cur.execute("SELECT id FROM global_catalog LIMIT 200")
+    gids = [r[0] for r in cur.fetchall()]
+    if gids:
+        targets.append(('gc_refresh', 'POST', lambda: f"/api/global-catalog/{rnd.choice(gids)}/refresh"))
+    conn.close()
+    return [targets[i % len(targets)] for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=500)
+    ap.add_argument('--concurrency', type=int, default=16)
+    ap.add_argument('--latency-ms', type=float, default=150)
+    ap.add_argument('--jitter-ms', type=float, default=50)
+    ap.add_argument('--error-rate', type=float, default=0.02)
+    ap.add_argument('--rps-limit', type=float, default=0)
+    ap.add_argument('--items', type=int, default=5000)
+    ap.add_argument('--db', default='/tmp/cs_load.db')
+    ap.add_argument('--seed', type=int, default=99)
+    args = ap.parse_args()
+
+    stub_server, stub_base, stub_stats = stub_providers.start(0, args.latency_ms, args.jitter_ms, args.error_rate, args.rps_limit)
+    os.environ.update(stub_providers.env_for(stub_base))
+
+    if not os.path.exists(args.db):
+        gen_dataset.generate(args.db, args.items, max(2, args.items // 500), 0.2, 0.1, 1, 90, args.seed)
+
+    spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app = module.create_app(os.path.abspath(args.db))
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    rnd = random.Random(args.seed)
+    plan = pick_targets(args.db, rnd, args.requests)
+    rnd.shuffle(plan)
+    local = threading.local()
+    results = []  # (name, seconds, status)
+    lock = threading.Lock()
+
+    def session() -> requests.Session:
+        s = getattr(local, 's', None)
+        if s is None:
+            s = local.s = requests.Session()
+            s.post(f'{base}/login', json={'username': gen_dataset.BENCH_USER[0], 'password': gen_dataset.BENCH_USER[1]})
+        return s
+
+    def run(target):
+        name, method, make_url = target
+        url = base + make_url()
+        t0 = time.perf_counter()
+        try:
+            status = session().request(method, url, timeout=60).status_code
+        except requests.RequestException:
+            status = 'error'
+        with lock:
+            results.append((name, time.perf_counter() - t0, status))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, plan))
+    wall = time.perf_counter() - t0
+
+    print(f"stub latency={args.latency_ms}±{args.jitter_ms} ms error_rate={args.error_rate} rps_limit={args.rps_limit}")
+    print(f"{len(results)} requests, concurrency {args.concurrency}, {wall:.1f}s wall, {len(results) / wall:.1f} req/s")
+    print(f"{'endpoint':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'non-200':>9}")
+    by_name = {}
+    for name, secs, status in results:
+        by_name.setdefault(name, []).append((secs, status))
+    for name, rows in sorted(by_name.items()):
+        lat = sorted(s * 1000 for s, _ in rows)
+        q = lambda p: lat[min(len(lat) - 1, int(len(lat) * p))]
+        bad = sum(1 for _, st in rows if st != 200)
+        print(f"{name:<16}{len(rows):>6}{statistics.median(lat):>10.1f}{q(0.95):>10.1f}{q(0.99):>10.1f}{bad:>9}")
+    print("stub calls per provider:", dict(sorted(stub_stats.items())))
+
+    server.shutdown()
+    stub_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
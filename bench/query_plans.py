@@ -0,0 +1,240 @@
+"""
+Regressione dei query plan: esercita tutte le route dell'app su un dataset generato,
+raccoglie tutti gli statement SQL eseguiti (sqt.capture, anche dai thread di lavoro) e per
+ciascuno stampa l'EXPLAIN QUERY PLAN. Esce con codice 1 se un percorso "caldo" fa SCAN items o
+se un endpoint supera il suo budget di query (sqt.assert_max_queries).
+
+Le route vengono lette da app.url_map: REQUESTS sono i percorsi caldi con parametri e budget
+espliciti, tutte le altre route (comprese quelle aggiunte in futuro) vengono chiamate una volta
+per metodo con i parametri di ROUTE_ARGS, se presenti. I provider esterni sono gli stub locali
+di bench/stub_providers.py.
+
+Gli statement globali (conteggi/statistiche di piattaforma, pulizia admin) sono
+ammessi in ALLOWED_SCANS perché scorrono legittimamente tutta la tabella.
+
+Uso:
+    python bench/query_plans.py [--db /tmp/cs_plans.db] [--items 5000] [--verbose]
+"""
+import argparse
+import importlib.util
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import phs, sqt  # noqa: E402
+
+import gen_dataset  # noqa: E402
+import stub_providers  # noqa: E402
+
+# Tabelle che non devono mai essere scansionate nei percorsi per-utente
+HOT_TABLES = ('items',)
+
+# Statement (normalizzati) che possono scansionare: aggregati sull'intera piattaforma
+ALLOWED_SCANS = {
+    "SELECT COUNT(*) FROM items",
+    "SELECT tags FROM items WHERE tags IS NOT NULL AND TRIM(tags)<>''",
+}
+
+# (metodo, url, body, max query) — {item_id} e {gid} sono sostituiti con ids reali dell'utente bench.
+# Il budget è il numero di statement attuale: alzarlo solo consapevolmente.
+REQUESTS = [
+    ('GET', '/api/items', None, 2),
+    ('GET', '/api/items?q=abbey&category=vinyl&tags=raro', None, 2),
+    ('GET', '/api/items/changes', None, 2),
+    ('GET', '/api/items/changes?since=1', None, 2),
+    ('GET', '/api/user', None, 1),
+    ('GET', '/api/profile/stats', None, 1),
+    ('GET', '/api/export/csv', None, 1),
+    ('GET', '/api/dashboard/summary', None, 6),
+    ('GET', '/api/dashboard/trend', None, 2),
+    ('GET', '/api/platform/overview', None, 3),
+    ('GET', '/api/global-catalog/search?q=charizard', None, 1),
+    ('GET', '/api/global-catalog/search?q=ab', None, 1),
+    ('GET', '/api/global-catalog/{gid}/prices', None, 1),
+    ('GET', '/api/global-catalog/{gid}/summary', None, 2),
+    ('GET', '/api/ebay-history?item_id={item_id}', None, 2),
+    ('GET', '/api/items/{item_id}/price-history?since=2024-01-01', None, 2),
+    ('POST', '/api/items', {'name': 'Plan probe', 'category': 'vinyl', 'purchase_price': 10, 'currency': 'EUR'}, 4),
+    ('PUT', '/api/items/{item_id}', {'name': 'Plan probe renamed'}, 4),
+    ('DELETE', '/api/items/{item_id}', None, 4),
+]
+
+
+# Parametri per le route non in REQUESTS: endpoint -> (query string, body JSON). Gli
+# id {item_id}, {gid}, {gid2}, {uid} sono sostituiti come nei path; {csv} è un CSV di prova.
+ROUTE_ARGS = {
+    'api_convert': ('amount=10&from=USD&to=EUR', None),
+    'ebay_estimate': ('item_id={item_id}', None),
+    'pricecharting_estimate': ('item_id={item_id}', None),
+    'discogs_estimate': ('item_id={item_id}', None),
+    'lego_estimate': ('item_id={item_id}', None),
+    'justtcg_estimate': ('item_id={item_id}', None),
+    'stockx_estimate': ('item_id={item_id}', None),
+    'api_code_resolve': ('', {'code_type': 'UPC', 'code': '045496590086'}),
+    'api_code_resolve_batch': ('', {'codes': [{'code_type': 'UPC', 'code': '045496590086'},
+                                              {'code_type': 'UPC', 'code': '045496590093'}]}),
+    'api_gc_ensure_or_resolve': ('', {'category': 'other', 'market_params': {'ean': '8099999999999'}}),
+    'api_gc_link': ('', {'max_chunks': 1}),
+    'put_global_info_links': ('', {'links': ['https://example.com/plan-probe']}),
+    'admin_catalog_dedupe': ('', {}),
+    'admin_catalog_merge': ('', {'keep_id': '{gid}', 'merge_ids': ['{gid2}']}),
+    'admin_pricecharting_import': ('', {'path': '{csv}'}),
+    'admin_create_user': ('', {'username': 'plan-probe', 'password': 'plan-probe'}),
+    'admin_update_user': ('', {'nickname': 'Plan probe'}),
+    'register': ('', {'username': 'plan-probe-2', 'password': 'plan-probe'}),
+    'login': ('', {'username': gen_dataset.BENCH_USER[0], 'password': gen_dataset.BENCH_USER[1]}),
+}
+# Route chiamate senza sessione (register/login/logout cambierebbero la sessione dell'utente bench)
+ANON_ENDPOINTS = {'register', 'login', 'logout'}
+SKIP_ENDPOINTS = {'static'}
+METHOD_ORDER = ('GET', 'POST', 'PUT', 'DELETE')
+
+
+def normalize(sql: str) -> str:
+    return ' '.join(sql.split())
+
+
+def load_app(db_path: str):
+    spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_app(os.path.abspath(db_path))
+
+
+def _fill(value, ids: dict):
+    """Sostituisce i segnaposto {name} di ROUTE_ARGS (anche dentro liste/dict), mantenendo gli int."""
+    if isinstance(value, dict):
+        return {k: _fill(v, ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, ids) for v in value]
+    if isinstance(value, str):
+        m = re.fullmatch(r'\{(\w+)\}', value)
+        return ids[m.group(1)] if m else value.format(**ids)
+    return value
+
+
+def route_requests(app, ids: dict) -> list:
+    """[(endpoint, metodo, url, body)] per ogni route/metodo di app.url_map non coperto da REQUESTS."""
+    covered = {(method, url.split('?')[0]) for method, url, _, _ in REQUESTS}
+    out = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint in SKIP_ENDPOINTS:
+            continue
+        path = re.sub(r'<(?:\w+:)?(\w+)>', lambda m: '{' + m.group(1) + '}', rule.rule)
+        for method in sorted(rule.methods & set(METHOD_ORDER), key=METHOD_ORDER.index):
+            if (method, path) in covered:
+                continue
+            query, body = ROUTE_ARGS.get(rule.endpoint, ('', None))
+            url = path.format(**ids) + (f"?{_fill(query, ids)}" if query else '')
+            out.append((rule.endpoint, method, url, _fill(body, ids) if method != 'GET' else None))
+    return sorted(out, key=lambda r: METHOD_ORDER.index(r[1]))
+
+
+def collect(app, db_path: str) -> tuple:
+    """
+    Esegue REQUESTS come utente bench, poi tutte le altre route (route_requests). Ritorna
+    ([(endpoint, sql, params)] senza duplicati, [(endpoint, messaggio)] degli endpoint oltre
+    il budget di query, [(endpoint, status)] delle route che hanno risposto 5xx, route esercitate).
+    """
+    conn = sqlite3.connect(db_path)
+    uid = conn.execute("SELECT id FROM users WHERE username = ?", (gen_dataset.BENCH_USER[0],)).fetchone()[0]
+    item_id, gid = conn.execute("SELECT id, global_id FROM items WHERE user_id = ? AND global_id IS NOT NULL LIMIT 1",
+                                (uid,)).fetchone()
+    gid2 = conn.execute("SELECT MAX(id) FROM global_catalog WHERE id <> ?", (gid,)).fetchone()[0]
+    spare_uid = conn.execute("SELECT MAX(id) FROM users WHERE id <> ? AND username <> 'admin'", (uid,)).fetchone()[0]
+    conn.close()
+    csv_path = os.path.join(tempfile.mkdtemp(), 'price-guide.csv')
+    with open(csv_path, 'w') as fh:
+        fh.write("id,product-name,console-name,loose-price,cib-price,new-price\n1,Plan Probe,Game Boy,$1.00,$2.00,$3.00\n")
+    ids = {'item_id': item_id, 'gid': gid, 'gid2': gid2, 'uid': spare_uid,
+           'a_id': min(gid, gid2), 'b_id': max(gid, gid2), 'csv': csv_path}
+
+    clients = {'user': app.test_client(), 'admin': app.test_client(), 'anon': app.test_client()}
+    for name, creds in (('user', gen_dataset.BENCH_USER), ('admin', ('admin', 'admin'))):
+        r = clients[name].post('/login', json={'username': creds[0], 'password': creds[1]})
+        if r.status_code != 200:
+            raise SystemExit(f"login failed for {creds[0]}: {r.status_code}")
+
+    seen, statements, over_budget, errors = set(), [], [], []
+
+    def keep(endpoint, captured):
+        for sql, params, _ in captured:
+            key = normalize(sql)
+            if params is None or key in seen:
+                continue  # executemany: niente piano per riga
+            seen.add(key)
+            statements.append((endpoint, sql, params))
+
+    for method, url, body, max_queries in REQUESTS:
+        url = url.format(**ids)
+        try:
+            with sqt.assert_max_queries(max_queries) as captured:
+                clients['user'].open(url, method=method, json=body)
+        except AssertionError as e:
+            over_budget.append((f"{method} {url}", str(e)))
+        keep(f"{method} {url}", captured)
+
+    sweep = route_requests(app, ids)
+    for endpoint, method, url, body in sweep:
+        client = clients['anon' if endpoint in ANON_ENDPOINTS
+                         else 'admin' if endpoint.startswith('admin_') or endpoint == 'metrics' else 'user']
+        with sqt.capture(all_threads=True) as captured:
+            r = client.open(url, method=method, json=body)
+            # lo storico prezzi bufferizzato viene scritto dentro la stessa cattura
+            phs.flush_all()
+        if r.status_code >= 500:
+            errors.append((f"{method} {url}", r.status_code))
+        keep(f"{method} {url}", captured)
+    routes = len(REQUESTS) + len(sweep)
+    return statements, over_budget, errors, routes
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', default='/tmp/cs_plans.db')
+    ap.add_argument('--items', type=int, default=5000)
+    ap.add_argument('--verbose', action='store_true', help='stampa il piano di ogni statement')
+    args = ap.parse_args()
+
+    # dataset sempre rigenerato: le richieste di scrittura modificano il db
+    gen_dataset.generate(args.db, args.items, max(2, args.items // 500), 0.2, 0.1, 1, 90, 4321)
+    stubs, base, _ = stub_providers.start(0, latency_ms=0, jitter_ms=0)
+    os.environ.update(stub_providers.env_for(base))
+    app = load_app(args.db)
+    try:
+        statements, over_budget, errors, routes = collect(app, args.db)
+    finally:
+        stubs.shutdown()
+
+    conn = sqlite3.connect(args.db)
+    failures = []
+    for endpoint, sql, params in statements:
+        plan = sqt.explain(conn, sql, params)
+        scans = [d for d in plan if any(d.startswith(f'SCAN {t}') for t in HOT_TABLES)]
+        bad = scans and normalize(sql) not in ALLOWED_SCANS
+        if bad:
+            failures.append((endpoint, sql, plan))
+        if args.verbose or bad:
+            print(f"{'FAIL' if bad else 'ok  '} {endpoint}: {normalize(sql)[:120]}")
+            for d in plan:
+                print(f"       {d}")
+    conn.close()
+
+    for endpoint, message in over_budget:
+        print(f"FAIL {endpoint}: {message}")
+    for endpoint, status in errors:
+        print(f"warn {endpoint}: HTTP {status}")
+
+    print(f"{routes} route requests, {len(statements)} statements checked, "
+          f"{len(failures)} with SCAN on {', '.join(HOT_TABLES)}, {len(over_budget)} endpoints over query budget")
+    sys.exit(1 if failures or over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
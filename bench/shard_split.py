@@ -0,0 +1,40 @@
+"""
+Divide un database esistente negli shard delle collezioni (shd.split): copia items, revisioni,
+feed delle modifiche, storico prezzi e snapshot finanziari di ogni utente nel file
+<dir>/items_<k>.db con k = user_id % N, poi li cancella dal database condiviso (salvo --keep).
+
+Dopo la divisione avviare l'app con lo stesso numero di shard:
+    SHARD_COUNT=8 [SHARD_DIR=/data/database_shards] python app.py
+
+Uso:
+    python bench/shard_split.py --db database.db --shards 8 [--dir database_shards] [--keep]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import db, shd  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', required=True)
+    ap.add_argument('--shards', type=int, required=True)
+    ap.add_argument('--dir', help='cartella degli shard (default: <db>_shards accanto al database)')
+    ap.add_argument('--keep', action='store_true', help='non cancellare le righe copiate dal database condiviso')
+    args = ap.parse_args()
+    if args.shards < 1:
+        ap.error('--shards must be at least 1')
+
+    db.init_db(args.db)   # shard e database condiviso devono partire dallo stesso schema
+    shard_dir = args.dir or shd.default_dir(args.db)
+    result = shd.split(args.db, shard_dir, args.shards, keep=args.keep,
+                       progress=lambda p: print(f"  shard {p['shard']}: {p['path']}"))
+    print(f"moved {result['moved']} in {result['seconds']}s")
+    print(f"start the app with SHARD_COUNT={args.shards}" + (f" SHARD_DIR={shard_dir}" if args.dir else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Verifica di conformità dei backend di storage: esegue lo stesso percorso (utenti, CRUD item,
+feed delle modifiche, dashboard, storico prezzi, merge del catalogo globale) contro SQLite e/o PostgreSQL
+e confronta le risposte con i valori attesi. Esce con codice 1 al primo controllo fallito.
+
+PostgreSQL locale in container:
+    docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=pw --name cs-pg postgres:16
+    pip install 'psycopg[binary]'
+
+Uso:
+    python bench/storage_check.py                                   # solo SQLite (db temporaneo)
+    python bench/storage_check.py --pg postgresql://postgres:pw@127.0.0.1:5432/postgres
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import uuid
+from datetime import date, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from app import db, phs, stg  # noqa: E402
+
+
+def load_app(database: str):
+    spec = importlib.util.spec_from_file_location('collectorstreet', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_app(database)
+
+
+def check(name: str, ok: bool, detail=''):
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}{'' if ok else f': {detail}'}")
+    if not ok:
+        sys.exit(1)
+
+
+def run(database: str):
+    print(f"[{'postgresql' if stg.is_postgres(database) else 'sqlite'}] {database}")
+    app = load_app(database)
+    c = app.test_client()
+    check('admin login', c.post('/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200)
+
+    # utenti: id generato (RETURNING) e vincolo di unicità
+    username = f'check_{uuid.uuid4().hex[:8]}'
+    r = c.post('/api/admin/users', json={'username': username, 'password': 'pw'})
+    check('create user', r.status_code == 201 and isinstance(r.get_json()['id'], int), r.get_json())
+    r = c.post('/api/admin/users', json={'username': username, 'password': 'pw'})
+    check('duplicate username -> 400', r.status_code == 400, r.get_json())
+    c.post('/logout')
+    check('user login', c.post('/login', json={'username': username, 'password': 'pw'}).status_code == 200)
+
+    # dashboard senza item: i totali restano 0 interi (non 0.0 né stringhe) su entrambi i backend
+    empty = c.get('/api/dashboard/summary').get_json()
+    check('empty dashboard summary', all(type(empty[k]) is int and empty[k] == 0
+                                         for k in ('tot_spent', 'tot_sold', 'profit_realized'))
+          and empty['avg_days_in_collection'] is None, empty)
+
+    # CRUD item e feed delle modifiche
+    ids = []
+    for i, (pdate, sdate, sale) in enumerate([('2024-01-05', None, None), ('2024-01-20', '2024-03-01', 30.0),
+                                              ('2024-02-10', None, None)]):
+        r = c.post('/api/items', json={'name': f'Item {i}', 'category': 'vinyl', 'purchase_price': 10 + i,
+                                       'purchase_date': pdate, 'sale_date': sdate, 'sale_price': sale,
+                                       'currency': 'EUR', 'market_params': {'artist': 'X', 'album': f'A{i}'}})
+        check(f'create item {i}', r.status_code == 201, r.get_json())
+        ids.append(r.get_json()['id'])
+    rv = c.get('/api/items/changes').get_json()['rev']
+    check('update item', c.put(f'/api/items/{ids[0]}', json={'name': 'Renamed'}).status_code == 200)
+    check('update missing item -> 404', c.put('/api/items/999999999', json={'name': 'x'}).status_code == 404)
+    check('delete item', c.delete(f'/api/items/{ids[2]}').status_code == 200)
+    delta = c.get(f'/api/items/changes?since={rv}').get_json()
+    check('changes feed', [i['id'] for i in delta['items']] == [ids[0]] and delta['deleted'] == [ids[2]], delta)
+    items = c.get('/api/items').get_json()
+    check('list items', sorted(i['id'] for i in items) == ids[:2], [i['id'] for i in items])
+
+    # dashboard: differenze di date e raggruppamento per mese (SQL del dialetto)
+    summary = c.get('/api/dashboard/summary').get_json()
+    check('dashboard summary', summary['in_collection'] == 1 and summary['tot_sold'] == 30.0, summary)
+    check('dashboard summary types', all(type(summary[k]) in (int, float)
+                                         for k in ('tot_spent', 'tot_sold', 'profit_realized', 'in_collection', 'for_sale'))
+          and type(summary['avg_days_in_collection']) is float, summary)
+    trend = c.get('/api/dashboard/trend').get_json()['points']
+    check('dashboard trend', [p['month'] for p in trend] == ['2024-03'], trend)
+
+    # storico prezzi: scrittura a blocchi + compattazione
+    cfg = app.config['DATABASE']
+    conn = db.get_db_connection(cfg); cur = conn.cursor()
+    today = date.today()
+    cur.executemany(
+        "INSERT INTO item_price_history (item_id, source, day, span, samples, avg, median, min, max, currency) "
+        "VALUES (?, 'ebay', ?, 1, 2, ?, ?, ?, ?, 'EUR')",
+        [(ids[0], phs.to_day(today - timedelta(days=d)), 10.0 + d % 5, 10.0, 5.0, 20.0) for d in range(400)])
+    conn.commit(); conn.close()
+    phs.compact(cfg)
+    conn = db.get_db_connection(cfg); cur = conn.cursor()
+    cur.execute("SELECT SUM(samples) FROM item_price_history WHERE item_id = ?", (ids[0],))
+    check('history compaction keeps samples', cur.fetchone()[0] == 800)
+    conn.close()
+    r = c.get(f'/api/items/{ids[0]}/price-history')
+    check('price history endpoint', r.status_code == 200, r.status_code)
+
+    # merge del catalogo globale: snapshot in conflitto, identificatori e item spostati su keep_id
+    admin = app.test_client()
+    admin.post('/login', json={'username': 'admin', 'password': 'admin'})
+    tag = uuid.uuid4().hex[:8]
+    conn = db.get_db_connection(cfg); cur = conn.cursor()
+    gids = []
+    for n in range(3):
+        cur.execute("INSERT INTO global_catalog (catalog_key, canonical_name, category, ident_ean) "
+                    "VALUES (?, ?, 'vinyl', ?) RETURNING id", (f'check:{tag}:{n}', f'Check {n}', f'{tag}{n}'))
+        gids.append(cur.fetchone()[0])
+    keep, m1, m2 = gids
+    cur.executemany("INSERT INTO global_catalog_prices (global_id, ref_date, source, avg) VALUES (?, ?, ?, ?)",
+                    [(keep, '2024-01-01', 'ebay', 1.0), (m1, '2024-01-01', 'ebay', 2.0),
+                     (m1, '2024-01-02', 'ebay', 3.0), (m2, '2024-01-02', 'ebay', 4.0),
+                     (m2, '2024-01-03', 'discogs', 5.0)])
+    cur.execute("UPDATE items SET global_id = ? WHERE id = ?", (m1, ids[1]))
+    conn.commit(); conn.close()
+    r = admin.post('/api/admin/catalog/merge', json={'keep_id': keep, 'merge_ids': [m1, m2]})
+    check('catalog merge', r.status_code == 200 and r.get_json()['items_moved'] == 1
+          and r.get_json()['prices_moved'] == 2, r.get_json())
+    conn = db.get_db_connection(cfg); cur = conn.cursor()
+    cur.execute("SELECT ref_date, source, avg FROM global_catalog_prices WHERE global_id IN (?, ?, ?) ORDER BY ref_date",
+                (keep, m1, m2))
+    prices = [tuple(row) for row in cur.fetchall()]
+    check('merge keeps one snapshot per day/source', prices == [('2024-01-01', 'ebay', 1.0), ('2024-01-02', 'ebay', 3.0),
+                                                                 ('2024-01-03', 'discogs', 5.0)], prices)
+    cur.execute("SELECT kind, value, global_id FROM global_catalog_identifiers WHERE value LIKE ? OR value LIKE ?",
+                (f'{tag}%', f'check:{tag}:%'))
+    idents = sorted(tuple(row) for row in cur.fetchall())
+    check('merge re-points identifiers', idents == sorted([('ean', f'{tag}{n}', keep) for n in range(3)] +
+                                                         [('key', f'check:{tag}:{n}', keep) for n in (1, 2)]), idents)
+    cur.execute("SELECT global_id FROM items WHERE id = ?", (ids[1],))
+    check('merge moves items', cur.fetchone()[0] == keep)
+    conn.close()
+
+    # cancellazione item: lo storico segue (trigger)
+    c.delete(f'/api/items/{ids[0]}')
+    conn = db.get_db_connection(cfg); cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM item_price_history WHERE item_id = ?", (ids[0],))
+    check('history removed with item', cur.fetchone()[0] == 0)
+    conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sqlite', default=os.path.join(tempfile.mkdtemp(), 'check.db'))
+    ap.add_argument('--pg', help='DSN postgresql://... (se assente si verifica solo SQLite)')
+    args = ap.parse_args()
+    run(args.sqlite)
+    if args.pg:
+        run(args.pg)
+        stg.close_pools()
+
+
+if __name__ == '__main__':
+    main()
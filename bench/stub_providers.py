@@ -0,0 +1,288 @@
+"""
+Stub HTTP locali dei provider di prezzo (eBay Finding, PriceCharting, Discogs,
+Rebrickable, JustTCG, StockX) per test di carico offline degli stimatori.
+
+Un solo server risponde per tutti i provider, distinti dal prefisso del path, con
+le stesse forme di risposta che i parser di app.py si aspettano. Prezzi e
+risultati sono deterministici (derivati dalla query). Latenza, errori e throttling
+(429) sono configurabili.
+
+Uso standalone:
+    python bench/stub_providers.py --port 8765 --latency-ms 150 --error-rate 0.02 --rps-limit 50
+    eval "$(python bench/stub_providers.py --port 8765 --print-env)"   # env per l'app
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def env_for(base: str) -> dict:
+    """Variabili d'ambiente che fanno puntare l'app agli stub (chiavi API fittizie incluse)."""
+    return {
+        'EBAY_FINDING_URL': f'{base}/ebay/services/search/FindingService/v1',
+        'EBAY_CLIENT_ID': 'stub',
+        'PRICECHARTING_API_BASE': f'{base}/pricecharting/api',
+        'PRICECHARTING_TOKEN': 'stub',
+        'DISCOGS_API_BASE': f'{base}/discogs',
+        'DISCOGS_TOKEN': 'stub',
+        'REBRICKABLE_API_BASE': f'{base}/rebrickable/api/v3',
+        'REBRICKABLE_API_KEY': 'stub',
+        'JUSTTCG_API_BASE': f'{base}/justtcg/v1',
+        'JUSTTCG_API_KEY': 'stub',
+        'STOCKX_RAPIDAPI_BASE': f'{base}/stockx-rapid',
+        'STOCKX_RAPIDAPI_KEY': 'stub',
+        'STOCKX_API_BASE': f'{base}/stockx/api',
+    }
+
+
+def _rng(*parts) -> random.Random:
+    seed = hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:12]
+    return random.Random(int(seed, 16))
+
+
+def _first(qs: dict, key: str, default: str = '') -> str:
+    return (qs.get(key) or [default])[0]
+
+
+# --- risposte per provider ---
+
+def ebay(path: str, qs: dict):
+    rnd = _rng('ebay', _first(qs, 'keywords'))
+    n = int(_first(qs, 'paginationInput.entriesPerPage', '25'))
+    items = []
+    for i in range(rnd.randint(0, n)):
+        price = round(rnd.uniform(5, 300), 2)
+        items.append({
+            'title': [f"{_first(qs, 'keywords')} #{i}"],
+            'viewItemURL': [f'https://www.ebay.it/itm/{rnd.randint(10**11, 10**12)}'],
+            'listingInfo': [{'endTime': ['2025-01-01T10:00:00.000Z']}],
+            'sellingStatus': [{
+                'sellingState': ['EndedWithSales' if rnd.random() < 0.85 else 'EndedWithoutSales'],
+                'currentPrice': [{'@currencyId': 'USD', '__value__': str(price)}],
+                'convertedCurrentPrice': [{'@currencyId': 'EUR', '__value__': str(round(price * 0.93, 2))}],
+            }],
+        })
+    return 200, {'findCompletedItemsResponse': [{'ack': ['Success'], 'searchResult': [{'@count': str(len(items)), 'item': items}]}]}
+
+
+def _pc_product(rnd, name: str, pid=None) -> dict:
+    base = rnd.randint(500, 30000)
+    return {
+        'status': 'success', 'id': str(pid or rnd.randint(1000, 99999)), 'product-name': name or 'Stub Game',
+        'console-name': 'Game Boy', 'upc': str(rnd.randint(10**11, 10**12)), 'release-date': '1998-09-28',
+        'loose-price': base, 'cib-price': int(base * 1.8), 'new-price': int(base * 3.5),
+        'retail-loose-sell': int(base * 1.1), 'retail-cib-sell': int(base * 2.0), 'retail-new-sell': int(base * 3.9),
+    }
+
+
+def pricecharting(path: str, qs: dict):
+    if path.endswith('/product'):
+        key = _first(qs, 'q') or _first(qs, 'barcode') or _first(qs, 'id')
+        return 200, _pc_product(_rng('pc', key), _first(qs, 'q') or f'Product {key}')
+    if path.endswith('/search'):
+        rnd = _rng('pc-search', _first(qs, 'q'))
+        return 200, [{'id': str(rnd.randint(1000, 99999)), 'title': f"Result for {_first(qs, 'q')} {i}"} for i in range(rnd.randint(1, 5))]
+    if path.endswith('/products'):
+        pid = _first(qs, 'id')
+        return 200, [_pc_product(_rng('pc', pid), f'Product {pid}', pid)]
+    return 404, {'status': 'error', 'error-message': 'unknown endpoint'}
+
+
+def discogs(path: str, qs: dict):
+    parts = [p for p in path.split('/') if p][1:]  # senza il prefisso /discogs
+    if parts[:1] == ['releases'] and len(parts) == 2:
+        rid = parts[1]
+        rnd = _rng('discogs-rel', rid)
+        return 200, {'id': int(rid) if rid.isdigit() else rid, 'title': f'Release {rid}', 'artists': [{'name': 'Stub Artist'}],
+                     'year': rnd.randint(1960, 2024), 'country': 'Italy', 'labels': [{'name': 'Stub Records'}],
+                     'formats': [{'name': 'Vinyl'}]}
+    if parts[:2] == ['database', 'search']:
+        rnd = _rng('discogs-search', sorted(qs.items()))
+        return 200, {'results': [{'id': rnd.randint(10**5, 10**7), 'title': f"{_first(qs, 'q')} {i}", 'year': str(rnd.randint(1960, 2024)),
+                                  'country': 'EU', 'label': ['Stub Records'], 'format': ['Vinyl', 'LP'], 'catno': f'STB{i:03d}'}
+                                 for i in range(rnd.randint(1, 10))]}
+    if parts[:2] == ['marketplace', 'price_suggestions']:
+        rnd = _rng('discogs-ps', parts[-1])
+        base = rnd.uniform(5, 150)
+        grades = ['Mint (M)', 'Near Mint (NM or M-)', 'Very Good Plus (VG+)', 'Very Good (VG)', 'Good (G)']
+        return 200, {g: {'currency': 'USD', 'value': round(base * (1 - i * 0.18), 2)} for i, g in enumerate(grades)}
+    if parts[:2] == ['marketplace', 'stats']:
+        rnd = _rng('discogs-st', parts[-1])
+        return 200, {'num_for_sale': rnd.randint(0, 80), 'lowest_price': {'currency': 'USD', 'value': round(rnd.uniform(3, 90), 2)},
+                     'blocked_from_sale': False}
+    return 404, {'message': 'The requested resource was not found.'}
+
+
+def rebrickable(path: str, qs: dict):
+    rnd = _rng('rebrickable', _first(qs, 'search'))
+    results = []
+    for i in range(rnd.randint(0, int(_first(qs, 'page_size', '10')))):
+        num = rnd.randint(1000, 99999)
+        results.append({'set_num': f'{num}-1', 'name': f"{_first(qs, 'search')} {i}", 'year': rnd.randint(1990, 2024),
+                        'theme_id': rnd.randint(1, 700), 'num_parts': rnd.randint(20, 7500),
+                        'set_img_url': f'https://cdn.rebrickable.com/media/sets/{num}-1.jpg'})
+    return 200, {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+
+def justtcg(path: str, qs: dict):
+    key = _first(qs, 'tcgplayerId') or _first(qs, 'q')
+    rnd = _rng('justtcg', key, _first(qs, 'condition'), _first(qs, 'printing'))
+    if rnd.random() < 0.1:
+        return 200, {'data': []}
+    variants = []
+    for i in range(rnd.randint(1, 6)):
+        price = round(rnd.uniform(0.5, 400), 2)
+        variants.append({'id': f'v{i}', 'printing': rnd.choice(['Normal', 'Foil']), 'condition': rnd.choice(['NM', 'LP', 'MP']),
+                         'language': 'English', 'price': price, 'low': round(price * 0.8, 2), 'high': round(price * 1.3, 2)})
+    return 200, {'data': [{'id': f'card-{key}', 'name': key, 'game': _first(qs, 'game') or 'pokemon', 'set_name': 'Base Set',
+                           'number': str(rnd.randint(1, 150)), 'tcgplayerId': str(rnd.randint(10**4, 10**6)), 'variants': variants}]}
+
+
+def _stockx_market(rnd) -> dict:
+    last = round(rnd.uniform(80, 900), 0)
+    return {'lastSale': last, 'lowestAsk': round(last * 1.08), 'highestBid': round(last * 0.9), 'deadstockSold': rnd.randint(10, 50000),
+            'volatility': round(rnd.uniform(0, 0.3), 3), 'pricePremium': round(rnd.uniform(-0.2, 2.0), 3)}
+
+
+def stockx_rapid(path: str, qs: dict):
+    if path.endswith('/search'):
+        rnd = _rng('stockx-s', _first(qs, 'query'))
+        return 200, {'data': [{'id': f'p{rnd.randint(1, 10**6)}', 'urlKey': _first(qs, 'query').lower().replace(' ', '-'),
+                               'name': _first(qs, 'query')}]}
+    if path.endswith('/product-details') or path.endswith('/product'):
+        rnd = _rng('stockx-d', _first(qs, 'productId') or _first(qs, 'urlKey'))
+        return 200, {'market': _stockx_market(rnd)}
+    return 404, {'message': 'not found'}
+
+
+def stockx_browse(path: str, qs: dict):
+    if path.endswith('/browse'):
+        q = _first(qs, '_search')
+        return 200, {'Products': [{'urlKey': q.lower().replace(' ', '-'), 'title': q}]}
+    if '/products/' in path:
+        rnd = _rng('stockx-p', path.rsplit('/', 1)[-1])
+        return 200, {'Product': {'market': _stockx_market(rnd)}}
+    return 404, {'message': 'not found'}
+
+
+ROUTES = [
+    ('/ebay/', 'ebay', ebay),
+    ('/pricecharting/api', 'pricecharting', pricecharting),
+    ('/discogs/', 'discogs', discogs),
+    ('/rebrickable/api/v3/lego/sets', 'rebrickable', rebrickable),
+    ('/justtcg/v1/cards', 'justtcg', justtcg),
+    ('/stockx-rapid/', 'stockx', stockx_rapid),
+    ('/stockx/api/', 'stockx', stockx_browse),
+]
+
+
+class Throttle():
+    """Token bucket per provider: oltre rps_limit richieste/s risponde 429."""
+
+    def __init__(self, rps_limit: float):
+        self.rps = rps_limit
+        self.tokens = {}
+        self.stamp = {}
+        self.lock = threading.Lock()
+
+    def allow(self, provider: str) -> bool:
+        if not self.rps:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.rps, self.tokens.get(provider, self.rps) + (now - self.stamp.get(provider, now)) * self.rps)
+            self.stamp[provider] = now
+            if tokens < 1:
+                self.tokens[provider] = tokens
+                return False
+            self.tokens[provider] = tokens - 1
+            return True
+
+
+def make_handler(latency_ms: float, jitter_ms: float, error_rate: float, throttle: Throttle, stats: dict):
+    rnd = random.Random(7)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if status == 429:
+                self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            qs = parse_qs(url.query)
+            for prefix, provider, fn in ROUTES:
+                if url.path.startswith(prefix):
+                    break
+            else:
+                return self._send(404, {'error': 'unknown provider'})
+            with lock:
+                stats[provider] = stats.get(provider, 0) + 1
+                delay = max(0.0, latency_ms + rnd.uniform(-jitter_ms, jitter_ms)) / 1000.0
+                fail = rnd.random() < error_rate
+            if not throttle.allow(provider):
+                return self._send(429, {'error': 'Too Many Requests'})
+            time.sleep(delay)
+            if fail:
+                return self._send(503, {'error': 'Service Unavailable (stub)'})
+            status, body = fn(url.path, qs)
+            self._send(status, body)
+
+    return Handler
+
+
+class StubServer(ThreadingHTTPServer):
+    # coda di listen ampia: i test con migliaia di chiamate in volo non devono perdere connessioni
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start(port: int = 0, latency_ms: float = 100, jitter_ms: float = 30, error_rate: float = 0.0, rps_limit: float = 0):
+    """Avvia gli stub in un thread; ritorna (server, base_url, stats)."""
+    stats = {}
+    handler = make_handler(latency_ms, jitter_ms, error_rate, Throttle(rps_limit), stats)
+    server = StubServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}', stats
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--latency-ms', type=float, default=100)
+    ap.add_argument('--jitter-ms', type=float, default=30)
+    ap.add_argument('--error-rate', type=float, default=0.0)
+    ap.add_argument('--rps-limit', type=float, default=0, help='richieste/s per provider prima del 429 (0 = nessun limite)')
+    ap.add_argument('--print-env', action='store_true', help="stampa gli export per puntare l'app agli stub ed esce")
+    args = ap.parse_args()
+    base = f'http://127.0.0.1:{args.port}'
+    if args.print_env:
+        for k, v in env_for(base).items():
+            print(f'export {k}={v}')
+        return
+    server, base, _ = start(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.rps_limit)
+    print(f'stub providers listening on {base}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -377,6 +377,43 @@ async function updateProfileStats() {
     }
 }
 
+// ETag dell'ultima risposta di /api/items (per query): se la collezione non è cambiata
+// il server risponde 304 e non serve né riscaricare né ri-renderizzare
+let itemsEtag = null;
+let itemsEtagQuery = null;
+
+// Copia locale della collezione (senza filtri) aggiornata via /api/items/changes
+const itemsCache = new Map();
+let itemsRev = 0;
+let itemsAsOf = null;
+let itemsCacheShown = false;
+
+async function syncItems() {
+    const since = itemsAsOf === new Date().toISOString().slice(0, 10) ? itemsRev : 0;
+    const res = await fetch(`/api/items/changes?since=${since}`, { cache: 'no-store' });
+    if (res.status === 401) {
+        window.location.href = '/';
+        return;
+    }
+    if (!res.ok) return;
+    const delta = await res.json();
+    if (delta.full) itemsCache.clear();
+    (delta.deleted || []).forEach(id => itemsCache.delete(id));
+    (delta.items || []).forEach(item => itemsCache.set(item.id, item));
+    const changed = delta.full || (delta.items || []).length || (delta.deleted || []).length;
+    itemsRev = delta.rev;
+    itemsAsOf = delta.as_of;
+    if (changed || !itemsCacheShown) {
+        const items = Array.from(itemsCache.values()).sort((a, b) => a.id - b.id);
+        renderItems(items);
+        populateCategories(items);
+        itemsCacheShown = true;
+        // a schermo c'è la lista completa: un 304 sulla query filtrata non basterebbe più
+        itemsEtag = null;
+        itemsEtagQuery = null;
+    }
+}
+
 async function fetchItems() {
     const searchInput = document.getElementById('searchInput');
     const categoryFilter = document.getElementById('categoryFilter');
@@ -385,10 +422,28 @@ async function fetchItems() {
     if (searchInput.value.trim()) params.append('q', searchInput.value.trim());
     if (categoryFilter.value) params.append('category', categoryFilter.value);
     if (tagFilter.value.trim()) params.append('tags', tagFilter.value.trim());
+    const query = params.toString();
+    if (!query) {
+        // Nessun filtro: sync incrementale della copia locale
+        try {
+            await syncItems();
+        } catch (err) {
+            console.error(err);
+        }
+        return;
+    }
+    itemsCacheShown = false;
+    const headers = {};
+    if (itemsEtag && itemsEtagQuery === query) headers['If-None-Match'] = itemsEtag;
     try {
-        const res = await fetch(`/api/items?${params.toString()}`);
+        const res = await fetch(`/api/items?${query}`, { headers, cache: 'no-store' });
+        if (res.status === 304) {
+            return;
+        }
         if (res.ok) {
             const items = await res.json();
+            itemsEtag = res.headers.get('ETag');
+            itemsEtagQuery = query;
             renderItems(items);
             populateCategories(items);
         } else if (res.status === 401) {